@@ -7,13 +7,19 @@
 # --------------------------------------------------------------------------
 import os
 import cv2
+import json
+import time
 import numpy as np
 import tensorflow as tf
+import numpy_utils as np_utils
 import tensorflow_utils as tf_utils
+from tf_profiler import LayerProfiler
 
 
 class ResNet18(object):
-    def __init__(self, data='01', num_attribute=6, mode=1, domain='xy', abs_path=None, name='ResNet18'):
+    def __init__(self, data='01', num_attribute=6, mode=1, domain='xy', abs_path=None, name='ResNet18',
+                 use_frozen_graph=False, model_name=None, sparse_fc=None, exit_threshold=None, binary_kernels=False,
+                 sparse_tiles=None, use_xla=False, batch_sizes=None, slim_checkpoint=None):
         self.data = data
         self.num_attribute = num_attribute
         self.mode = mode
@@ -22,8 +28,32 @@ class ResNet18(object):
         self.name = name
         self.resize_factor = 0.5
         self.layers = [2, 2, 2, 2]
+        self.filters = [64, 128, 256, 512]
+        self.inner_filters = None   # conv_0 widths of the residual blocks after channel pruning
+        self.fc_ranks = dict()      # ranks of the factorized FC layers
+        self.exit_heads = False
+        self.stem, self.stem_filters, self.head = 'conv7', 64, 'flatten'
+        self.block_type, self.expansion = 'basic', 4
+        self.binary_layers = 0      # 1: binary conv1, 2: binary conv1 and block_layer1
+        self.binary_output = None
+        self.binary_kernels = None  # XNOR/popcount kernels of the binary layers in numpy
+        self.sparse_tiles = sparse_tiles    # tile size on the block_layer1 grid of the sparse early layers
+        self.tile_layout = None
+        self.trunk_output = None
+        self.batch_sizes = sorted(batch_sizes) if batch_sizes is not None else list()
+        self.batch_graphs = dict()  # static-shape graphs of fixed batch sizes, {batch_size: (img_tfph, unnorm_preds)}
+        # Max. mean predicted std of an exit head to stop there. The log-variances are learned on the weighted errors
+        # of the normalized labels, 10x on X and Y (xy) or Ra and Rb (rarb) and 1x on the others. A std of 0.05 is
+        # 0.5% of the range of a main attribute and 5% of the range of the others
+        self.exit_threshold = exit_threshold
+        self.exit_inputs, self.exit_outputs = list(), list()
         self.small_value = 1e-7
-        self.sess = tf.compat.v1.Session()  # Initialize session
+        if use_xla:
+            tf_utils.enable_xla_cpu_jit()   # sets TF_XLA_FLAGS of the process, before the first session
+        self.sess = tf.compat.v1.Session(config=tf_utils.session_config(use_xla=use_xla))  # Initialize session
+        self.profiler = None
+        self.sparse_head = None
+        self.slim_params, self.slim_iter = None, None
 
         # Model should be fixed in here
         if self.data == '01':
@@ -52,7 +82,7 @@ class ResNet18(object):
                 self.model_dir = '20191222-230515'
             elif self.domain == 'rarb' and self.mode == 1:
                 self.model_dir = '20191222-230520'
-            else:
+            elif model_name is None:
                 exit(' [*] Data_02 only has mode 1!')
         elif self.data == '03':
             self.top_left = (15, 95)
@@ -73,13 +103,43 @@ class ResNet18(object):
                 elif self.mode == 2:
                     self.model_dir = "20191224-090714"
 
+        # A model folder other than the fixed ones, e.g. a unified model trained with --domain all
+        if model_name is not None:
+            self.model_dir = model_name
+        elif self.domain == 'all':
+            exit(' [!] The unified xy and rarb model needs model_name!')
+
         self.input_shape = (int(np.ceil(self.resize_factor * (self.bottom_right[0] - self.top_left[0]))),
                             int(np.ceil(self.resize_factor * (self.bottom_right[1] - self.top_left[1]))),
                             2 if self.mode == 0 else 1)
         self.model_dir = os.path.join(self.abs_path, self.model_dir)
 
-        self._read_min_max_info()
+        if slim_checkpoint is not None:
+            # Forward weights with their min/max values and config from dev_src/rg_slim.py, e.g. model_slim_fp16.npz
+            self.slim_params, meta = np_utils.load_slim_checkpoint(os.path.join(self.model_dir, slim_checkpoint))
+            self.min_values, self.max_values = meta['min_values'], meta['max_values']
+            self.slim_iter = meta['iter_time']
+            print('Min values: {}'.format(self.min_values))
+            print('Max values: {}'.format(self.max_values))
+            self._set_model_config(meta['config'])
+        else:
+            self._read_min_max_info()
+            self._read_model_config()
+
+        if use_frozen_graph:
+            # Folded inference graph exported by dev_src/rg_export.py
+            self._load_frozen_graph()
+            return
+
+        if sparse_fc is not None:
+            # CSR head exported by dev_src/rg_sparse.py, e.g. fc_sparse_90.npz
+            self.sparse_head = np_utils.load_sparse_head(os.path.join(self.model_dir, sparse_fc))
+
         self._build_graph()
+        if self.sparse_tiles is not None:
+            self._build_tile_graph()
+        if len(self.batch_sizes) > 0 and self.sparse_head is None:
+            self._build_batch_graphs()
 
         flag, iter_time = self.load_model()
         if flag is True:
@@ -87,15 +147,60 @@ class ResNet18(object):
         else:
             exit(' [!] Failed to restore model {}'.format(self.model_dir))
 
+        if binary_kernels and self.binary_layers > 0:
+            params = self.slim_params if self.slim_params is not None else tf_utils.read_checkpoint(
+                tf.train.get_checkpoint_state(self.model_dir).model_checkpoint_path, name=self.name)
+            self.binary_kernels = np_utils.prepare_binary_kernels(params, self.binary_layers, blocks=self.layers[0])
+
+        if self.sparse_tiles is not None:
+            # block_layer1 output of an empty frame fills the cells outside the active tiles
+            self.background_features = self.sess.run(self.trunk_output, feed_dict={
+                self.img_tfph: np.zeros((1, *self.input_shape), dtype=np.float32)})[0]
+            self.tile_layout = np_utils.sparse_tile_layout(self.input_shape[:2],
+                                                           kernel_size=(3 if self.stem == 'conv3' else 7),
+                                                           blocks=self.layers[0], tile_size=self.sparse_tiles)
+            self.reset_sparse_stats()
+
     def _init_variables(self):
         self.sess.run(tf.compat.v1.global_variables_initializer())
 
     def _build_graph(self):
         self.img_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, *self.input_shape])
 
+        if self.sparse_head is not None:
+            # The FC layers run with sparse matrix-vector kernels in numpy
+            self.features = self.forward_network(input_img=self.normalize_img(self.img_tfph), reuse=False,
+                                                 with_head=False)
+            return
+
         # Network forward for training
         self.preds = self.forward_network(input_img=self.normalize_img(self.img_tfph), reuse=False)
         self.unnorm_preds = self.unnormalize(self.preds)
+        self.reset_exit_stats()
+
+    def _build_tile_graph(self):
+        # Crops of any size around the active tiles share the weights of the early layers
+        self.tile_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, None, None, self.input_shape[2]])
+        self.tile_output = self.forward_trunk(input_img=self.normalize_img(self.tile_tfph), reuse=True)
+
+    def _build_batch_graphs(self):
+        # One copy of the network per batch size with the shapes known at graph construction, all share the weights
+        for batch_size in self.batch_sizes:
+            img_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[batch_size, *self.input_shape],
+                                                name='img_tfph_{}'.format(batch_size))
+            preds = self.forward_network(input_img=self.normalize_img(img_tfph), reuse=True)
+            self.batch_graphs[batch_size] = (img_tfph, self.unnormalize(preds))
+
+    def _load_frozen_graph(self, graph_name='inference_graph.pb'):
+        print(' [*] Reading frozen graph...')
+        graph_def = tf.compat.v1.GraphDef()
+        with tf.io.gfile.GFile(os.path.join(self.model_dir, graph_name), 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        tf.compat.v1.import_graph_def(graph_def, name='')
+        self.img_tfph = self.sess.graph.get_tensor_by_name('img_tfph:0')
+        self.unnorm_preds = self.sess.graph.get_tensor_by_name('unnorm_preds:0')
+        print(' [!] Load Success! {}'.format(graph_name))
 
     def predict(self, left_img=None, right_img=None):
         if self.mode == 0:      # left and right images
@@ -107,58 +212,292 @@ class ResNet18(object):
 
         # Preprocessing
         pre_img = self.preprocessing(left_img, right_img)
-        output = self.sess.run(self.unnorm_preds, feed_dict={self.img_tfph: np.expand_dims(pre_img, axis=0)})
+        feed = {self.img_tfph: np.expand_dims(pre_img, axis=0)}
+        fetch = self.unnorm_preds if self.sparse_head is None else self.features
+
+        if self.binary_kernels is not None:
+            # The binary layers run with XNOR and popcount in numpy, TF continues from their output
+            feed = {self.binary_output: np.expand_dims(np_utils.binary_trunk_forward(
+                pre_img, self.binary_kernels, self.binary_layers, blocks=self.layers[0]), axis=0)}
+        elif self.tile_layout is not None:
+            feed = self.sparse_feed(pre_img, feed)
+        elif 1 in self.batch_graphs and self.exit_threshold is None:
+            img_tfph, fetch = self.batch_graphs[1]
+            feed = {img_tfph: feed[self.img_tfph]}
+
+        if self.exit_threshold is not None and len(self.exit_outputs) > 0:
+            return self.predict_early_exit(feed)[0]
+
+        if self.profiler is None:
+            output = self.sess.run(fetch, feed_dict=feed)
+        else:
+            output = self.profiler.run(fetch, feed_dict=feed)
+
+        if self.sparse_head is not None:
+            output = self.unnormalize_prediction(np_utils.sparse_head_forward(self.sparse_head, output))
         return output[0]
 
-    def forward_network(self, input_img, reuse=False):
+    def predict_batch(self, left_imgs=None, right_imgs=None):
+        # Frames of one request, e.g. a replayed sequence, in as few runs as the batch variants allow
+        num_imgs = len(left_imgs) if left_imgs is not None else len(right_imgs)
+        pre_imgs = np.asarray([self.preprocessing(left_imgs[idx] if left_imgs is not None else None,
+                                                  right_imgs[idx] if right_imgs is not None else None)
+                               for idx in range(num_imgs)])
+        return self.run_batch(pre_imgs)
+
+    def run_batch(self, pre_imgs):
+        if self.sparse_head is not None:
+            # The sparse head has no static-shape variants, the trunk runs on the dynamic-shape graph
+            features = self.sess.run(self.features, feed_dict={self.img_tfph: pre_imgs})
+            return self.unnormalize_prediction(np_utils.sparse_head_forward(self.sparse_head, features))
+
+        if len(self.batch_graphs) == 0:
+            return self.sess.run(self.unnorm_preds, feed_dict={self.img_tfph: pre_imgs})
+
+        # Chunks of the largest variant, the rest goes to the smallest variant that fits and is padded with background
+        outputs, max_size = list(), max(self.batch_graphs)
+        for start in range(0, pre_imgs.shape[0], max_size):
+            chunk = pre_imgs[start:start + max_size]
+            batch_size = min(size for size in self.batch_graphs if size >= chunk.shape[0])
+            img_tfph, unnorm_preds = self.batch_graphs[batch_size]
+
+            imgs = np.zeros((batch_size, *self.input_shape), dtype=np.float32)
+            imgs[:chunk.shape[0]] = chunk
+            outputs.append(self.sess.run(unnorm_preds, feed_dict={img_tfph: imgs})[:chunk.shape[0]])
+
+        return np.concatenate(outputs, axis=0)
+
+    def batch_report(self, left_img=None, right_img=None, num_runs=100):
+        # Latency of the dynamic-shape graph and of the static-shape variant of every batch size
+        pre_img = self.preprocessing(left_img, right_img)
+        print(' [*] {:>6}{:>14}{:>13}{:>9}{:>16}'.format('Batch', 'Dynamic(ms)', 'Static(ms)', 'Speedup',
+                                                          'Static/frame(ms)'))
+        for batch_size, (img_tfph, unnorm_preds) in sorted(self.batch_graphs.items()):
+            imgs = np.repeat(np.expand_dims(pre_img, axis=0), batch_size, axis=0)
+            times = list()
+            for fetch, feed in [(self.unnorm_preds, {self.img_tfph: imgs}), (unnorm_preds, {img_tfph: imgs})]:
+                self.sess.run(fetch, feed_dict=feed)  # warm-up
+                tic = time.time()
+                for _ in range(num_runs):
+                    self.sess.run(fetch, feed_dict=feed)
+                times.append((time.time() - tic) / num_runs * 1000.)
+
+            print(' [*] {:>6}{:>14.3f}{:>13.3f}{:>8.2f}x{:>16.3f}'.format(
+                batch_size, times[0], times[1], times[0] / times[1], times[1] / batch_size))
+
+    def predict_early_exit(self, feed):
+        # Stops at the first exit head that is confident enough, the next stage continues from the fed features of
+        # the previous one, so no layer runs twice
+        frame_tic = time.time()
+        for idx, (exit_input, (preds, log_vars)) in enumerate(zip(self.exit_inputs, self.exit_outputs)):
+            tic = time.time()
+            features, exit_preds, exit_log_vars = self.sess.run([exit_input, preds, log_vars], feed_dict=feed)
+            self.stage_times[idx].append((time.time() - tic) * 1000.)
+
+            # Mean std of the weighted errors of all attributes, the same scale as the exit loss of the training
+            if np.mean(np.exp(0.5 * exit_log_vars)) < self.exit_threshold:
+                self.exit_counts[idx] += 1
+                self.frame_times.append((time.time() - frame_tic) * 1000.)
+                return self.unnormalize_prediction(exit_preds)
+
+            feed = {exit_input: features}
+
+        tic = time.time()
+        output = self.sess.run(self.unnorm_preds, feed_dict=feed)
+        self.stage_times[-1].append((time.time() - tic) * 1000.)
+        self.exit_counts[-1] += 1
+        self.frame_times.append((time.time() - frame_tic) * 1000.)
+        return output
+
+    def sparse_feed(self, pre_img, feed):
+        # Early layers only on the crops around the contact, falls back to the dense frame if the crops are larger
+        tic = time.time()
+        tiles = np_utils.active_tiles(pre_img, self.tile_layout)
+        groups = np_utils.gather_tiles(pre_img, tiles, self.tile_layout)
+        self.tile_fractions.append(len(tiles) / self.tile_layout['num_tiles'])
+
+        if sum(crops.size for _, crops in groups) >= pre_img.size:
+            self.sparse_counts['dense'] += 1
+            return feed
+
+        features = self.background_features.copy()
+        for group_tiles, crops in groups:
+            outputs = self.sess.run(self.tile_output, feed_dict={self.tile_tfph: crops})
+            np_utils.scatter_tiles(features, group_tiles, outputs, self.tile_layout)
+
+        self.sparse_counts['sparse' if len(tiles) > 0 else 'empty'] += 1
+        self.trunk_times.append((time.time() - tic) * 1000.)
+        return {self.trunk_output: np.expand_dims(features, axis=0)}
+
+    def reset_sparse_stats(self):
+        self.sparse_counts = {'empty': 0, 'sparse': 0, 'dense': 0}
+        self.tile_fractions, self.trunk_times = list(), list()
+
+    def sparse_report(self):
+        num_frames = sum(self.sparse_counts.values())
+        if num_frames == 0:
+            print(' [!] No sparse predictions yet!')
+            return
+
+        for name, count in self.sparse_counts.items():
+            print(' [*] {:>6}: {:>6} frames ({:.2%})'.format(name, count, count / num_frames))
+        print(' [*] Avg. active tiles: {:.2%} of {} tiles'.format(np.mean(self.tile_fractions),
+                                                                 self.tile_layout['num_tiles']))
+        if len(self.trunk_times) > 0:
+            print(' [*] Avg. sparse early layers: {:.3f} msec'.format(np.mean(self.trunk_times)))
+
+    def reset_exit_stats(self):
+        num_stages = len(self.exit_outputs) + 1
+        self.exit_counts = [0] * num_stages
+        self.stage_times = [list() for _ in range(num_stages)]
+        self.frame_times = list()
+
+    def exit_report(self):
+        num_frames = sum(self.exit_counts)
+        if num_frames == 0:
+            print(' [!] No early-exit predictions yet!')
+            return
+
+        for idx, count in enumerate(self.exit_counts):
+            name = 'exit{}'.format(idx + 1) if idx < len(self.exit_outputs) else 'final'
+            print(' [*] {:>6}: {:>6} frames ({:.2%})'.format(name, count, count / num_frames))
+
+        # Latency of a frame that runs through all stages from the measured time of each stage
+        if all(len(times) > 0 for times in self.stage_times):
+            full_time = sum(np.mean(times) for times in self.stage_times)
+            print(' [*] Avg. latency: {:.3f} msec, all stages: {:.3f} msec, saved: {:.3f} msec'.format(
+                np.mean(self.frame_times), full_time, full_time - np.mean(self.frame_times)))
+        else:
+            print(' [*] Avg. latency: {:.3f} msec'.format(np.mean(self.frame_times)))
+
+    def profile(self, left_img=None, right_img=None, num_runs=100, num_warmup=10, save_folder='../profile'):
+        # Warm-up runs are not traced
+        for _ in range(num_warmup):
+            self.predict(left_img=left_img, right_img=right_img)
+
+        self.profiler = LayerProfiler(sess=self.sess, name=self.name)
+        for _ in range(num_runs):
+            self.predict(left_img=left_img, right_img=right_img)
+
+        self.profiler.write_report(save_folder=save_folder, prefix='predict_data_{}_{}_mode_{}'.format(
+            self.data, self.domain, self.mode))
+        self.profiler = None
+
+    def forward_trunk(self, input_img, reuse=False):
+        # conv1, max pooling and block_layer1, the layers of the sparse path
+        block_fn = {'basic': self.bottleneck_block,
+                    'separable': self.separable_block,
+                    'inverted_residual': self.inverted_residual_block}[self.block_type]
+
+        with tf.compat.v1.variable_scope(self.name, reuse=reuse):
+            if self.binary_layers >= 1:
+                input_img = tf_utils.binarize(input_img, name='binarize_input')
+            inputs = self.conv2d_fixed_padding(inputs=input_img, filters=self.stem_filters,
+                                               kernel_size=(3 if self.stem == 'conv3' else 7), strides=1, name='conv1')
+            inputs = tf_utils.max_pool(inputs, name='3x3_maxpool', ksize=[1, 3, 3, 1], strides=[1, 2, 2, 1],
+                                       logger=None)
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[0], block_fn=block_fn,
+                                      blocks=self.layers[0], strides=1, train_mode=False, name='block_layer1',
+                                      inner_filters=self.inner_filters[0] if self.inner_filters else None)
+        return inputs
+
+    def forward_network(self, input_img, reuse=False, with_head=True):
+        block_fn = {'basic': self.bottleneck_block,
+                    'separable': self.separable_block,
+                    'inverted_residual': self.inverted_residual_block}[self.block_type]
+
         with tf.compat.v1.variable_scope(self.name, reuse=reuse):
             tf_utils.print_activations(input_img, logger=None)
-            inputs = self.conv2d_fixed_padding(inputs=input_img, filters=64, kernel_size=7, strides=1, name='conv1')
+            if self.binary_layers >= 1:
+                input_img = tf_utils.binarize(input_img, name='binarize_input')
+            inputs = self.conv2d_fixed_padding(inputs=input_img, filters=self.stem_filters,
+                                               kernel_size=(3 if self.stem == 'conv3' else 7), strides=1, name='conv1')
+            if self.binary_layers == 1 and not reuse:
+                self.binary_output = inputs
             inputs = tf_utils.max_pool(inputs, name='3x3_maxpool', ksize=[1, 3, 3, 1], strides=[1, 2, 2, 1],
                                        logger=None)
 
-            inputs = self.block_layer(inputs=inputs, filters=64, block_fn=self.bottleneck_block, blocks=self.layers[0],
-                                      strides=1, train_mode=False, name='block_layer1')
-            inputs = self.block_layer(inputs=inputs, filters=128, block_fn=self.bottleneck_block, blocks=self.layers[1],
-                                      strides=2, train_mode=False, name='block_layer2')
-            inputs = self.block_layer(inputs=inputs, filters=256, block_fn=self.bottleneck_block, blocks=self.layers[2],
-                                      strides=2, train_mode=False, name='block_layer3')
-            inputs = self.block_layer(inputs=inputs, filters=512, block_fn=self.bottleneck_block, blocks=self.layers[3],
-                                      strides=2, train_mode=False, name='block_layer4')
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[0], block_fn=block_fn,
+                                      blocks=self.layers[0], strides=1, train_mode=False, name='block_layer1',
+                                      inner_filters=self.inner_filters[0] if self.inner_filters else None)
+            # Intermediate outputs fed by the binary, sparse and early-exit paths belong to the first graph only
+            if self.binary_layers == 2 and not reuse:
+                self.binary_output = inputs
+            if not reuse:
+                self.trunk_output = inputs
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[1], block_fn=block_fn,
+                                      blocks=self.layers[1], strides=2, train_mode=False, name='block_layer2',
+                                      inner_filters=self.inner_filters[1] if self.inner_filters else None)
+            if self.exit_heads and with_head and not reuse:
+                self.exit_inputs.append(inputs)
+                self.exit_outputs.append(self.exit_head(inputs, name='exit1'))
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[2], block_fn=block_fn,
+                                      blocks=self.layers[2], strides=2, train_mode=False, name='block_layer3',
+                                      inner_filters=self.inner_filters[2] if self.inner_filters else None)
+            if self.exit_heads and with_head and not reuse:
+                self.exit_inputs.append(inputs)
+                self.exit_outputs.append(self.exit_head(inputs, name='exit2'))
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[3], block_fn=block_fn,
+                                      blocks=self.layers[3], strides=2, train_mode=False, name='block_layer4',
+                                      inner_filters=self.inner_filters[3] if self.inner_filters else None)
 
             inputs = tf_utils.relu(inputs, name='before_flatten_relu', logger=None)
+            if self.head == 'gap':
+                _, h, w, _ = inputs.get_shape().as_list()
+                inputs = tf_utils.avg_pool(inputs, name='gap', ksize=[1, h, w, 1], strides=[1, 1, 1, 1], logger=None)
 
             # Flatten & FC1
             inputs = tf_utils.flatten(inputs, name='flatten', logger=None)
-            inputs = tf_utils.linear(inputs, 512, name='FC1')
+            if not with_head:
+                return inputs
+
+            inputs = tf_utils.linear(inputs, 512, name='FC1', rank=self.fc_ranks.get('FC1'))
             inputs = tf_utils.relu(inputs, name='FC1_relu', logger=None)
 
-            inputs = tf_utils.linear(inputs, 256, name='FC2')
+            inputs = tf_utils.linear(inputs, 256, name='FC2', rank=self.fc_ranks.get('FC2'))
             inputs = tf_utils.relu(inputs, name='FC2_relu', logger=None)
 
             logits = tf_utils.linear(inputs, self.num_attribute, name='Out')
             return logits
 
-    def block_layer(self, inputs, filters, block_fn, blocks, strides, train_mode, name):
+    def exit_head(self, inputs, name):
+        with tf.compat.v1.variable_scope(name):
+            inputs = tf_utils.relu(inputs, name='relu', logger=None)
+            inputs = tf.math.reduce_mean(inputs, axis=[1, 2], name='gap')
+            inputs = tf_utils.linear(inputs, 128, name='FC1')
+            inputs = tf_utils.relu(inputs, name='FC1_relu', logger=None)
+
+            preds = tf_utils.linear(inputs, self.num_attribute, name='Out')
+            log_vars = tf_utils.linear(inputs, self.num_attribute, name='Log_var')
+
+        return preds, log_vars
+
+    def block_layer(self, inputs, filters, block_fn, blocks, strides, train_mode, name, inner_filters=None):
+        if inner_filters is None:
+            inner_filters = [None] * blocks     # stage width, filters * expansion for the inverted residual blocks
+
         # Only the first block per block_layer uses projection_shortcut and strides
-        inputs = block_fn(inputs, filters, train_mode, self.projection_shortcut, strides, name + '_1')
+        inputs = block_fn(inputs, filters, train_mode, self.projection_shortcut, strides, name + '_1',
+                          inner_filters=inner_filters[0])
 
         for num_iter in range(1, blocks):
-            inputs = block_fn(inputs, filters, train_mode, None, 1, name=(name + '_' + str(num_iter + 1)))
+            inputs = block_fn(inputs, filters, train_mode, None, 1, name=(name + '_' + str(num_iter + 1)),
+                              inner_filters=inner_filters[num_iter])
 
         return tf.identity(inputs, name)
 
-    def bottleneck_block(self, inputs, filters, train_mode, projection_shortcut, strides, name):
+    def bottleneck_block(self, inputs, filters, train_mode, projection_shortcut, strides, name, inner_filters=None):
         with tf.compat.v1.variable_scope(name):
             shortcut = inputs
-            inputs = tf_utils.relu(inputs, name='relu_0', logger=None)
+            inputs = self.activation(inputs, name='relu_0')
 
             # The projection shortcut shouldcome after the first batch norm and ReLU since it perofrms a 1x1 convolution.
             if projection_shortcut is not None:
                 shortcut = self.projection_shortcut(inputs=inputs, filters_out=filters, strides=strides, name='conv_projection')
 
-            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=3, strides=strides, name='conv_0')
-            inputs = tf_utils.relu(inputs, name='relu_1', logger=None)
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=inner_filters or filters, kernel_size=3,
+                                               strides=strides, name='conv_0')
+            inputs = self.activation(inputs, name='relu_1')
             inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=3, strides=1, name='conv_1')
 
             output = tf.identity(inputs + shortcut, name=(name + '_output'))
@@ -166,11 +505,55 @@ class ResNet18(object):
 
             return output
 
+    def separable_block(self, inputs, filters, train_mode, projection_shortcut, strides, name, inner_filters=None):
+        with tf.compat.v1.variable_scope(name):
+            shortcut = inputs
+            inputs = tf_utils.relu(inputs, name='relu_0', logger=None)
+
+            if projection_shortcut is not None:
+                shortcut = self.projection_shortcut(inputs=inputs, filters_out=filters, strides=strides, name='conv_projection')
+
+            inputs = self.depthwise_conv2d_fixed_padding(inputs=inputs, kernel_size=3, strides=strides, name='dw_conv_0')
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=inner_filters or filters, kernel_size=1, strides=1,
+                                               name='conv_0')
+            inputs = tf_utils.relu(inputs, name='relu_1', logger=None)
+            inputs = self.depthwise_conv2d_fixed_padding(inputs=inputs, kernel_size=3, strides=1, name='dw_conv_1')
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=1, strides=1, name='conv_1')
+
+            output = tf.identity(inputs + shortcut, name=(name + '_output'))
+            tf_utils.print_activations(output, logger=None)
+
+            return output
+
+    def inverted_residual_block(self, inputs, filters, train_mode, projection_shortcut, strides, name,
+                                inner_filters=None):
+        with tf.compat.v1.variable_scope(name):
+            shortcut = inputs
+
+            if projection_shortcut is not None:
+                shortcut = self.projection_shortcut(inputs=inputs, filters_out=filters, strides=strides, name='conv_projection')
+
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=inner_filters or filters * self.expansion,
+                                               kernel_size=1, strides=1, name='conv_0')
+            inputs = tf_utils.relu(inputs, name='relu_1', logger=None)
+            inputs = self.depthwise_conv2d_fixed_padding(inputs=inputs, kernel_size=3, strides=strides, name='dw_conv')
+            inputs = tf_utils.relu(inputs, name='relu_2', logger=None)
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=1, strides=1, name='conv_1')
+
+            output = tf.identity(inputs + shortcut, name=(name + '_output'))
+            tf_utils.print_activations(output, logger=None)
+
+            return output
+
     def projection_shortcut(self, inputs, filters_out, strides, name):
         inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters_out, kernel_size=1, strides=strides, name=name)
         return inputs
 
     def conv2d_fixed_padding(self, inputs, filters, kernel_size, strides, name):
+        if self.is_binary(name):
+            return tf_utils.binary_conv2d(inputs, output_dim=filters, k_h=kernel_size, k_w=kernel_size, d_h=strides,
+                                          d_w=strides, initializer='He', name=name, logger=None)
+
         if strides > 1:
             inputs = self.fixed_padding(inputs, kernel_size)
 
@@ -179,6 +562,27 @@ class ResNet18(object):
                                  padding=('SAME' if strides == 1 else 'VALID'), logger=None)
         return inputs
 
+    def is_binary(self, name):
+        # conv1 for binary_layers >= 1, all layers of block_layer1 for binary_layers >= 2
+        scope = tf.compat.v1.get_variable_scope().name.split('/')
+        if len(scope) == 1:
+            return (self.binary_layers >= 1) and (name == 'conv1')
+        return (self.binary_layers >= 2) and scope[1].startswith('block_layer1_')
+
+    def activation(self, inputs, name):
+        if self.is_binary(name):
+            return tf_utils.binarize(inputs, name=name)
+        return tf_utils.relu(inputs, name=name, logger=None)
+
+    def depthwise_conv2d_fixed_padding(self, inputs, kernel_size, strides, name):
+        if strides > 1:
+            inputs = self.fixed_padding(inputs, kernel_size)
+
+        inputs = tf_utils.depthwise_conv2d(inputs, k_h=kernel_size, k_w=kernel_size, d_h=strides, d_w=strides,
+                                           initializer='He', name=name, padding=('SAME' if strides == 1 else 'VALID'),
+                                           logger=None)
+        return inputs
+
     @staticmethod
     def fixed_padding(inputs, kernel_size):
         pad_total = kernel_size - 1
@@ -194,6 +598,9 @@ class ResNet18(object):
     def unnormalize(self, data):
         return tf.maximum(data, 0.) * (self.max_values - self.min_values + self.small_value) + self.min_values
 
+    def unnormalize_prediction(self, data):
+        return np.maximum(data, 0.) * (self.max_values - self.min_values + self.small_value) + self.min_values
+
     def preprocessing(self, left_img=None, right_img=None, resize_factor=0.5,
                       binarize_threshold=55.):
         imgs = list()
@@ -227,8 +634,18 @@ class ResNet18(object):
         return input_img
 
     def _read_min_max_info(self):
-        print(os.path.join('../data', 'rg_' + self.domain + '_train_' + self.data + '.npy'))
-        min_max_data = np.load(os.path.join('../data', 'rg_' + self.domain + '_train_' + self.data + '.npy'))
+        domains = ['xy', 'rarb'] if self.domain == 'all' else [self.domain]
+        domain_min_max_data = list()
+        for domain in domains:
+            print(os.path.join('../data', 'rg_' + domain + '_train_' + self.data + '.npy'))
+            domain_min_max_data.append(np.load(os.path.join('../data', 'rg_' + domain + '_train_' + self.data + '.npy')))
+
+        # The unified model uses the joint min and max values of both domains
+        domain_min_max_data = np.asarray(domain_min_max_data)
+        min_max_data = np.zeros(domain_min_max_data.shape[1], dtype=domain_min_max_data.dtype)
+        min_max_data[0::2] = np.min(domain_min_max_data[:, 0::2], axis=0)
+        min_max_data[1::2] = np.max(domain_min_max_data[:, 1::2], axis=0)
+
         self.x_min = min_max_data[0]
         self.x_max = min_max_data[1]
         self.y_min = min_max_data[2]
@@ -247,7 +664,39 @@ class ResNet18(object):
         print('Min values: {}'.format(self.min_values))
         print('Max values: {}'.format(self.max_values))
 
+    def _read_model_config(self):
+        # Architecture written by rg_main, e.g. a distilled student with fewer blocks and narrower widths
+        config_path = os.path.join(self.model_dir, 'model_config.json')
+        config = dict()
+        if os.path.isfile(config_path):
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+
+        self._set_model_config(config)
+
+    def _set_model_config(self, config):
+        self.layers = config.get('layers', self.layers)
+        self.filters = config.get('filters', self.filters)
+        self.inner_filters = config.get('inner_filters', self.inner_filters)
+        self.fc_ranks = config.get('fc_ranks', self.fc_ranks)
+        self.exit_heads = config.get('exit_heads', self.exit_heads)
+        self.stem = config.get('stem', self.stem)
+        self.stem_filters = config.get('stem_filters', self.stem_filters)
+        self.head = config.get('head', self.head)
+        self.block_type = config.get('block_type', self.block_type)
+        self.expansion = config.get('expansion', self.expansion)
+        self.binary_layers = config.get('binary_layers', self.binary_layers)
+        print('Layers: {}, Filters: {}, Inner filters: {}'.format(self.layers, self.filters, self.inner_filters))
+
     def load_model(self):
+        if self.slim_params is not None:
+            print(' [*] Reading slim checkpoint...')
+            self.sess.run(tf.compat.v1.global_variables_initializer())
+            num_variables = len([variable for variable in tf.compat.v1.global_variables()
+                                 if variable.op.name.startswith(self.name + '/')])
+            num_assigned = tf_utils.assign_variables(self.sess, self.slim_params, name=self.name)
+            return num_assigned == num_variables, self.slim_iter
+
         saver = tf.compat.v1.train.Saver(max_to_keep=1)  # Initialize saver
         print(' [*] Reading checkpoint...')
 
@@ -281,6 +730,14 @@ def main(left_path, right_path):
     # Initialize model
     model = ResNet18(data='01', mode=1, domain='xy', abs_path='../model')
     pred = model.predict(left_img=left_img, right_img=None)
+    # model = ResNet18(..., slim_checkpoint='model_slim_fp16.npz')  # inference-only weights of dev_src/rg_slim.py
+    # model = ResNet18(..., binary_kernels=True)  # numpy XNOR kernels of a model trained with --binary_layers
+    # model = ResNet18(..., use_xla=True)  # XLA JIT and aggressive Grappler passes
+    # model = ResNet18(..., batch_sizes=(1, 2, 8, 32))  # static-shape graphs, see model.batch_report(left_img)
+    # model = ResNet18(..., sparse_tiles=16)  # early layers only on the 16x16 tiles around the contact
+    # model.sparse_report()
+    # model.exit_report()  # exit fractions and saved latency of a model trained with --exit_heads and exit_threshold
+    # model.profile(left_img=left_img, right_img=None, num_runs=100)  # per-layer latency report in ../profile
 
     print('\nPrediction!')
     print('X:  {:.3f}'.format(pred[0]))
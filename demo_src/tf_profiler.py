@@ -0,0 +1,123 @@
+# ---------------------------------------------------------
+# Tensorflow Profiler Implementation
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# ---------------------------------------------------------
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class LayerProfiler(object):
+    """Measured per-scope CPU latency of a graph collected from RunMetadata step stats."""
+    def __init__(self, sess, name='ResNet18'):
+        self.sess = sess
+        self.name = name    # variable scope of the model, e.g. ResNet18/conv1/... -> conv1
+        self.run_options = tf.compat.v1.RunOptions(trace_level=tf.compat.v1.RunOptions.FULL_TRACE)
+        self.reset()
+
+    def reset(self):
+        self.wall_times = list()
+        self.scope_times = list()
+        self.op_type_times = list()
+        self.step_stats = list()
+
+    @property
+    def num_runs(self):
+        return len(self.wall_times)
+
+    def run(self, fetches, feed_dict=None):
+        run_metadata = tf.compat.v1.RunMetadata()
+
+        tic = time.time()
+        outputs = self.sess.run(fetches, feed_dict=feed_dict, options=self.run_options, run_metadata=run_metadata)
+        self.wall_times.append((time.time() - tic) * 1000.)
+
+        scope_time, op_type_time = self.parse_step_stats(run_metadata.step_stats)
+        self.scope_times.append(scope_time)
+        self.op_type_times.append(op_type_time)
+        self.step_stats.append(run_metadata.step_stats)
+
+        return outputs
+
+    def profile(self, fetches, feed_dict=None, num_runs=100, num_warmup=10):
+        for _ in range(num_warmup):
+            self.sess.run(fetches, feed_dict=feed_dict)
+
+        for _ in range(num_runs):
+            self.run(fetches, feed_dict=feed_dict)
+
+        return self.hotspots()
+
+    def parse_step_stats(self, step_stats):
+        scope_time, op_type_time = dict(), dict()
+
+        for dev_stats in step_stats.dev_stats:
+            # GPU devices report every kernel twice (per stream and stream:all)
+            if 'stream:all' in dev_stats.device:
+                continue
+
+            for node_stats in dev_stats.node_stats:
+                if node_stats.node_name.startswith('_'):    # _SOURCE, _retval, ...
+                    continue
+
+                duration = node_stats.all_end_rel_micros / 1000.
+                scope = self.scope_of(node_stats.node_name)
+                op_type = node_stats.timeline_label.split('(')[0].split('=')[-1].strip() \
+                    if node_stats.timeline_label else node_stats.node_name.split(':')[0].split('/')[-1]
+
+                scope_time[scope] = scope_time.get(scope, 0.) + duration
+                op_type_time[op_type] = op_type_time.get(op_type, 0.) + duration
+
+        return scope_time, op_type_time
+
+    def scope_of(self, node_name):
+        parts = node_name.split(':')[0].split('/')
+        if parts[0] == self.name and len(parts) > 1:
+            return parts[1]
+        return parts[0]
+
+    def hotspots(self, key='scope'):
+        records = self.scope_times if key == 'scope' else self.op_type_times
+        names = sorted(set(name for record in records for name in record))
+
+        rows = list()
+        for name in names:
+            values = np.asarray([record.get(name, 0.) for record in records], dtype=np.float64)
+            rows.append((name, np.mean(values), np.percentile(values, 95)))
+
+        total = sum(row[1] for row in rows) + 1e-12
+        rows = [(name, mean, p95, mean / total) for name, mean, p95 in rows]
+
+        return sorted(rows, key=lambda row: row[1], reverse=True)
+
+    def write_report(self, save_folder, prefix='profile', logger=None):
+        if not os.path.isdir(save_folder):
+            os.makedirs(save_folder)
+
+        lines = list()
+        lines.append('Num. of runs: {}, Wall time mean: {:.3f} msec, p95: {:.3f} msec'.format(
+            self.num_runs, np.mean(self.wall_times), np.percentile(self.wall_times, 95)))
+
+        for key in ['scope', 'op_type']:
+            lines.append('')
+            lines.append('{:>4}  {:<32}{:>12}{:>12}{:>9}'.format('Rank', key, 'Mean(ms)', 'p95(ms)', 'Share'))
+            for rank, (name, mean, p95, share) in enumerate(self.hotspots(key=key)):
+                lines.append('{:>4}  {:<32}{:>12.3f}{:>12.3f}{:>9.2%}'.format(rank + 1, name, mean, p95, share))
+
+        with open(os.path.join(save_folder, prefix + '_hotspots.txt'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        # Chrome trace of the run closest to the median latency, open with chrome://tracing
+        median_idx = int(np.argsort(self.wall_times)[self.num_runs // 2])
+        trace = timeline.Timeline(self.step_stats[median_idx]).generate_chrome_trace_format()
+        with open(os.path.join(save_folder, prefix + '_timeline.json'), 'w') as f:
+            f.write(trace)
+
+        for line in lines:
+            if logger is None:
+                print(line)
+            else:
+                logger.info(line)
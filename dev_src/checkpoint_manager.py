@@ -0,0 +1,157 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Background checkpointing with top-k retention and the resume state of the training
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import glob
+import json
+import queue
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+RESUME_FOLDER = 'resume'                # latest state of the training in <model_dir>/resume
+RESUME_STATE_FILE = 'resume_state.json'
+RECORDS_FILE = 'checkpoint_records.json'
+
+
+class CheckpointManager(object):
+    """Variables are copied in the training thread and written to disk by a background thread."""
+    def __init__(self, sess, model_dir, max_to_keep=1, name='model'):
+        self.sess = sess
+        self.model_dir = model_dir
+        self.resume_dir = os.path.join(model_dir, RESUME_FOLDER)
+        self.max_to_keep = max_to_keep
+        self.name = name
+        self.variables = tf.compat.v1.global_variables()
+        self.records = read_json(os.path.join(self.model_dir, RECORDS_FILE), default=list())    # [[avg_err, iter]]
+
+        if not os.path.isdir(self.resume_dir):
+            os.makedirs(self.resume_dir)
+
+        self._build_writer()
+        self.queue = queue.Queue(maxsize=1)     # at most one snapshot waits, the memory stays bounded
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _build_writer(self):
+        # Copies of the variables in a separate graph, the background saves do not use the training session
+        self.writer_graph = tf.Graph()
+        with self.writer_graph.as_default():
+            self.writer_variables = [tf.compat.v1.Variable(tf.zeros(variable.get_shape(),
+                                                                    dtype=variable.dtype.base_dtype),
+                                                           name=variable.op.name, trainable=False)
+                                     for variable in self.variables]
+            self.writer_saver = tf.compat.v1.train.Saver(var_list=self.writer_variables, max_to_keep=None)
+            self.writer_sess = tf.compat.v1.Session(graph=self.writer_graph,
+                                                    config=tf.compat.v1.ConfigProto(device_count={'GPU': 0}))
+
+    def is_top_k(self, avg_err):
+        return (len(self.records) < self.max_to_keep) or (avg_err < max(record[0] for record in self.records))
+
+    def save(self, iter_time, avg_err):
+        # Best checkpoints in the model folder, the demo loader restores the one with the lowest error
+        if not self.is_top_k(avg_err):
+            return False
+
+        self.records = sorted(self.records + [[float(avg_err), int(iter_time)]])[:self.max_to_keep]
+        self.queue.put(('best', iter_time, self.sess.run(self.variables), list(self.records)))
+        return True
+
+    def save_resume(self, iter_time, state, block=False):
+        self.queue.put(('resume', iter_time, self.sess.run(self.variables), dict(state, iter_time=int(iter_time))))
+        if block:
+            self.wait()
+
+    def wait(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer_sess.close()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            try:
+                kind, iter_time, values, info = item
+                for variable, value in zip(self.writer_variables, values):
+                    variable.load(value, self.writer_sess)
+
+                if kind == 'best':
+                    self._write_best(iter_time, info)
+                else:
+                    self._write_resume(iter_time, info)
+            except Exception as e:
+                print(' [!] Failed to write checkpoint: {}'.format(e))
+            finally:
+                self.queue.task_done()
+
+    def _write_best(self, iter_time, records):
+        self.writer_saver.save(self.writer_sess, os.path.join(self.model_dir, self.name), global_step=iter_time,
+                               write_state=False)
+
+        kept = [self.name + '-{}'.format(record[1]) for record in records]
+        remove_checkpoints(self.model_dir, self.name, keep=kept)
+        tf.compat.v1.train.update_checkpoint_state(self.model_dir, kept[0], all_model_checkpoint_paths=kept)
+        write_json(os.path.join(self.model_dir, RECORDS_FILE), records)
+
+    def _write_resume(self, iter_time, state):
+        path = self.name + '-{}'.format(iter_time)
+        self.writer_saver.save(self.writer_sess, os.path.join(self.resume_dir, self.name), global_step=iter_time,
+                               write_state=False)
+
+        # The state file is written after the variables, it always points to a complete checkpoint
+        tf.compat.v1.train.update_checkpoint_state(self.resume_dir, path)
+        write_json(os.path.join(self.resume_dir, RESUME_STATE_FILE), state)
+        remove_checkpoints(self.resume_dir, self.name, keep=[path])
+
+
+def restore_resume(sess, saver, model_dir):
+    # Returns the resume state of the model folder after restoring its variables, None without a resume state
+    resume_dir = os.path.join(model_dir, RESUME_FOLDER)
+    state = read_json(os.path.join(resume_dir, RESUME_STATE_FILE), default=None)
+    if state is None:
+        return None
+
+    saver.restore(sess, os.path.join(resume_dir, 'model-{}'.format(state['iter_time'])))
+    return state
+
+
+def rng_state():
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return [name, keys.tolist(), int(pos), int(has_gauss), float(cached_gaussian)]
+
+
+def set_rng_state(state):
+    name, keys, pos, has_gauss, cached_gaussian = state
+    np.random.set_state((name, np.asarray(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+
+def remove_checkpoints(folder, name, keep):
+    for path in glob.glob(os.path.join(folder, name + '-*')):
+        prefix = os.path.basename(path).split('.')[0]
+        if prefix not in keep:
+            os.remove(path)
+
+
+def read_json(file_path, default=None):
+    if not os.path.isfile(file_path):
+        return default
+
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+def write_json(file_path, values):
+    with open(file_path + '.tmp', 'w') as f:
+        json.dump(values, f, indent=4, sort_keys=True)
+    os.replace(file_path + '.tmp', file_path)
@@ -15,7 +15,7 @@ import tensorflow_utils as tf_utils
 
 class ResNet18(object):
     def __init__(self, input_shape, num_classes=5, lr=1e-3, weight_decay=1e-4, total_iters=2e5, is_train=True,
-                 log_dir=None, name='ResNet18'):
+                 log_dir=None, name='ResNet18', data_format='NHWC', fused_bn=False):
         self.input_shape = input_shape
         self.num_classes = num_classes
         self.lr = lr
@@ -25,6 +25,8 @@ class ResNet18(object):
         self.log_dir = log_dir
         self.name = name
         self.layers = [2, 2, 2, 2]
+        self.data_format = data_format      # NHWC | NCHW layout of the activations
+        self.fused_bn = fused_bn
         self._ops = list()
         self.tb_lr = None
 
@@ -32,6 +34,7 @@ class ResNet18(object):
         self.logger.setLevel(logging.INFO)
         utils.init_logger(logger=self.logger, log_dir=self.log_dir, is_train=self.is_train, name=self.name)
 
+        tf_utils.set_data_format(self.data_format)
         self._build_graph()
         # TODO: self._best_metrics_record()
         self._eval_graph()
@@ -112,6 +115,8 @@ class ResNet18(object):
     def forward_network(self, input_img, reuse=False):
         with tf.compat.v1.variable_scope(self.name, reuse=reuse):
             tf_utils.print_activations(input_img, logger=self.logger)
+            if self.data_format == 'NCHW':
+                input_img = tf.transpose(input_img, [0, 3, 1, 2], name='to_nchw')
             inputs = self.conv2d_fixed_padding(inputs=input_img, filters=64, kernel_size=7, strides=2, name='conv1')
             inputs = tf_utils.max_pool(inputs, name='3x3_maxpool', ksize=[1, 3, 3, 1], strides=[1, 2, 2, 1],
                                        logger=self.logger)
@@ -126,11 +131,11 @@ class ResNet18(object):
                                       strides=2, train_mode=self.train_mode, name='block_layer4')
 
             inputs = tf_utils.norm(inputs, name='before_gap_batch_norm', _type='batch', _ops=self._ops,
-                                   is_train=self.train_mode, logger=self.logger)
+                                   is_train=self.train_mode, fused=self.fused_bn, logger=self.logger)
 
             inputs = tf_utils.relu(inputs, name='before_flatten_relu', logger=self.logger)
 
-            _, h, w, _ = inputs.get_shape().as_list()
+            h, w = [inputs.get_shape().as_list()[axis] for axis in tf_utils.spatial_axes()]
             inputs = tf_utils.avg_pool(inputs, name='gap', ksize=[1, h, w, 1], strides=[1, 1, 1, 1], logger=self.logger)
 
             # Flatten
@@ -154,7 +159,7 @@ class ResNet18(object):
 
             # norm(x, name, _type, _ops, is_train=True, is_print=True, logger=None)
             inputs = tf_utils.norm(inputs, name='batch_norm_0', _type='batch', _ops=self._ops,
-                                   is_train=train_mode, logger=self.logger)
+                                   is_train=train_mode, fused=self.fused_bn, logger=self.logger)
             inputs = tf_utils.relu(inputs, name='relu_0', logger=self.logger)
 
             # The projection shortcut shouldcome after the first batch norm and ReLU since it perofrms a 1x1 convolution.
@@ -164,7 +169,7 @@ class ResNet18(object):
             inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=3, strides=strides, name='conv_0')
 
             inputs = tf_utils.norm(inputs, name='batch_norm_1', _type='batch', _ops=self._ops,
-                                   is_train=train_mode, logger=self.logger)
+                                   is_train=train_mode, fused=self.fused_bn, logger=self.logger)
             inputs = tf_utils.relu(inputs, name='relu_1', logger=self.logger)
             inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=3, strides=1, name='conv_1')
 
@@ -197,7 +202,7 @@ class ResNet18(object):
         pad_total = kernel_size - 1
         pad_start = pad_total // 2
         pad_end = pad_total - pad_start
-        inputs = tf.pad(inputs, [[0, 0], [pad_start, pad_end], [pad_start, pad_end], [0, 0]])
+        inputs = tf.pad(inputs, tf_utils.to_format([[0, 0], [pad_start, pad_end], [pad_start, pad_end], [0, 0]]))
         return inputs
 
     @staticmethod
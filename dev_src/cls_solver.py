@@ -9,17 +9,20 @@
 import numpy as np
 import tensorflow as tf
 
+import tensorflow_utils as tf_utils
+
 
 class Solver(object):
-    def __init__(self, model, data):
+    def __init__(self, model, data, use_xla=False):
         self.model = model
         self.data = data
+        self.use_xla = use_xla
 
         self._init_session()
         self._init_variables()
 
     def _init_session(self):
-        self.sess = tf.compat.v1.Session()
+        self.sess = tf.compat.v1.Session(config=tf_utils.session_config(use_xla=self.use_xla))
 
     def _init_variables(self):
         self.sess.run(tf.compat.v1.global_variables_initializer())
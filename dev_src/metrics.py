@@ -0,0 +1,154 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Metrics writer with a background thread and TensorBoard, CSV, JSONL and console sinks
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import csv
+import json
+import time
+import queue
+import threading
+import numpy as np
+import tensorflow as tf
+
+
+class TensorBoardSink(object):
+    def __init__(self, log_dir, graph=None):
+        self.writer = tf.compat.v1.summary.FileWriter(logdir=log_dir, graph=graph)
+
+    def write(self, records):
+        for step, _, values, summary in records:
+            if summary is not None:
+                self.writer.add_summary(summary, step)
+            else:
+                self.writer.add_summary(tf.compat.v1.Summary(value=[
+                    tf.compat.v1.Summary.Value(tag=tag, simple_value=value) for tag, value in values.items()]), step)
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvSink(object):
+    # One row per scalar, the training and the evaluation scalars share the file
+    def __init__(self, log_dir, file_name='metrics.csv'):
+        file_path = os.path.join(log_dir, file_name)
+        is_new = not os.path.isfile(file_path)
+        self.file = open(file_path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if is_new:
+            self.writer.writerow(['step', 'wall_time', 'tag', 'value'])
+
+    def write(self, records):
+        for step, wall_time, values, _ in records:
+            for tag, value in values.items():
+                self.writer.writerow([step, '{:.3f}'.format(wall_time), tag, value])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlSink(object):
+    def __init__(self, log_dir, file_name='metrics.jsonl'):
+        self.file = open(os.path.join(log_dir, file_name), 'a')
+
+    def write(self, records):
+        for step, wall_time, values, _ in records:
+            self.file.write(json.dumps({'step': step, 'wall_time': round(wall_time, 3), **values}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ConsoleSink(object):
+    # Mean of each scalar since the last emission, one line per emission. The step profile has its own report
+    def __init__(self, total_steps=None):
+        self.total_steps = total_steps
+
+    def write(self, records):
+        train_records = [record for record in records if record[3] is None]
+        if len(train_records) == 0:
+            return
+
+        tags = sorted(set(tag for record in train_records for tag in record[2] if not tag.startswith('Profile/')))
+        means = ['{}: {:.5f}'.format(tag, np.mean([record[2][tag] for record in train_records if tag in record[2]]))
+                 for tag in tags]
+        print('[{0:6} / {1:6}] {2}'.format(train_records[-1][0], self.total_steps, ', '.join(means)))
+
+    def close(self):
+        pass
+
+
+class MetricsWriter(object):
+    """Scalars are queued in the training loop and written by a background thread every flush_secs."""
+    def __init__(self, log_dir, sinks=('tensorboard',), flush_secs=10., graph=None, total_steps=None):
+        self.flush_secs = flush_secs
+        self.sinks = list()
+        for sink in sinks:
+            if sink == 'tensorboard':
+                self.sinks.append(TensorBoardSink(log_dir, graph=graph))
+            elif sink == 'csv':
+                self.sinks.append(CsvSink(log_dir))
+            elif sink == 'jsonl':
+                self.sinks.append(JsonlSink(log_dir))
+            elif sink == 'console':
+                self.sinks.append(ConsoleSink(total_steps=total_steps))
+            else:
+                raise NotImplementedError
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add_scalars(self, step, values):
+        # values: {tag: value}, no I/O in the caller
+        self.queue.put((int(step), time.time(), {tag: float(value) for tag, value in values.items()}, None))
+
+    def add_summary(self, step, summary):
+        # Serialized tf Summary, e.g. the eval summary of the solver, parsed in the writer thread
+        self.queue.put((int(step), time.time(), None, summary))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        for sink in self.sinks:
+            sink.close()
+
+    def _run(self):
+        records, is_closed = list(), False
+        deadline = time.time() + self.flush_secs
+        while not is_closed:
+            try:
+                record = self.queue.get(timeout=max(deadline - time.time(), 0.))
+                if record is None:
+                    is_closed = True
+                else:
+                    records.append(self._parse(record))
+            except queue.Empty:
+                pass
+
+            if (time.time() >= deadline or is_closed) and len(records) > 0:
+                self._emit(records)
+                records = list()
+            if time.time() >= deadline:
+                deadline = time.time() + self.flush_secs
+
+    @staticmethod
+    def _parse(record):
+        step, wall_time, values, summary = record
+        if summary is not None:
+            values = {value.tag: value.simple_value for value in tf.compat.v1.Summary.FromString(summary).value
+                      if value.HasField('simple_value')}
+        return step, wall_time, values, summary
+
+    def _emit(self, records):
+        for sink in self.sinks:
+            try:
+                sink.write(records)
+            except Exception as e:
+                # A failed sink does not stop the training
+                print(' [!] {} failed: {}'.format(type(sink).__name__, e))
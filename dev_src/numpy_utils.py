@@ -0,0 +1,289 @@
+# ---------------------------------------------------------
+# NumPy Utils Implementation
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# ---------------------------------------------------------
+import json
+import numpy as np
+
+
+def magnitude_prune(matrix, sparsity):
+    num_prune = int(sparsity * matrix.size)
+    if num_prune == 0:
+        return matrix.copy()
+
+    abs_matrix = np.abs(matrix)
+    threshold = np.partition(abs_matrix.ravel(), num_prune - 1)[num_prune - 1]
+    return np.where(abs_matrix > threshold, matrix, 0.).astype(matrix.dtype)
+
+
+def dense_to_csr(matrix):
+    # CSR of the transposed matrix, one row per output unit of y = x @ matrix
+    matrix_t = np.ascontiguousarray(matrix.T)
+    rows, cols = np.nonzero(matrix_t)
+
+    indptr = np.zeros(matrix_t.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=matrix_t.shape[0]), out=indptr[1:])
+
+    return {'data': matrix_t[rows, cols].astype(np.float32),
+            'indices': cols.astype(np.int32),
+            'indptr': indptr,
+            'shape': np.asarray(matrix.shape, dtype=np.int64)}
+
+
+def csr_matvec(x, csr):
+    # y = x @ matrix for a single input vector x
+    output = np.zeros(csr['shape'][1], dtype=np.float32)
+    if csr['data'].size == 0:
+        return output
+
+    starts, ends = csr['indptr'][:-1], csr['indptr'][1:]
+    non_empty = starts < ends
+    output[non_empty] = np.add.reduceat(csr['data'] * x[csr['indices']], starts[non_empty])
+    return output
+
+
+def csr_matmul(x, csr):
+    return np.stack([csr_matvec(x[i], csr) for i in range(x.shape[0])], axis=0)
+
+
+def save_sparse_head(file_path, params, sparse_names=('FC1', 'FC2'), dense_names=('Out',)):
+    arrays = dict()
+    for name in sparse_names:
+        for key, value in dense_to_csr(params[name + '/matrix']).items():
+            arrays[name + '/' + key] = value
+        arrays[name + '/bias'] = params[name + '/bias']
+
+    for name in dense_names:
+        arrays[name + '/matrix'] = params[name + '/matrix']
+        arrays[name + '/bias'] = params[name + '/bias']
+
+    np.savez(file_path, **arrays)
+
+
+def load_sparse_head(file_path, sparse_names=('FC1', 'FC2')):
+    with np.load(file_path) as arrays:
+        head = {key: arrays[key] for key in arrays.files}
+
+    for name in sparse_names:
+        head[name] = {key: head.pop(name + '/' + key) for key in ['data', 'indices', 'indptr', 'shape']}
+
+    return head
+
+
+def sparse_head_forward(head, features):
+    # FC1 -> ReLU -> FC2 -> ReLU -> Out with sparse matrix-vector kernels
+    outputs = np.maximum(csr_matmul(features, head['FC1']) + head['FC1/bias'], 0.)
+    outputs = np.maximum(csr_matmul(outputs, head['FC2']) + head['FC2/bias'], 0.)
+    return np.matmul(outputs, head['Out/matrix']) + head['Out/bias']
+
+
+def truncated_svd(matrix, rank):
+    # matrix ~= u @ v with u: [in, rank] and v: [rank, out], the singular values are split evenly
+    u, s, vt = np.linalg.svd(matrix, full_matrices=False)
+    sqrt_s = np.sqrt(s[:rank])
+    return (u[:, :rank] * sqrt_s).astype(matrix.dtype), (sqrt_s[:, None] * vt[:rank]).astype(matrix.dtype)
+
+
+def dense_head_forward(params, features):
+    outputs = np.maximum(np.matmul(features, params['FC1/matrix']) + params['FC1/bias'], 0.)
+    outputs = np.maximum(np.matmul(outputs, params['FC2/matrix']) + params['FC2/bias'], 0.)
+    return np.matmul(outputs, params['Out/matrix']) + params['Out/bias']
+
+
+def save_slim_checkpoint(file_path, params, min_values, max_values, config=None, iter_time=0, use_float16=False):
+    # Forward weights only, the normalization stats and the model config travel with them
+    arrays = dict()
+    for key, value in params.items():
+        arrays[key] = value.astype(np.float16) if use_float16 and value.dtype == np.float32 else value
+
+    arrays['__min_values__'] = np.asarray(min_values)
+    arrays['__max_values__'] = np.asarray(max_values)
+    arrays['__config__'] = np.asarray(json.dumps(config if config is not None else dict(), sort_keys=True))
+    arrays['__iter__'] = np.asarray(iter_time, dtype=np.int64)
+
+    np.savez(file_path, **arrays)
+
+
+def load_slim_checkpoint(file_path):
+    # float16 weights are upcast, the graph and the numpy kernels always run in float32
+    params, meta = dict(), dict()
+    with np.load(file_path) as arrays:
+        for key in arrays.files:
+            if key.startswith('__'):
+                continue
+            value = arrays[key]
+            params[key] = value.astype(np.float32) if value.dtype == np.float16 else value
+
+        meta['min_values'] = arrays['__min_values__']
+        meta['max_values'] = arrays['__max_values__']
+        meta['config'] = json.loads(str(arrays['__config__']))
+        meta['iter_time'] = int(arrays['__iter__'])
+
+    return params, meta
+
+
+# Popcount of every byte value
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint16)
+
+
+def pad_signs(x, pad_start, pad_end):
+    # Binary layers pad with -1 (False), the background of the normalized frame
+    return np.pad(x, [[pad_start, pad_end], [pad_start, pad_end], [0, 0]], mode='constant', constant_values=False)
+
+
+def extract_patches(x, kernel_size, strides):
+    # [h, w, c] -> [out_h, out_w, kernel_size * kernel_size * c] in the (k_h, k_w, c) order of the conv kernels
+    h, w, c = x.shape
+    out_h, out_w = (h - kernel_size) // strides + 1, (w - kernel_size) // strides + 1
+    s_h, s_w, s_c = x.strides
+    patches = np.lib.stride_tricks.as_strided(x, shape=(out_h, out_w, kernel_size, kernel_size, c),
+                                              strides=(s_h * strides, s_w * strides, s_h, s_w, s_c), writeable=False)
+    return patches.reshape(out_h, out_w, -1)
+
+
+def binarize_conv(weight, bias):
+    # XNOR-Net approximation w ~= alpha * sign(w) with one alpha per output channel
+    kernel_size, _, _, output_dim = weight.shape
+    return {'bits': np.packbits(weight.reshape(-1, output_dim).T >= 0., axis=1),
+            'alpha': np.mean(np.abs(weight), axis=(0, 1, 2)).astype(np.float32),
+            'bias': bias.astype(np.float32),
+            'kernel_size': kernel_size,
+            'num_bits': weight.shape[0] * weight.shape[1] * weight.shape[2]}
+
+
+def xnor_conv2d(signs, kernel, strides=1, chunk_size=1024):
+    # signs: [h, w, c] bool (True for +1), the dot product of two +-1 vectors is num_bits - 2 * popcount(a xor b)
+    kernel_size = kernel['kernel_size']
+    pad_start = (kernel_size - 1) // 2
+    signs = pad_signs(signs, pad_start, kernel_size - 1 - pad_start)
+
+    patches = extract_patches(signs, kernel_size, strides)
+    out_h, out_w, _ = patches.shape
+    packed = np.packbits(patches.reshape(out_h * out_w, -1), axis=1)
+
+    output = np.empty((out_h * out_w, kernel['bits'].shape[0]), dtype=np.float32)
+    for start in range(0, packed.shape[0], chunk_size):
+        xor = np.bitwise_xor(packed[start:start + chunk_size, None, :], kernel['bits'][None, :, :])
+        mismatches = np.sum(POPCOUNT_TABLE[xor], axis=2)
+        output[start:start + chunk_size] = kernel['num_bits'] - 2. * mismatches
+
+    output = output * kernel['alpha'] + kernel['bias']
+    return output.reshape(out_h, out_w, -1)
+
+
+def max_pool_same(x, kernel_size=3, strides=2):
+    # The SAME max pooling of tensorflow, padded values never win
+    h, w, _ = x.shape
+    pad_h = max((int(np.ceil(h / strides)) - 1) * strides + kernel_size - h, 0)
+    pad_w = max((int(np.ceil(w / strides)) - 1) * strides + kernel_size - w, 0)
+    x = np.pad(x, [[pad_h // 2, pad_h - pad_h // 2], [pad_w // 2, pad_w - pad_w // 2], [0, 0]],
+               mode='constant', constant_values=-np.inf)
+
+    patches = extract_patches(np.ascontiguousarray(x), kernel_size, strides)
+    return np.max(patches.reshape(patches.shape[0], patches.shape[1], kernel_size * kernel_size, -1), axis=2)
+
+
+def prepare_binary_kernels(params, binary_layers, blocks=2):
+    kernels = {'conv1': binarize_conv(params['conv1/w'], params['conv1/biases'])}
+    if binary_layers >= 2:
+        for block in range(blocks):
+            scope = 'block_layer1_{}'.format(block + 1)
+            for conv_name in ['conv_0', 'conv_1', 'conv_projection']:
+                if scope + '/' + conv_name + '/w' in params:
+                    kernels[scope + '/' + conv_name] = binarize_conv(params[scope + '/' + conv_name + '/w'],
+                                                                     params[scope + '/' + conv_name + '/biases'])
+    return kernels
+
+
+def binary_trunk_forward(img, kernels, binary_layers, blocks=2):
+    # Binary layers of a single frame [h, w, c] of 0/255 pixels: conv1 and optionally maxpool and block_layer1
+    outputs = xnor_conv2d(img >= 127.5, kernels['conv1'])
+    if binary_layers < 2:
+        return outputs
+
+    outputs = max_pool_same(outputs)
+    for block in range(blocks):
+        scope = 'block_layer1_{}'.format(block + 1)
+        signs = outputs >= 0.
+        shortcut = outputs
+        if scope + '/conv_projection' in kernels:
+            shortcut = xnor_conv2d(signs, kernels[scope + '/conv_projection'])
+
+        inner = xnor_conv2d(signs, kernels[scope + '/conv_0'])
+        outputs = xnor_conv2d(inner >= 0., kernels[scope + '/conv_1']) + shortcut
+
+    return outputs
+
+
+def sparse_tile_layout(input_hw, kernel_size=7, blocks=2, tile_size=16):
+    # Tiles on the grid after the stride-2 max pooling (block_layer1 resolution), SAME padding of the pooling adds one
+    # row at the top of odd heights. The halo holds the cells that the border of a crop changes: the conv1 and pooling
+    # margin and two 3x3 convs per residual block
+    h, w = input_hw
+    pool_hw = ((h + 1) // 2, (w + 1) // 2)
+    return {'input_hw': (h, w),
+            'pool_hw': pool_hw,
+            'pad': (h % 2, w % 2),
+            'radius': kernel_size // 2,
+            'context': 2 * blocks,
+            'halo': (kernel_size // 2) // 2 + 1 + 2 * blocks,
+            'tile_size': tile_size,
+            'num_tiles': int(np.ceil(pool_hw[0] / tile_size) * np.ceil(pool_hw[1] / tile_size))}
+
+
+def tile_crop(start, layout, axis):
+    # Input rows (or cols) of the crop of a tile and the pooled cell of its first output row
+    a, b = start - layout['halo'], start + layout['tile_size'] + layout['halo']
+    pad, size = layout['pad'][axis], layout['input_hw'][axis]
+    return max(2 * a - pad, 0), min(2 * b - pad, size), max(a, 0)
+
+
+def active_tiles(img, layout):
+    # Tiles with a foreground pixel in their receptive field, all other cells keep the response of an empty frame
+    integral = np.pad(np.cumsum(np.cumsum(np.any(img > 0, axis=-1), axis=0), axis=1), [[1, 0], [1, 0]])
+    size, radius, context = layout['tile_size'], layout['radius'], layout['context']
+
+    def window(start, axis):
+        pad, limit = layout['pad'][axis], layout['input_hw'][axis]
+        low = 2 * (start - context) - pad - radius
+        high = 2 * (start + size - 1 + context) - pad + 2 + radius + 1
+        return max(low, 0), min(high, limit)
+
+    tiles = list()
+    for start_h in range(0, layout['pool_hw'][0], size):
+        r0, r1 = window(start_h, axis=0)
+        for start_w in range(0, layout['pool_hw'][1], size):
+            c0, c1 = window(start_w, axis=1)
+            if integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0] > 0:
+                tiles.append((start_h, start_w))
+
+    return tiles
+
+
+def gather_tiles(img, tiles, layout):
+    # Crops with the halo, grouped by shape since the crops at the image border are cut
+    groups = dict()
+    for start_h, start_w in tiles:
+        r0, r1, _ = tile_crop(start_h, layout, axis=0)
+        c0, c1, _ = tile_crop(start_w, layout, axis=1)
+        crop = img[r0:r1, c0:c1]
+        group_tiles, crops = groups.setdefault(crop.shape, (list(), list()))
+        group_tiles.append((start_h, start_w))
+        crops.append(crop)
+
+    return [(group_tiles, np.stack(crops, axis=0)) for group_tiles, crops in groups.values()]
+
+
+def scatter_tiles(features, tiles, outputs, layout):
+    # Writes the inner tile of every crop output [n, crop_h, crop_w, c] into the pooled features [h, w, c]
+    size = layout['tile_size']
+    for (start_h, start_w), output in zip(tiles, outputs):
+        offset_h = start_h - tile_crop(start_h, layout, axis=0)[2]
+        offset_w = start_w - tile_crop(start_w, layout, axis=1)[2]
+        num_h = min(size, layout['pool_hw'][0] - start_h)
+        num_w = min(size, layout['pool_hw'][1] - start_w)
+        features[start_h:start_h + num_h, start_w:start_w + num_w] = \
+            output[offset_h:offset_h + num_h, offset_w:offset_w + num_w]
+
+    return features
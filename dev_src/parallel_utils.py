@@ -0,0 +1,111 @@
+# ---------------------------------------------------------
+# Parallel Utils Implementation
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# ---------------------------------------------------------
+import os
+import time
+import signal
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class LocalAllReduce(object):
+    """Synchronous all-reduce of the worker processes on one host through a shared-memory buffer."""
+    def __init__(self, num_workers, name=None, timeout=None):
+        self.num_workers = num_workers
+        self.name = name if name is not None else 'rg_allreduce_{}'.format(os.getpid())
+        self.barrier = mp.get_context('spawn').Barrier(num_workers, timeout=timeout)
+        self.rank = 0
+        self.shm, self.buffer = None, None
+
+    @property
+    def is_chief(self):
+        return self.rank == 0
+
+    def setup(self, rank, size):
+        # The chief allocates one float32 row per worker, the others attach once it exists
+        self.rank = rank
+        if self.is_chief:
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=4 * self.num_workers * size)
+        self.barrier.wait()
+
+        if not self.is_chief:
+            self.shm = shared_memory.SharedMemory(name=self.name)
+        self.buffer = np.ndarray((self.num_workers, size), dtype=np.float32, buffer=self.shm.buf)
+
+    def all_reduce(self, arrays):
+        # Mean of the arrays of all workers, every worker sums the rows in the same order and gets the same values
+        flat = flatten(arrays)
+        self.buffer[self.rank, :flat.size] = flat
+        self.barrier.wait()
+
+        mean = np.mean(self.buffer[:, :flat.size], axis=0)
+        self.barrier.wait()     # the buffer is only written again after every worker has read it
+        return unflatten(mean, arrays)
+
+    def broadcast(self, arrays, root=0):
+        flat = flatten(arrays)
+        if self.rank == root:
+            self.buffer[root, :flat.size] = flat
+        self.barrier.wait()
+
+        values = unflatten(self.buffer[root, :flat.size].copy(), arrays)
+        self.barrier.wait()
+        return values
+
+    def close(self):
+        if self.shm is None:
+            return
+
+        self.barrier.wait()
+        self.buffer = None
+        self.shm.close()
+        if self.is_chief:
+            self.shm.unlink()
+        self.shm = None
+
+
+def flatten(arrays):
+    return np.concatenate([np.asarray(array, dtype=np.float32).ravel() for array in arrays])
+
+
+def unflatten(flat, arrays):
+    values, start = list(), 0
+    for array in arrays:
+        size = int(np.size(array))
+        values.append(flat[start:start + size].reshape(np.shape(array)))
+        start += size
+
+    return values
+
+
+def launch_workers(target, num_workers, args=()):
+    # One spawned process per worker, target(rank, collective, *args). A failed worker stops all the others
+    collective = LocalAllReduce(num_workers)
+    ctx = mp.get_context('spawn')
+    workers = [ctx.Process(target=target, args=(rank, collective, *args)) for rank in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    # A preempted launcher hands SIGTERM to the chief, which saves the resume state and stops every worker
+    signal.signal(signal.SIGTERM, lambda signum, frame: workers[0].terminate())
+
+    while any(worker.is_alive() for worker in workers):
+        if any(worker.exitcode not in [None, 0] for worker in workers):
+            for worker in workers:
+                worker.terminate()
+            break
+        time.sleep(1.)
+
+    for worker in workers:
+        worker.join()
+
+    try:
+        # Buffer of a chief that did not reach close()
+        shared_memory.SharedMemory(name=collective.name).unlink()
+    except FileNotFoundError:
+        pass
+
+    return [worker.exitcode for worker in workers]
@@ -15,7 +15,12 @@ import tensorflow_utils as tf_utils
 
 class ResNet18_Revised(object):
     def __init__(self, input_shape, min_values, max_values, domain='xy', num_attribute=6, use_batchnorm=False, lr=1e-3,
-                 weight_decay=1e-4, total_iters=2e5, small_value=1e-7, is_train=True, log_dir=None, name='ResNet18'):
+                 weight_decay=1e-4, total_iters=2e5, small_value=1e-7, is_train=True, log_dir=None, name='ResNet18',
+                 layers=(2, 2, 2, 2), filters=(64, 128, 256, 512), distill_alpha=0., domain_min_values=None,
+                 domain_max_values=None, prune_fc=False, inner_filters=None, fc_ranks=None, exit_heads=False,
+                 exit_weight=0.3, stem='conv7', stem_filters=64, head='flatten', block_type='basic', expansion=4,
+                 binary_layers=0, data_format='NHWC', fused_bn=False, inference_only=False, with_metrics=True,
+                 data_parallel=False, accum_steps=1):
         self.input_shape = input_shape
         self.min_values = min_values
         self.max_values = max_values
@@ -29,9 +34,34 @@ class ResNet18_Revised(object):
         self.is_train = is_train
         self.log_dir = log_dir
         self.name = name
-        self.layers = [2, 2, 2, 2]
+        self.layers = list(layers)
+        self.filters = list(filters)
+        # Output width of conv_0 in each residual block after channel pruning, None for the width of the block type
+        self.inner_filters = [list(widths) for widths in inner_filters] if inner_filters is not None else None
+        self.distill_alpha = distill_alpha
+        self.prune_fc = prune_fc
+        self.fc_ranks = dict(fc_ranks) if fc_ranks is not None else dict()    # e.g. {'FC1': 32} after factorization
+        self.exit_heads = exit_heads
+        self.exit_weight = exit_weight
+        self.exit_inputs, self.exit_outputs = list(), list()
+        self.stem = stem                    # conv7 | conv3
+        self.stem_filters = stem_filters
+        self.head = head                    # flatten | gap
+        self.block_type = block_type        # basic | separable | inverted_residual
+        self.expansion = expansion          # width of the inverted residual blocks in multiples of the stage width
+        self.binary_layers = binary_layers  # 1: binary conv1, 2: binary conv1 and block_layer1
+        self.binary_output = None
+        self.data_format = data_format      # NHWC | NCHW layout of the activations, the variables do not change
+        self.fused_bn = fused_bn
+        self.inference_only = inference_only    # forward network only, no loss, optimizer and summaries
+        self.with_metrics = with_metrics        # gt placeholder and eval metrics of the inference-only graph
+        self.data_parallel = data_parallel      # gradients are averaged over the workers between compute and apply
+        self.grads, self.grad_tfphs = list(), list()
+        self.accum_steps = accum_steps          # micro-batches of which the gradients are averaged for one update
+        self.accum_op = None
         self._ops = list()
         self.tb_lr = None
+        self.lr_scale_tfph = None
 
         if self.domain.lower() == 'xy':
             # X, Y, Ra, Rb, F, D
@@ -39,24 +69,58 @@ class ResNet18_Revised(object):
         elif self.domain.lower() == 'rarb':
             # X, Y, Ra, Rb, F, D
             self.weights_constant = np.array([1.0, 1.0, 10.0, 10.0, 1.0, 1.0], dtype=np.float32)
+        elif self.domain.lower() == 'all':
+            # Per-sample weights of the xy and rarb samples. Each row also rescales the error from the joint min/max
+            # normalization to the min/max normalization of its own domain. Attributes that are constant in a domain,
+            # e.g. X and Y of the rarb data, have no own range and keep the joint normalization
+            domain_ranges = np.asarray(domain_max_values) - np.asarray(domain_min_values) + self.small_value
+            joint_range = np.asarray(self.max_values) - np.asarray(self.min_values) + self.small_value
+            domain_ranges = np.where(domain_ranges < 1e-3 * joint_range, joint_range, domain_ranges)
+            self.weights_constant = (np.array([[10.0, 10.0, 1.0, 1.0, 1.0, 1.0],
+                                               [1.0, 1.0, 10.0, 10.0, 1.0, 1.0]]) *
+                                     joint_range / domain_ranges).astype(np.float32)
         else:
             raise NotImplementedError
 
+        if self.stem not in ['conv7', 'conv3'] or self.head not in ['flatten', 'gap'] or \
+                self.block_type not in ['basic', 'separable', 'inverted_residual']:
+            raise NotImplementedError
+
+        if self.binary_layers not in [0, 1, 2] or (self.binary_layers == 2 and self.block_type != 'basic'):
+            raise NotImplementedError
+
+        self.block_fn = {'basic': self.bottleneck_block,
+                         'separable': self.separable_block,
+                         'inverted_residual': self.inverted_residual_block}[self.block_type]
+
         self.logger = logging.getLogger(__name__)  # logger
         self.logger.setLevel(logging.INFO)
         utils.init_logger(logger=self.logger, log_dir=self.log_dir, is_train=self.is_train, name=self.name)
 
-        self._build_graph()
-        # TODO: self._best_metrics_record()
-        self._eval_graph()
-        self._init_tensorboard()
+        tf_utils.set_data_format(self.data_format)
+        if self.inference_only:
+            self._build_inference_graph()
+            if self.with_metrics:
+                self._eval_graph()
+        else:
+            self._build_graph()
+            # TODO: self._best_metrics_record()
+            self._eval_graph()
+            self._init_tensorboard()
         tf_utils.show_all_variables(logger=self.logger if self.is_train else None)
 
     def _build_graph(self):
         self.img_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, *self.input_shape], name='img_tfph')
         self.gt_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, self.num_attribute], name='gt_tfph')
         self.pred_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, self.num_attribute], name='pred_tfph')
-        self.train_mode = tf.compat.v1.placeholder(dtype=tf.dtypes.bool, name='train_mode_ph')
+        # Batch statistics in the batch norms only when fed True, the evaluations run with the moving statistics
+        self.train_mode = tf.compat.v1.placeholder_with_default(False, shape=[], name='train_mode_ph')
+        if self.domain.lower() == 'all':
+            self.domain_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.int32, shape=[None], name='domain_tfph')
+        if self.distill_alpha > 0.:
+            # Normalized predictions of the frozen teacher model
+            self.teacher_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, self.num_attribute],
+                                                         name='teacher_tfph')
 
         # Network forward for training
         self.preds = self.forward_network(input_img=self.normalize(self.img_tfph), reuse=False)
@@ -64,8 +128,24 @@ class ResNet18_Revised(object):
         self.unnorm_gts = self.unnormalize(self.gt_tfph)
 
         # Data loss
-        self.data_loss = tf.compat.v1.losses.mean_squared_error(predictions=self.weights_constant * self.preds,
-                                                                labels=self.weights_constant * self.gt_tfph)
+        if self.domain.lower() == 'all':
+            weights_constant = tf.gather(tf.constant(self.weights_constant), self.domain_tfph)
+        else:
+            weights_constant = self.weights_constant
+
+        self.data_loss = tf.compat.v1.losses.mean_squared_error(predictions=weights_constant * self.preds,
+                                                                labels=weights_constant * self.gt_tfph)
+        if self.distill_alpha > 0.:
+            # Distillation loss: mix of the ground-truth labels and the teacher outputs
+            self.distill_loss = tf.compat.v1.losses.mean_squared_error(
+                predictions=weights_constant * self.preds, labels=weights_constant * self.teacher_tfph)
+            self.data_loss = (1. - self.distill_alpha) * self.data_loss + self.distill_alpha * self.distill_loss
+        if self.exit_heads:
+            # Gaussian negative log-likelihood of the early-exit heads, the learned variance is their confidence
+            self.exit_loss = tf.math.add_n([tf.math.reduce_mean(
+                0.5 * tf.math.exp(-log_vars) * tf.math.square(weights_constant * (preds - self.gt_tfph)) +
+                0.5 * log_vars) for preds, log_vars in self.exit_outputs])
+            self.data_loss = self.data_loss + self.exit_weight * self.exit_loss
         # Regularization term
         variables = self.get_regularization_variables()
         self.reg_term = self.weight_decay * tf.math.reduce_mean([tf.nn.l2_loss(variable) for variable in variables])
@@ -74,9 +154,53 @@ class ResNet18_Revised(object):
 
         # Optimizer
         train_op = self.init_optimizer(loss=self.total_loss)
-        train_ops = [train_op] + self._ops
+        # The moving statistics of the batch norms update in the run of the images, the data-parallel update only
+        # gets the averaged gradients
+        train_ops = [train_op] + (list() if self.data_parallel else self._ops)
         self.train_op = tf.group(*train_ops)
 
+        if self.prune_fc:
+            self._pruning_graph()
+
+    def _build_inference_graph(self):
+        # Test and serving graph, checkpoints restore without the optimizer slots and the global step
+        self.img_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, *self.input_shape], name='img_tfph')
+        self.train_mode = False
+
+        self.preds = self.forward_network(input_img=self.normalize(self.img_tfph), reuse=False)
+        self.unnorm_preds = self.unnormalize(self.preds)
+
+        if self.with_metrics:
+            self.gt_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, self.num_attribute],
+                                                    name='gt_tfph')
+            self.pred_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, self.num_attribute],
+                                                      name='pred_tfph')
+            self.unnorm_gts = self.unnormalize(self.gt_tfph)
+
+    def _pruning_graph(self):
+        self.sparsity_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[], name='sparsity_tfph')
+        weights = tf.compat.v1.get_collection('pruning_weights')
+        masks = tf.compat.v1.get_collection('pruning_masks')
+
+        prune_ops, apply_ops, self.sparsity_ops = list(), list(), list()
+        for weight, mask in zip(weights, masks):
+            # Keep the largest-magnitude weights for the target sparsity
+            abs_weight = tf.math.abs(weight)
+            num_weights = int(np.prod(weight.get_shape().as_list()))
+            num_keep = tf.math.maximum(num_weights - tf.dtypes.cast(self.sparsity_tfph * num_weights, tf.int32), 1)
+            threshold = tf.math.reduce_min(tf.nn.top_k(tf.reshape(abs_weight, [-1]), k=num_keep, sorted=False).values)
+            new_mask = tf.dtypes.cast(tf.math.greater_equal(abs_weight, threshold), tf.float32)
+            prune_ops.append(tf.group(mask.assign(new_mask), weight.assign(weight * new_mask)))
+            self.sparsity_ops.append(1. - tf.math.reduce_mean(mask))
+
+        # Masked weights stay at zero after every update, the checkpoint holds the sparse matrices
+        with tf.control_dependencies([self.train_op]):
+            for weight, mask in zip(weights, masks):
+                apply_ops.append(weight.assign(weight * mask))
+
+        self.prune_op = tf.group(*prune_ops)
+        self.train_op = tf.group(*apply_ops)
+
     def _eval_graph(self):
         # Evalaution
         self.eval_ops = tf.math.reduce_mean(tf.math.sqrt(tf.math.square(self.pred_tfph - self.gt_tfph)), axis=0)
@@ -87,8 +211,18 @@ class ResNet18_Revised(object):
             self.tb_total = tf.compat.v1.summary.scalar('Loss/total_loss', self.total_loss)
             self.tb_data = tf.compat.v1.summary.scalar('Loss/data_loss', self.data_loss)
             self.tb_reg = tf.compat.v1.summary.scalar('Loss/reg_term', self.reg_term)
-            self.summary_op = tf.compat.v1.summary.merge(
-                inputs=[self.tb_total, self.tb_data, self.tb_reg, self.tb_lr])
+            tb_list = [self.tb_total, self.tb_data, self.tb_reg, self.tb_lr]
+            if self.exit_heads:
+                tb_list.append(tf.compat.v1.summary.scalar('Loss/exit_loss', self.exit_loss))
+            self.summary_op = tf.compat.v1.summary.merge(inputs=tb_list)
+
+            # The same scalars as plain values for the metrics writer, nothing to serialize per step
+            self.train_scalars = {'Loss/total_loss': self.total_loss,
+                                  'Loss/data_loss': self.data_loss,
+                                  'Loss/reg_term': self.reg_term,
+                                  'Leanring_rate': self.learning_rate}
+            if self.exit_heads:
+                self.train_scalars['Loss/exit_loss'] = self.exit_loss
 
             self.eval_summary_op = tf.compat.v1.summary.merge([
                 tf.compat.v1.summary.scalar('Eval/X_err', self.eval_ops[0]),
@@ -113,79 +247,148 @@ class ResNet18_Revised(object):
                                                                           decay_steps=decay_steps,
                                                                           end_learning_rate=end_leanring_rate,
                                                                           power=1.0), start_learning_rate))
+            # Reduce-on-plateau factor of the solver, a feed and not a variable, older checkpoints restore as before
+            self.lr_scale_tfph = tf.compat.v1.placeholder_with_default(1., shape=[], name='lr_scale_tfph')
+            learning_rate = self.lr_scale_tfph * learning_rate
+            self.learning_rate = learning_rate
             self.tb_lr = tf.compat.v1.summary.scalar('Leanring_rate', learning_rate)
 
-            learn_step = tf.compat.v1.train.AdamOptimizer(learning_rate=learning_rate, beta1=0.99).minimize(
-                loss, global_step=global_step)
+            optimizer = tf.compat.v1.train.AdamOptimizer(learning_rate=learning_rate, beta1=0.99)
+            grads_and_vars = [(grad, var) for grad, var in optimizer.compute_gradients(loss) if grad is not None]
+            grads, variables = [grad for grad, _ in grads_and_vars], [var for _, var in grads_and_vars]
+
+            if self.accum_steps > 1:
+                # Mean gradient of the micro-batches, the last one is accumulated in the same run as the update
+                accum_vars = [tf.compat.v1.get_variable(var.op.name + '/accum', shape=var.get_shape(),
+                                                        initializer=tf.compat.v1.zeros_initializer(), trainable=False)
+                              for var in variables]
+                grads = [accum.assign_add(grad / self.accum_steps) for accum, grad in zip(accum_vars, grads)]
+                self.accum_op = tf.group(*(grads + self._ops))
+
+            if self.data_parallel:
+                # Gradients leave the graph for the all-reduce, the averaged ones come back through the placeholders
+                self.grads = [tf.convert_to_tensor(grad) for grad in grads]
+                self.bn_update_op = tf.group(*self._ops)
+                self.grad_tfphs = [tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=var.get_shape(),
+                                                            name=var.op.name.replace('/', '_') + '_grad_tfph')
+                                   for var in variables]
+                grads = self.grad_tfphs
+
+            learn_step = optimizer.apply_gradients(zip(grads, variables), global_step=global_step)
+
+            if self.accum_steps > 1:
+                with tf.control_dependencies([learn_step]):
+                    learn_step = tf.group(*[accum.assign(tf.zeros_like(accum)) for accum in accum_vars])
 
         return learn_step
 
     def forward_network(self, input_img, reuse=False):
         with tf.compat.v1.variable_scope(self.name, reuse=reuse):
             tf_utils.print_activations(input_img, logger=self.logger)
-            inputs = self.conv2d_fixed_padding(inputs=input_img, filters=64, kernel_size=7, strides=1, name='conv1')
+            if self.data_format == 'NCHW':
+                input_img = tf.transpose(input_img, [0, 3, 1, 2], name='to_nchw')
+            if self.binary_layers >= 1:
+                input_img = tf_utils.binarize(input_img, name='binarize_input')
+            inputs = self.conv2d_fixed_padding(inputs=input_img, filters=self.stem_filters,
+                                               kernel_size=(3 if self.stem == 'conv3' else 7), strides=1, name='conv1')
+            if self.binary_layers == 1:
+                self.binary_output = inputs
             inputs = tf_utils.max_pool(inputs, name='3x3_maxpool', ksize=[1, 3, 3, 1], strides=[1, 2, 2, 1],
                                        logger=self.logger)
 
-            inputs = self.block_layer(inputs=inputs, filters=64, block_fn=self.bottleneck_block, blocks=self.layers[0],
-                                      strides=1, train_mode=self.train_mode, name='block_layer1')
-            inputs = self.block_layer(inputs=inputs, filters=128, block_fn=self.bottleneck_block, blocks=self.layers[1],
-                                      strides=2, train_mode=self.train_mode, name='block_layer2')
-            inputs = self.block_layer(inputs=inputs, filters=256, block_fn=self.bottleneck_block, blocks=self.layers[2],
-                                      strides=2, train_mode=self.train_mode, name='block_layer3')
-            inputs = self.block_layer(inputs=inputs, filters=512, block_fn=self.bottleneck_block, blocks=self.layers[3],
-                                      strides=2, train_mode=self.train_mode, name='block_layer4')
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[0], block_fn=self.block_fn,
+                                      blocks=self.layers[0], strides=1, train_mode=self.train_mode,
+                                      name='block_layer1', inner_filters=self.inner_filters[0] if self.inner_filters else None)
+            if self.binary_layers == 2:
+                self.binary_output = inputs
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[1], block_fn=self.block_fn,
+                                      blocks=self.layers[1], strides=2, train_mode=self.train_mode,
+                                      name='block_layer2', inner_filters=self.inner_filters[1] if self.inner_filters else None)
+            if self.exit_heads:
+                self.exit_inputs.append(inputs)
+                self.exit_outputs.append(self.exit_head(inputs, name='exit1'))
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[2], block_fn=self.block_fn,
+                                      blocks=self.layers[2], strides=2, train_mode=self.train_mode,
+                                      name='block_layer3', inner_filters=self.inner_filters[2] if self.inner_filters else None)
+            if self.exit_heads:
+                self.exit_inputs.append(inputs)
+                self.exit_outputs.append(self.exit_head(inputs, name='exit2'))
+            inputs = self.block_layer(inputs=inputs, filters=self.filters[3], block_fn=self.block_fn,
+                                      blocks=self.layers[3], strides=2, train_mode=self.train_mode,
+                                      name='block_layer4', inner_filters=self.inner_filters[3] if self.inner_filters else None)
 
             if self.use_batchnorm:
                 inputs = tf_utils.norm(inputs, name='before_gap_batch_norm', _type='batch', _ops=self._ops,
-                                       is_train=self.train_mode, logger=self.logger)
+                                       is_train=self.train_mode, fused=self.fused_bn, logger=self.logger)
 
             inputs = tf_utils.relu(inputs, name='before_flatten_relu', logger=self.logger)
 
-            # _, h, w, _ = inputs.get_shape().as_list()
-            # inputs = tf_utils.avg_pool(inputs, name='gap', ksize=[1, h, w, 1], strides=[1, 1, 1, 1], logger=self.logger)
+            if self.head == 'gap':
+                h, w = [inputs.get_shape().as_list()[axis] for axis in tf_utils.spatial_axes()]
+                inputs = tf_utils.avg_pool(inputs, name='gap', ksize=[1, h, w, 1], strides=[1, 1, 1, 1],
+                                           logger=self.logger)
 
             # Flatten & FC1
             inputs = tf_utils.flatten(inputs, name='flatten', logger=self.logger)
-            inputs = tf_utils.linear(inputs, 512, name='FC1')
+            self.features = inputs
+            inputs = tf_utils.linear(inputs, 512, name='FC1', use_mask=self.prune_fc, rank=self.fc_ranks.get('FC1'))
             inputs = tf_utils.relu(inputs, name='FC1_relu', logger=self.logger)
 
-            inputs = tf_utils.linear(inputs, 256, name='FC2')
+            inputs = tf_utils.linear(inputs, 256, name='FC2', use_mask=self.prune_fc, rank=self.fc_ranks.get('FC2'))
             inputs = tf_utils.relu(inputs, name='FC2_relu', logger=self.logger)
 
             logits = tf_utils.linear(inputs, self.num_attribute, name='Out')
 
             return logits
 
-    def block_layer(self, inputs, filters, block_fn, blocks, strides, train_mode, name):
+    def exit_head(self, inputs, name):
+        # Light auxiliary regression head, predictions and log-variance of each attribute
+        with tf.compat.v1.variable_scope(name):
+            inputs = tf_utils.relu(inputs, name='relu', logger=self.logger)
+            inputs = tf.math.reduce_mean(inputs, axis=tf_utils.spatial_axes(), name='gap')
+            inputs = tf_utils.linear(inputs, 128, name='FC1')
+            inputs = tf_utils.relu(inputs, name='FC1_relu', logger=self.logger)
+
+            preds = tf_utils.linear(inputs, self.num_attribute, name='Out')
+            log_vars = tf_utils.linear(inputs, self.num_attribute, name='Log_var')
+
+        return preds, log_vars
+
+    def block_layer(self, inputs, filters, block_fn, blocks, strides, train_mode, name, inner_filters=None):
+        if inner_filters is None:
+            inner_filters = [None] * blocks     # stage width, filters * expansion for the inverted residual blocks
+
         # Only the first block per block_layer uses projection_shortcut and strides
-        inputs = block_fn(inputs, filters, train_mode, self.projection_shortcut, strides, name + '_1')
+        inputs = block_fn(inputs, filters, train_mode, self.projection_shortcut, strides, name + '_1',
+                          inner_filters=inner_filters[0])
 
         for num_iter in range(1, blocks):
-            inputs = block_fn(inputs, filters, train_mode, None, 1, name=(name + '_' + str(num_iter + 1)))
+            inputs = block_fn(inputs, filters, train_mode, None, 1, name=(name + '_' + str(num_iter + 1)),
+                              inner_filters=inner_filters[num_iter])
 
         return tf.identity(inputs, name)
 
-    def bottleneck_block(self, inputs, filters, train_mode, projection_shortcut, strides, name):
+    def bottleneck_block(self, inputs, filters, train_mode, projection_shortcut, strides, name, inner_filters=None):
         with tf.compat.v1.variable_scope(name):
             shortcut = inputs
 
             if self.use_batchnorm:
                 # norm(x, name, _type, _ops, is_train=True, is_print=True, logger=None)
                 inputs = tf_utils.norm(inputs, name='batch_norm_0', _type='batch', _ops=self._ops,
-                                       is_train=train_mode, logger=self.logger)
-            inputs = tf_utils.relu(inputs, name='relu_0', logger=self.logger)
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+            inputs = self.activation(inputs, name='relu_0')
 
             # The projection shortcut shouldcome after the first batch norm and ReLU since it perofrms a 1x1 convolution.
             if projection_shortcut is not None:
                 shortcut = self.projection_shortcut(inputs=inputs, filters_out=filters, strides=strides, name='conv_projection')
 
-            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=3, strides=strides, name='conv_0')
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=inner_filters or filters, kernel_size=3,
+                                               strides=strides, name='conv_0')
 
             if self.use_batchnorm:
                 inputs = tf_utils.norm(inputs, name='batch_norm_1', _type='batch', _ops=self._ops,
-                                       is_train=train_mode, logger=self.logger)
-            inputs = tf_utils.relu(inputs, name='relu_1', logger=self.logger)
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+            inputs = self.activation(inputs, name='relu_1')
             inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=3, strides=1, name='conv_1')
 
             output = tf.identity(inputs + shortcut, name=(name + '_output'))
@@ -193,11 +396,77 @@ class ResNet18_Revised(object):
 
             return output
 
+    def separable_block(self, inputs, filters, train_mode, projection_shortcut, strides, name, inner_filters=None):
+        # The basic block with each 3x3 conv factorized into a depthwise 3x3 and a pointwise 1x1 conv
+        with tf.compat.v1.variable_scope(name):
+            shortcut = inputs
+
+            if self.use_batchnorm:
+                inputs = tf_utils.norm(inputs, name='batch_norm_0', _type='batch', _ops=self._ops,
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+            inputs = tf_utils.relu(inputs, name='relu_0', logger=self.logger)
+
+            if projection_shortcut is not None:
+                shortcut = self.projection_shortcut(inputs=inputs, filters_out=filters, strides=strides, name='conv_projection')
+
+            inputs = self.depthwise_conv2d_fixed_padding(inputs=inputs, kernel_size=3, strides=strides, name='dw_conv_0')
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=inner_filters or filters, kernel_size=1, strides=1,
+                                               name='conv_0')
+
+            if self.use_batchnorm:
+                inputs = tf_utils.norm(inputs, name='batch_norm_1', _type='batch', _ops=self._ops,
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+            inputs = tf_utils.relu(inputs, name='relu_1', logger=self.logger)
+            inputs = self.depthwise_conv2d_fixed_padding(inputs=inputs, kernel_size=3, strides=1, name='dw_conv_1')
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=1, strides=1, name='conv_1')
+
+            output = tf.identity(inputs + shortcut, name=(name + '_output'))
+            tf_utils.print_activations(output, logger=self.logger)
+
+            return output
+
+    def inverted_residual_block(self, inputs, filters, train_mode, projection_shortcut, strides, name,
+                                inner_filters=None):
+        # MobileNetV2 block: 1x1 expansion, depthwise 3x3 and a linear 1x1 projection
+        with tf.compat.v1.variable_scope(name):
+            shortcut = inputs
+
+            if self.use_batchnorm:
+                inputs = tf_utils.norm(inputs, name='batch_norm_0', _type='batch', _ops=self._ops,
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+
+            if projection_shortcut is not None:
+                shortcut = self.projection_shortcut(inputs=inputs, filters_out=filters, strides=strides, name='conv_projection')
+
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=inner_filters or filters * self.expansion,
+                                               kernel_size=1, strides=1, name='conv_0')
+            if self.use_batchnorm:
+                inputs = tf_utils.norm(inputs, name='batch_norm_1', _type='batch', _ops=self._ops,
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+            inputs = tf_utils.relu(inputs, name='relu_1', logger=self.logger)
+
+            inputs = self.depthwise_conv2d_fixed_padding(inputs=inputs, kernel_size=3, strides=strides, name='dw_conv')
+            if self.use_batchnorm:
+                inputs = tf_utils.norm(inputs, name='batch_norm_2', _type='batch', _ops=self._ops,
+                                       is_train=train_mode, fused=self.fused_bn, logger=self.logger)
+            inputs = tf_utils.relu(inputs, name='relu_2', logger=self.logger)
+
+            inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters, kernel_size=1, strides=1, name='conv_1')
+
+            output = tf.identity(inputs + shortcut, name=(name + '_output'))
+            tf_utils.print_activations(output, logger=self.logger)
+
+            return output
+
     def projection_shortcut(self, inputs, filters_out, strides, name):
         inputs = self.conv2d_fixed_padding(inputs=inputs, filters=filters_out, kernel_size=1, strides=strides, name=name)
         return inputs
 
     def conv2d_fixed_padding(self, inputs, filters, kernel_size, strides, name):
+        if self.is_binary(name):
+            return tf_utils.binary_conv2d(inputs, output_dim=filters, k_h=kernel_size, k_w=kernel_size, d_h=strides,
+                                          d_w=strides, initializer='He', name=name, logger=self.logger)
+
         if strides > 1:
             inputs = self.fixed_padding(inputs, kernel_size)
 
@@ -206,6 +475,28 @@ class ResNet18_Revised(object):
                                  padding=('SAME' if strides == 1 else 'VALID'), logger=self.logger)
         return inputs
 
+    def is_binary(self, name):
+        # conv1 for binary_layers >= 1, all layers of block_layer1 for binary_layers >= 2
+        scope = tf.compat.v1.get_variable_scope().name.split('/')
+        if len(scope) == 1:
+            return (self.binary_layers >= 1) and (name == 'conv1')
+        return (self.binary_layers >= 2) and scope[1].startswith('block_layer1_')
+
+    def activation(self, inputs, name):
+        # Binary layers take sign(x) instead of ReLU
+        if self.is_binary(name):
+            return tf_utils.binarize(inputs, name=name)
+        return tf_utils.relu(inputs, name=name, logger=self.logger)
+
+    def depthwise_conv2d_fixed_padding(self, inputs, kernel_size, strides, name):
+        if strides > 1:
+            inputs = self.fixed_padding(inputs, kernel_size)
+
+        inputs = tf_utils.depthwise_conv2d(inputs, k_h=kernel_size, k_w=kernel_size, d_h=strides, d_w=strides,
+                                           initializer='He', name=name, padding=('SAME' if strides == 1 else 'VALID'),
+                                           logger=self.logger)
+        return inputs
+
     def unnormalize(self, data):
         return tf.maximum(data, 0.) * (self.max_values - self.min_values + self.small_value) + self.min_values
 
@@ -214,7 +505,7 @@ class ResNet18_Revised(object):
         pad_total = kernel_size - 1
         pad_start = pad_total // 2
         pad_end = pad_total - pad_start
-        inputs = tf.pad(inputs, [[0, 0], [pad_start, pad_end], [pad_start, pad_end], [0, 0]])
+        inputs = tf.pad(inputs, tf_utils.to_format([[0, 0], [pad_start, pad_end], [pad_start, pad_end], [0, 0]]))
         return inputs
 
     @staticmethod
@@ -0,0 +1,230 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Latency-constrained architecture search over the depth and width of ResNet18_Revised
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import json
+import itertools
+import numpy as np
+from datetime import datetime
+import tensorflow as tf
+
+import utils as utils
+from rg_dataset import Dataset
+from rg_solver import Solver
+from resnet import ResNet18_Revised
+from tf_profiler import LayerProfiler
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '0', 'gpu index for the proxy training, the latency is always measured on CPU, '
+                                         'default: 0')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_bool('use_batchnorm', False, 'use batchnorm or not in regression task, default: False')
+tf.flags.DEFINE_string('depths', '1,2,3', 'candidate number of residual blocks of each block_layer, default: 1,2,3')
+tf.flags.DEFINE_string('width_multipliers', '0.25,0.5,0.75,1.0', 'candidate multipliers of the 64-128-256-512 '
+                                                                 'widths, default: 0.25,0.5,0.75,1.0')
+tf.flags.DEFINE_string('stems', 'conv7,conv3', 'candidate stems, default: conv7,conv3')
+tf.flags.DEFINE_string('heads', 'flatten,gap', 'candidate heads, default: flatten,gap')
+tf.flags.DEFINE_string('block_types', 'basic', 'candidate residual blocks [basic | separable | inverted_residual], '
+                                               'default: basic')
+tf.flags.DEFINE_integer('num_samples', 24, 'number of sampled architectures, the baseline is always included, '
+                                           'default: 24')
+tf.flags.DEFINE_float('max_latency', 0., 'latency budget in msec, slower architectures are not trained, 0. for no '
+                                         'budget, default: 0.')
+tf.flags.DEFINE_integer('proxy_iters', 1000, 'number of iterations of the proxy training, default: 1000')
+tf.flags.DEFINE_integer('batch_size', 64, 'batch size for one iteration, default: 64')
+tf.flags.DEFINE_float('learning_rate', 1e-4, 'initial learning rate for optimizer, default: 0.0001')
+tf.flags.DEFINE_float('weight_decay', 1e-6, 'weight decay for model to handle overfitting, defautl: 1e-6')
+tf.flags.DEFINE_integer('num_runs', 50, 'number of profiled runs for the latency, default: 50')
+tf.flags.DEFINE_integer('seed', 0, 'random seed of the architecture sampling, default: 0')
+
+ATTRIBUTES = ['X', 'Y', 'Ra', 'Rb', 'F', 'D']
+BASE_FILTERS = [64, 128, 256, 512]
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+
+    log_dir = os.path.join('../log', 'arch_search', datetime.now().strftime("%Y%m%d-%H%M%S"))
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    data = Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+    results = list()
+    configs = sample_configs()
+    for idx, config in enumerate(configs):
+        print(' [*] Architecture {} / {}: {}'.format(idx + 1, len(configs), config))
+        result = evaluate_config(config, data, log_dir, name='arch_{:03d}'.format(idx))
+        results.append(result)
+        print(' [*] Latency: {:.3f} msec, Avg. Error: {}'.format(
+            result['latency'], 'skipped' if result['errors'] is None else '{:.5f}'.format(np.mean(result['errors']))))
+
+    write_results(results, log_dir)
+
+
+def sample_configs():
+    rng = np.random.RandomState(FLAGS.seed)
+    depths = utils.str_to_ints(FLAGS.depths)
+    multipliers = [float(item) for item in FLAGS.width_multipliers.split(',')]
+    stems, heads, block_types = FLAGS.stems.split(','), FLAGS.heads.split(','), FLAGS.block_types.split(',')
+
+    # The current architecture is the reference point of the front
+    baseline = make_config([2, 2, 2, 2], 1.0, 'conv7', 'flatten', 'basic')
+
+    # Distinct configs of the search space, multipliers that round to the same widths give one config
+    grid, keys = list(), {json.dumps(baseline, sort_keys=True)}
+    for layers in itertools.product(depths, repeat=4):
+        for multiplier, stem, head, block_type in itertools.product(multipliers, stems, heads, block_types):
+            config = make_config(list(layers), multiplier, stem, head, block_type)
+            key = json.dumps(config, sort_keys=True)
+            if key not in keys:
+                keys.add(key)
+                grid.append(config)
+
+    if len(grid) < FLAGS.num_samples:
+        print(' [!] Search space has only {} configs besides the baseline, all of them are evaluated instead of {}'
+              .format(len(grid), FLAGS.num_samples))
+    indexes = rng.choice(len(grid), size=min(FLAGS.num_samples, len(grid)), replace=False)
+
+    return [baseline] + [grid[idx] for idx in indexes]
+
+
+def make_config(layers, multiplier, stem, head, block_type, multiple=8):
+    # Widths are kept as multiples of 8 for the CPU kernels
+    def to_width(filters):
+        return max(multiple, int(round(filters * multiplier / multiple)) * multiple)
+
+    return {'use_batchnorm': FLAGS.use_batchnorm,
+            'layers': [int(num_blocks) for num_blocks in layers],
+            'filters': [to_width(filters) for filters in BASE_FILTERS],
+            'stem': stem,
+            'stem_filters': to_width(64),
+            'head': head,
+            'block_type': block_type}
+
+
+def evaluate_config(config, data, log_dir, name):
+    result = {'name': name, 'config': config, 'latency': None, 'params': None, 'errors': None}
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ResNet18_Revised(input_shape=data.input_shape,
+                                 min_values=data.min_values,
+                                 max_values=data.max_values,
+                                 domain=data.domain,
+                                 num_attribute=data.num_attribute,
+                                 lr=FLAGS.learning_rate,
+                                 weight_decay=FLAGS.weight_decay,
+                                 total_iters=FLAGS.proxy_iters,
+                                 is_train=True,
+                                 log_dir=log_dir,
+                                 domain_min_values=data.domain_min_values,
+                                 domain_max_values=data.domain_max_values,
+                                 **utils.model_kwargs(config))
+        result['params'] = int(sum(np.prod(variable.get_shape().as_list())
+                                   for variable in tf.compat.v1.trainable_variables()))
+
+        # Batch-1 latency on CPU, the values of the weights do not change the latency
+        cpu_sess = tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(device_count={'GPU': 0}))
+        cpu_sess.run(tf.compat.v1.global_variables_initializer())
+        imgs = 255. * np.random.randint(low=0, high=2, size=(1, *data.input_shape)).astype(np.float32)
+
+        result['latency'] = measure_latency(cpu_sess, model, imgs)
+
+        # Per-layer report only, the full traces slow down the runs
+        profiler = LayerProfiler(sess=cpu_sess, name=model.name)
+        profiler.profile(model.unnorm_preds, feed_dict={model.img_tfph: imgs}, num_runs=FLAGS.num_runs)
+        profiler.write_report(save_folder=os.path.join(log_dir, name), prefix='latency')
+        cpu_sess.close()
+
+        if (FLAGS.max_latency > 0.) and (result['latency'] > FLAGS.max_latency):
+            return result
+
+        # Short proxy training to rank the architectures
+        solver = Solver(model, data)
+        for _ in range(FLAGS.proxy_iters):
+            solver.train(batch_size=FLAGS.batch_size)
+        result['errors'] = [float(err) for err in val_errors(solver, data)]
+        solver.sess.close()
+
+    return result
+
+
+def measure_latency(sess, model, imgs, num_warmup=10):
+    # Median msec of the untraced runs after the warm-up
+    feed = {model.img_tfph: imgs}
+    for _ in range(num_warmup):
+        sess.run(model.unnorm_preds, feed_dict=feed)
+
+    run_times = list()
+    for _ in range(FLAGS.num_runs):
+        tic = time.time()
+        sess.run(model.unnorm_preds, feed_dict=feed)
+        run_times.append((time.time() - tic) * 1000.)
+    return float(np.median(run_times))
+
+
+def val_errors(solver, data):
+    errors = np.zeros(data.num_attribute, dtype=np.float64)
+    for index in range(0, data.num_val, FLAGS.batch_size):
+        img_vals, label_vals = data.direct_batch(batch_size=FLAGS.batch_size, start_index=index, stage='val')
+        unnorm_preds, unnorm_gts = solver.sess.run([solver.model.unnorm_preds, solver.model.unnorm_gts],
+                                                   feed_dict={solver.model.img_tfph: img_vals,
+                                                              solver.model.gt_tfph: label_vals})
+        errors += np.sum(np.sqrt(np.square(unnorm_preds - unnorm_gts)), axis=0)
+
+    return errors / data.num_val
+
+
+def pareto_front(results):
+    # Non-dominated results in latency and in every per-attribute error
+    points = [np.asarray([result['latency'], *result['errors']]) for result in results]
+
+    front = list()
+    for i, point in enumerate(points):
+        dominated = any(np.all(other <= point) and np.any(other < point) for j, other in enumerate(points) if j != i)
+        if not dominated:
+            front.append(results[i])
+
+    return sorted(front, key=lambda result: result['latency'])
+
+
+def write_results(results, log_dir):
+    trained = [result for result in results if result['errors'] is not None]
+    front = pareto_front(trained)
+
+    lines = list()
+    lines.append('{:<10}{:>8}{:>12}{:>10}{}  {}'.format(
+        'Name', 'Pareto', 'Latency(ms)', 'Params', ''.join('{:>9}'.format(attr) for attr in ATTRIBUTES), 'Config'))
+    for result in sorted(results, key=lambda result: result['latency']):
+        errors = ''.join('{:>9.4f}'.format(err) for err in result['errors']) if result['errors'] is not None \
+            else '{:>54}'.format('over the latency budget')
+        lines.append('{:<10}{:>8}{:>12.3f}{:>10,}{}  {}'.format(
+            result['name'], '*' if result in front else '', result['latency'], result['params'], errors,
+            json.dumps(result['config'], sort_keys=True)))
+
+    with open(os.path.join(log_dir, 'arch_search.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    with open(os.path.join(log_dir, 'arch_search.json'), 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+    # Ready-to-train configs, e.g. python rg_main.py --model_config=../log/arch_search/<time>/pareto_00.json
+    for rank, result in enumerate(front):
+        utils.write_model_config(log_dir, result['config'], file_name='pareto_{:02d}.json'.format(rank))
+
+    for line in lines:
+        print(line)
+    print(' [!] {} Pareto configs saved in {}'.format(len(front), log_dir))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
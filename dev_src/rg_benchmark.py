@@ -0,0 +1,355 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Benchmark of the backbone variants of the regression model
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import numpy as np
+from datetime import datetime
+import tensorflow as tf
+
+import utils as utils
+import numpy_utils as np_utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+from rg_solver import Solver
+from resnet import ResNet18_Revised
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '0', 'gpu index for the training, the latency is always measured on CPU, '
+                                         'default: 0')
+tf.flags.DEFINE_string('bench', 'block_type', 'benchmark to run [block_type | binary | layout | xla], '
+                                                  'default: block_type')
+tf.flags.DEFINE_integer('mode', 1, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 1')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('data_folders', '01,02,03', 'data folders to benchmark, default: 01,02,03')
+tf.flags.DEFINE_string('block_types', 'basic,separable,inverted_residual', 'residual blocks to compare, '
+                                                                           'default: basic,separable,inverted_residual')
+tf.flags.DEFINE_string('binary_layers', '0,1,2', 'binarized early layers to compare, 0 is the float model, '
+                                               'default: 0,1,2')
+tf.flags.DEFINE_string('data_formats', 'NHWC,NCHW', 'layouts of the activations to compare, default: NHWC,NCHW')
+tf.flags.DEFINE_integer('train_steps', 20, 'number of timed training steps of the layout and xla benchmarks, '
+                                            'default: 20')
+tf.flags.DEFINE_bool('use_batchnorm', False, 'use batchnorm or not in regression task, default: False')
+tf.flags.DEFINE_string('filters', '64,128,256,512', 'number of filters in each block_layer, default: 64,128,256,512')
+tf.flags.DEFINE_integer('expansion', 4, 'expansion factor of the inverted residual blocks, default: 4')
+tf.flags.DEFINE_integer('train_iters', 2000, 'number of training iterations of each model, 0 for latency only, '
+                                             'default: 2000')
+tf.flags.DEFINE_integer('batch_size', 64, 'batch size for one iteration, default: 64')
+tf.flags.DEFINE_float('learning_rate', 1e-4, 'initial learning rate for optimizer, default: 0.0001')
+tf.flags.DEFINE_float('weight_decay', 1e-6, 'weight decay for model to handle overfitting, defautl: 1e-6')
+tf.flags.DEFINE_integer('num_runs', 100, 'number of runs to measure the per-frame latency, default: 100')
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+    if FLAGS.bench == 'xla':
+        tf_utils.enable_xla_cpu_jit()   # the sessions without XLA keep the default jit level
+
+    log_dir = os.path.join('../log', 'benchmark', datetime.now().strftime("%Y%m%d-%H%M%S"))
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    benchmarks = {'block_type': bench_block_type,
+                  'binary': bench_binary,
+                  'layout': bench_layout,
+                  'xla': bench_xla}
+    if FLAGS.bench not in benchmarks:
+        exit(' [!] Unknown benchmark {}, select one of {}'.format(FLAGS.bench, list(benchmarks.keys())))
+
+    lines = benchmarks[FLAGS.bench](log_dir)
+
+    with open(os.path.join(log_dir, FLAGS.bench + '.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    for line in lines:
+        print(line)
+
+
+def bench_block_type(log_dir):
+    lines = list()
+    for data_folder in FLAGS.data_folders.split(','):
+        data = Dataset(data=data_folder, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+        lines.append('Data: {}, input: {}'.format(data_folder, data.input_shape))
+        lines.append('{:<20}{:>8}{:>12}{:>14}{:>9}{:>12}'.format('Block', 'Inner', 'Params', 'Latency(ms)', 'Speedup',
+                                                                   'Avg. Err'))
+
+        base_latency = None
+        for block_type in FLAGS.block_types.split(','):
+            config = {'use_batchnorm': FLAGS.use_batchnorm,
+                      'filters': utils.str_to_ints(FLAGS.filters),
+                      'block_type': block_type,
+                      'expansion': FLAGS.expansion}
+            num_params, latency, avg_err, inner_width = evaluate(data, config, log_dir)
+            base_latency = latency if base_latency is None else base_latency
+
+            # Shape check of the first block, the inverted residual block widens conv_0 by the expansion factor
+            expected_width = config['filters'][0] * (FLAGS.expansion if block_type == 'inverted_residual' else 1)
+            assert inner_width == expected_width, 'conv_0 of {} is {} wide, expected {}'.format(
+                block_type, inner_width, expected_width)
+
+            lines.append('{:<20}{:>8}{:>12,}{:>14.3f}{:>8.2f}x{:>12}'.format(
+                block_type, inner_width, num_params, latency, base_latency / latency,
+                '-' if avg_err is None else '{:.5f}'.format(avg_err)))
+        lines.append('')
+
+    return lines
+
+
+def bench_binary(log_dir):
+    lines = list()
+    for data_folder in FLAGS.data_folders.split(','):
+        data = Dataset(data=data_folder, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+        lines.append('Data: {}, input: {}'.format(data_folder, data.input_shape))
+        lines.append('{:<8}{:>14}{:>16}{:>16}{:>16}{:>12}'.format(
+            'Binary', 'TF(ms)', 'TF binary(ms)', 'XNOR binary(ms)', 'XNOR + TF(ms)', 'Avg. Err'))
+
+        for binary_layers in utils.str_to_ints(FLAGS.binary_layers):
+            # The numpy XNOR kernels skip batchnorm, the same as the demo models
+            config = {'use_batchnorm': False,
+                      'filters': utils.str_to_ints(FLAGS.filters),
+                      'binary_layers': binary_layers}
+            latencies, avg_err = evaluate_binary(data, config, log_dir)
+
+            lines.append('{:<8}{:>14.3f}{:>16}{:>16}{:>16}{:>12}'.format(
+                binary_layers, latencies['tf'], *['-' if latencies.get(key) is None else '{:.3f}'.format(
+                    latencies[key]) for key in ['tf_binary', 'xnor_binary', 'xnor_tf']],
+                '-' if avg_err is None else '{:.5f}'.format(avg_err)))
+        lines.append('')
+
+    return lines
+
+
+def evaluate_binary(data, config, log_dir):
+    latencies = dict()
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ResNet18_Revised(input_shape=data.input_shape,
+                                 min_values=data.min_values,
+                                 max_values=data.max_values,
+                                 domain=data.domain,
+                                 num_attribute=data.num_attribute,
+                                 lr=FLAGS.learning_rate,
+                                 weight_decay=FLAGS.weight_decay,
+                                 total_iters=max(FLAGS.train_iters, 1),
+                                 is_train=True,
+                                 log_dir=log_dir,
+                                 domain_min_values=data.domain_min_values,
+                                 domain_max_values=data.domain_max_values,
+                                 **utils.model_kwargs(config))
+
+        avg_err, params = None, None
+        if FLAGS.train_iters > 0:
+            solver = Solver(model, data)
+            for _ in range(FLAGS.train_iters):
+                solver.train(batch_size=FLAGS.batch_size)
+            avg_err, _ = solver.eval(batch_size=FLAGS.batch_size)
+            params = read_variables(solver.sess, name=model.name)
+            solver.sess.close()
+
+        cpu_sess = tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(device_count={'GPU': 0}))
+        cpu_sess.run(tf.compat.v1.global_variables_initializer())
+        if params is not None:
+            tf_utils.assign_variables(cpu_sess, params, name=model.name)
+        latencies['tf'] = measure_latency(cpu_sess, model, data)
+
+        if model.binary_output is not None:
+            img = 255. * np.random.randint(low=0, high=2, size=data.input_shape).astype(np.float32)
+            if params is None:
+                params = read_variables(cpu_sess, name=model.name)
+            kernels = np_utils.prepare_binary_kernels(params, config['binary_layers'], blocks=model.layers[0])
+
+            def binary_fn():
+                return np_utils.binary_trunk_forward(img, kernels, config['binary_layers'], blocks=model.layers[0])
+
+            def tf_binary_fn():
+                return cpu_sess.run(model.binary_output, feed_dict={model.img_tfph: img[None]})
+
+            def tail_fn():
+                # XNOR layers in numpy and the rest of the network in TF
+                return cpu_sess.run(model.unnorm_preds, feed_dict={model.binary_output: binary_fn()[None]})
+
+            latencies['tf_binary'] = measure_fn(tf_binary_fn)
+            latencies['xnor_binary'] = measure_fn(binary_fn)
+            latencies['xnor_tf'] = measure_fn(tail_fn)
+
+            max_diff = np.max(np.abs(binary_fn() - tf_binary_fn()[0]))
+            print(' [*] Binary layers: {}, max. abs. difference of XNOR and TF: {:.6f}'.format(
+                config['binary_layers'], max_diff))
+        cpu_sess.close()
+
+    return latencies, avg_err
+
+
+def read_variables(sess, name):
+    # Trained weights without the scope prefix, the same keys as tf_utils.read_checkpoint
+    variables = [variable for variable in tf.compat.v1.global_variables(name) if 'Adam' not in variable.op.name]
+    return {variable.op.name[len(name) + 1:]: value for variable, value in zip(variables, sess.run(variables))}
+
+
+def measure_fn(fn):
+    fn()  # warm-up
+    tic = time.time()
+    for _ in range(FLAGS.num_runs):
+        fn()
+    return (time.time() - tic) / FLAGS.num_runs * 1000.
+
+
+def bench_layout(log_dir):
+    lines = list()
+    for data_folder in FLAGS.data_folders.split(','):
+        data = Dataset(data=data_folder, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+        lines.append('Data: {}, input: {}, batch: {}'.format(data_folder, data.input_shape, FLAGS.batch_size))
+        lines.append('{:<8}{:>8}{:>14}{:>14}'.format('Layout', 'Fused', 'Step(ms)', 'Latency(ms)'))
+
+        for data_format in FLAGS.data_formats.split(','):
+            for fused_bn in [False, True]:
+                config = {'use_batchnorm': True,
+                          'filters': utils.str_to_ints(FLAGS.filters)}
+                step_time, latency = evaluate_speed(data, config, log_dir, data_format=data_format,
+                                                    fused_bn=fused_bn)
+
+                lines.append('{:<8}{:>8}{:>14}{:>14}'.format(
+                    data_format, str(fused_bn), *['unsupported' if value is None else '{:.3f}'.format(value)
+                                                  for value in [step_time, latency]]))
+        lines.append('')
+
+    return lines
+
+
+def bench_xla(log_dir):
+    lines = list()
+    for data_folder in FLAGS.data_folders.split(','):
+        data = Dataset(data=data_folder, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+        lines.append('Data: {}, input: {}, batch: {}'.format(data_folder, data.input_shape, FLAGS.batch_size))
+        lines.append('{:<8}{:>14}{:>9}{:>14}{:>9}'.format('XLA', 'Step(ms)', 'Speedup', 'Latency(ms)', 'Speedup'))
+
+        config = {'use_batchnorm': FLAGS.use_batchnorm,
+                  'filters': utils.str_to_ints(FLAGS.filters)}
+        base_times = evaluate_speed(data, config, log_dir, use_xla=False)
+        for use_xla in [False, True]:
+            times = evaluate_speed(data, config, log_dir, use_xla=True) if use_xla else base_times
+            if None in times:
+                lines.append('{:<8}{:>14}'.format('on' if use_xla else 'off', 'unsupported'))
+                continue
+
+            lines.append('{:<8}{:>14.3f}{:>8.2f}x{:>14.3f}{:>8.2f}x'.format(
+                'on' if use_xla else 'off', times[0], base_times[0] / times[0], times[1], base_times[1] / times[1]))
+        lines.append('')
+
+    return lines
+
+
+def evaluate_speed(data, config, log_dir, use_xla=False, data_format='NHWC', fused_bn=False):
+    # CPU training step time and batch-1 latency of one session setting and layout
+    step_time, latency = None, None
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ResNet18_Revised(input_shape=data.input_shape,
+                                 min_values=data.min_values,
+                                 max_values=data.max_values,
+                                 domain=data.domain,
+                                 num_attribute=data.num_attribute,
+                                 lr=FLAGS.learning_rate,
+                                 weight_decay=FLAGS.weight_decay,
+                                 is_train=True,
+                                 log_dir=log_dir,
+                                 domain_min_values=data.domain_min_values,
+                                 domain_max_values=data.domain_max_values,
+                                 data_format=data_format,
+                                 fused_bn=fused_bn,
+                                 **utils.model_kwargs(config))
+
+        cpu_sess = tf.compat.v1.Session(config=tf_utils.session_config(use_xla=use_xla, cpu_only=True))
+        cpu_sess.run(tf.compat.v1.global_variables_initializer())
+        try:
+            # Some CPU builds have no NCHW kernels for the convs and the poolings
+            step_time = measure_train_step(cpu_sess, model, data)
+            latency = measure_latency(cpu_sess, model, data)
+        except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError) as e:
+            print(' [!] {}, fused: {}, xla: {}: {}'.format(data_format, fused_bn, use_xla, e.message.split('\n')[0]))
+        cpu_sess.close()
+
+    tf_utils.set_data_format('NHWC')
+    return step_time, latency
+
+
+def measure_train_step(sess, model, data):
+    # The same batch every step, only the forward and backward pass is timed. The batch norms run in training mode,
+    # batch statistics and the update of the moving statistics
+    if data.domain == 'all':
+        imgs, labels, domains = data.train_random_batch(batch_size=FLAGS.batch_size, with_domain=True)
+        feed = {model.img_tfph: imgs, model.gt_tfph: labels, model.domain_tfph: domains}
+    else:
+        imgs, labels = data.train_random_batch(batch_size=FLAGS.batch_size)
+        feed = {model.img_tfph: imgs, model.gt_tfph: labels}
+    feed[model.train_mode] = True
+
+    sess.run(model.train_op, feed_dict=feed)  # warm-up
+    tic = time.time()
+    for _ in range(FLAGS.train_steps):
+        sess.run(model.train_op, feed_dict=feed)
+    return (time.time() - tic) / FLAGS.train_steps * 1000.
+
+
+def evaluate(data, config, log_dir):
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ResNet18_Revised(input_shape=data.input_shape,
+                                 min_values=data.min_values,
+                                 max_values=data.max_values,
+                                 domain=data.domain,
+                                 num_attribute=data.num_attribute,
+                                 lr=FLAGS.learning_rate,
+                                 weight_decay=FLAGS.weight_decay,
+                                 total_iters=max(FLAGS.train_iters, 1),
+                                 is_train=True,
+                                 log_dir=log_dir,
+                                 domain_min_values=data.domain_min_values,
+                                 domain_max_values=data.domain_max_values,
+                                 **utils.model_kwargs(config))
+        num_params = int(sum(np.prod(variable.get_shape().as_list())
+                             for variable in tf.compat.v1.trainable_variables()))
+        inner_width = [variable.get_shape().as_list()[-1] for variable in tf.compat.v1.trainable_variables()
+                       if variable.op.name.endswith('block_layer1_1/conv_0/w')][0]
+
+        # Batch-1 latency on CPU, the values of the weights do not change the latency
+        cpu_sess = tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(device_count={'GPU': 0}))
+        cpu_sess.run(tf.compat.v1.global_variables_initializer())
+        latency = measure_latency(cpu_sess, model, data)
+        cpu_sess.close()
+
+        avg_err = None
+        if FLAGS.train_iters > 0:
+            solver = Solver(model, data)
+            for _ in range(FLAGS.train_iters):
+                solver.train(batch_size=FLAGS.batch_size)
+            avg_err, _ = solver.eval(batch_size=FLAGS.batch_size)
+            solver.sess.close()
+
+    return num_params, latency, avg_err, inner_width
+
+
+def measure_latency(sess, model, data, batch_size=1):
+    imgs = 255. * np.random.randint(low=0, high=2, size=(batch_size, *data.input_shape)).astype(np.float32)
+    feed = {model.img_tfph: imgs}
+
+    sess.run(model.unnorm_preds, feed_dict=feed)  # warm-up
+    tic = time.time()
+    for _ in range(FLAGS.num_runs):
+        sess.run(model.unnorm_preds, feed_dict=feed)
+    return (time.time() - tic) / FLAGS.num_runs * 1000.
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
@@ -0,0 +1,260 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Structured channel pruning of the residual blocks with a short fine-tune
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+import utils as utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+from rg_solver import Solver
+from resnet import ResNet18_Revised
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '0', 'gpu index if you have multiple gpus, default: 0')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('load_model', None, 'folder of the trained model to prune (e.g. 20191222-230522), the pruned '
+                                           'model is saved in <load_model>_pruned, default: None')
+tf.flags.DEFINE_float('inner_ratio', 0.5, 'ratio of the pruned conv_0 filters in each residual block, default: 0.5')
+tf.flags.DEFINE_float('stage_ratio', 0., 'ratio of the pruned residual channels in each block_layer, shared by conv_1 '
+                                         'and the projection shortcut of the stage, default: 0.')
+tf.flags.DEFINE_integer('channel_multiple', 8, 'kept channels are rounded to a multiple of this value, default: 8')
+tf.flags.DEFINE_integer('finetune_iters', 2000, 'number of fine-tuning iterations of the pruned model, default: 2000')
+tf.flags.DEFINE_integer('eval_freq', 200, 'evaluation frequency during fine-tuning, default: 200')
+tf.flags.DEFINE_integer('batch_size', 128, 'batch size for one iteration, default: 128')
+tf.flags.DEFINE_float('learning_rate', 1e-4, 'initial learning rate of the fine-tuning, default: 0.0001')
+tf.flags.DEFINE_float('weight_decay', 1e-6, 'weight decay of the fine-tuning, default: 1e-6')
+tf.flags.DEFINE_integer('num_runs', 100, 'number of runs to measure the per-frame latency, default: 100')
+
+BN_VARIABLES = ['beta', 'gamma', 'moving_mean', 'moving_variance']
+BN_EPSILON = 1e-5   # the same epsilon as tensorflow_utils.batch_norm
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+
+    if FLAGS.load_model is None:
+        exit(' [!] Please select the model folder with --load_model')
+
+    org_model_dir = os.path.join('../model', FLAGS.load_model)
+    ckpt = tf.train.get_checkpoint_state(org_model_dir)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        exit(' [!] Failed to find checkpoint in {}'.format(org_model_dir))
+
+    model_dir, log_dir = utils.make_folders_simple(cur_time=FLAGS.load_model + '_pruned')
+    data = Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+    config = {'use_batchnorm': False, 'layers': [2, 2, 2, 2], 'filters': [64, 128, 256, 512]}
+    config.update(utils.read_model_config(org_model_dir))
+    if config.get('fc_ranks'):
+        exit(' [!] Channel pruning needs the dense FC1 rows, prune before the low-rank factorization')
+    if config.get('block_type', 'basic') != 'basic' or config.get('binary_layers', 0) > 0:
+        exit(' [!] Channel pruning only supports the float basic blocks')
+
+    params = tf_utils.read_checkpoint(ckpt.model_checkpoint_path)
+    for name in ['FC1', 'FC2']:
+        if name + '/mask' in params:
+            params[name + '/matrix'] = params[name + '/matrix'] * params.pop(name + '/mask')
+
+    pruned, pruned_config = prune_params(params, config, FLAGS.inner_ratio, FLAGS.stage_ratio, FLAGS.channel_multiple)
+    utils.write_model_config(model_dir, pruned_config)
+    print(' [*] Filters: {} -> {}'.format(config['filters'], pruned_config['filters']))
+    print(' [*] Inner filters: {}'.format(pruned_config['inner_filters']))
+
+    # Original model
+    org_graph = tf.Graph()
+    with org_graph.as_default():
+        org_solver = Solver(build_model(data, config, log_dir), data)
+        tf.compat.v1.train.Saver().restore(org_solver.sess, ckpt.model_checkpoint_path)
+        org_err, _ = org_solver.eval(batch_size=FLAGS.batch_size)
+        org_latency = measure_latency(org_solver, data)
+
+    # Physically narrower model initialized with the kept channels
+    graph = tf.Graph()
+    with graph.as_default():
+        solver = Solver(build_model(data, pruned_config, log_dir), data)
+        num_assigned = tf_utils.assign_variables(solver.sess, pruned, name=solver.model.name)
+        print(' [*] Assigned {} of {} pruned variables'.format(num_assigned, len(pruned)))
+        saver = tf.compat.v1.train.Saver(max_to_keep=1)
+
+        pruned_err, _ = solver.eval(batch_size=FLAGS.batch_size)
+        best_err = finetune(solver, saver, model_dir, log_dir, pruned_err)
+        latency = measure_latency(solver, data)
+
+    lines = list()
+    lines.append('Original: {}, Pruned: {}'.format(org_model_dir, model_dir))
+    lines.append('Filters: {} -> {}, Inner filters: {}'.format(
+        config['filters'], pruned_config['filters'], pruned_config['inner_filters']))
+    lines.append('Conv trunk params: {:,} -> {:,}'.format(trunk_size(params), trunk_size(pruned)))
+    lines.append('Latency (batch 1): {:.3f} msec -> {:.3f} msec, {:.2f}x'.format(
+        org_latency, latency, org_latency / latency))
+    lines.append('Avg. Error: original {:.5f}, pruned {:.5f}, fine-tuned {:.5f}'.format(org_err, pruned_err, best_err))
+
+    with open(os.path.join(log_dir, 'channel_prune_report.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    for line in lines:
+        print(line)
+
+
+def build_model(data, config, log_dir):
+    return ResNet18_Revised(input_shape=data.input_shape,
+                            min_values=data.min_values,
+                            max_values=data.max_values,
+                            domain=data.domain,
+                            num_attribute=data.num_attribute,
+                            lr=FLAGS.learning_rate,
+                            weight_decay=FLAGS.weight_decay,
+                            total_iters=max(FLAGS.finetune_iters, 1),
+                            is_train=True,
+                            log_dir=log_dir,
+                            domain_min_values=data.domain_min_values,
+                            domain_max_values=data.domain_max_values,
+                            **utils.model_kwargs(config))
+
+
+def l1_saliency(weight, axis=3):
+    # L1 norm of each filter along the given channel axis of a [k_h, k_w, in, out] kernel
+    return np.sum(np.abs(weight), axis=tuple(idx for idx in range(weight.ndim) if idx != axis))
+
+
+def num_keep(num_channels, ratio, multiple):
+    keep = int(round(num_channels * (1. - ratio) / multiple)) * multiple
+    return int(np.clip(keep, min(multiple, num_channels), num_channels))
+
+
+def top_channels(scores, keep):
+    # Indices of the most salient channels in the original order
+    return np.sort(np.argsort(scores)[::-1][:keep])
+
+
+def take(params, key, indices, axis):
+    params[key] = np.take(params[key], indices, axis=axis)
+
+
+def prune_params(params, config, inner_ratio, stage_ratio, multiple):
+    use_batchnorm = config.get('use_batchnorm', False)
+    pruned = dict(params)
+    filters, inner_filters = list(), list()
+
+    prev_keep = None    # kept residual channels of the previous stage, conv1 is not pruned
+    for stage, blocks in enumerate(config['layers']):
+        scopes = ['block_layer{}_{}'.format(stage + 1, block + 1) for block in range(blocks)]
+
+        # Residual channels are shared by conv_1 of every block and the projection shortcut of the stage
+        stage_scores = l1_saliency(params[scopes[0] + '/conv_projection/w'])
+        for scope in scopes:
+            stage_scores = stage_scores + l1_saliency(params[scope + '/conv_1/w'])
+        keep = top_channels(stage_scores, num_keep(stage_scores.size, stage_ratio, multiple))
+        filters.append(int(keep.size))
+
+        widths = list()
+        for block, scope in enumerate(scopes):
+            # A conv_0 filter matters when both the filter and its outgoing conv_1 weights are large
+            inner_scores = l1_saliency(params[scope + '/conv_0/w']) * l1_saliency(params[scope + '/conv_1/w'], axis=2)
+            if use_batchnorm:
+                inner_scores = inner_scores * np.abs(params[scope + '/batch_norm_1/gamma']) / np.sqrt(
+                    params[scope + '/batch_norm_1/moving_variance'] + BN_EPSILON)
+            inner_keep = top_channels(inner_scores, num_keep(inner_scores.size, inner_ratio, multiple))
+            widths.append(int(inner_keep.size))
+
+            take(pruned, scope + '/conv_0/w', inner_keep, axis=3)
+            take(pruned, scope + '/conv_0/biases', inner_keep, axis=0)
+            take(pruned, scope + '/conv_1/w', inner_keep, axis=2)
+            if use_batchnorm:
+                for var_name in BN_VARIABLES:
+                    take(pruned, scope + '/batch_norm_1/' + var_name, inner_keep, axis=0)
+
+            # Block input
+            in_keep = prev_keep if block == 0 else keep
+            if in_keep is not None:
+                take(pruned, scope + '/conv_0/w', in_keep, axis=2)
+                if block == 0:
+                    take(pruned, scope + '/conv_projection/w', in_keep, axis=2)
+                if use_batchnorm:
+                    for var_name in BN_VARIABLES:
+                        take(pruned, scope + '/batch_norm_0/' + var_name, in_keep, axis=0)
+
+            # Block output
+            take(pruned, scope + '/conv_1/w', keep, axis=3)
+            take(pruned, scope + '/conv_1/biases', keep, axis=0)
+            if block == 0:
+                take(pruned, scope + '/conv_projection/w', keep, axis=3)
+                take(pruned, scope + '/conv_projection/biases', keep, axis=0)
+
+        inner_filters.append(widths)
+        prev_keep = keep
+
+        # Early-exit heads pool the outputs of block_layer2 and block_layer3
+        exit_name = {1: 'exit1', 2: 'exit2'}.get(stage)
+        if exit_name is not None and exit_name + '/FC1/matrix' in pruned:
+            take(pruned, exit_name + '/FC1/matrix', keep, axis=0)
+
+    if use_batchnorm:
+        for var_name in BN_VARIABLES:
+            take(pruned, 'before_gap_batch_norm/' + var_name, prev_keep, axis=0)
+
+    # FC1 rows follow the flatten order (h, w, c) of the last block_layer
+    matrix = params['FC1/matrix']
+    matrix = matrix.reshape(-1, stage_scores.size, matrix.shape[1])[:, prev_keep, :]
+    pruned['FC1/matrix'] = matrix.reshape(-1, matrix.shape[2])
+
+    pruned_config = dict(config)
+    pruned_config.update({'filters': filters, 'inner_filters': inner_filters})
+    return pruned, pruned_config
+
+
+def finetune(solver, saver, model_dir, log_dir, pruned_err):
+    best_avg_err = pruned_err
+    saver.save(solver.sess, os.path.join(model_dir, 'model'), global_step=0)
+
+    tb_writer = tf.compat.v1.summary.FileWriter(logdir=log_dir, graph=solver.sess.graph_def)
+    for iter_time in range(FLAGS.finetune_iters):
+        total_loss, data_loss, reg_term, summary = solver.train(batch_size=FLAGS.batch_size)
+        tb_writer.add_summary(summary, iter_time)
+
+        if ((iter_time + 1) % FLAGS.eval_freq == 0) or (iter_time + 1 == FLAGS.finetune_iters):
+            print("[{0:6} / {1:6}] Total loss: {2:.5f}, Data loss: {3:.5f}, Reg. term: {4:.5f}".format(
+                iter_time, FLAGS.finetune_iters, total_loss, data_loss, reg_term))
+
+            avg_err, eval_summary = solver.eval(batch_size=FLAGS.batch_size)
+            tb_writer.add_summary(eval_summary, iter_time)
+            tb_writer.flush()
+
+            if avg_err < best_avg_err:
+                best_avg_err = avg_err
+                saver.save(solver.sess, os.path.join(model_dir, 'model'), global_step=iter_time + 1)
+
+            print('Avg. Error: {:.5f}, Best Avg. Error: {:.5f}'.format(avg_err, best_avg_err))
+
+    return best_avg_err
+
+
+def measure_latency(solver, data, batch_size=1):
+    imgs = 255. * np.random.randint(low=0, high=2, size=(batch_size, *data.input_shape)).astype(np.float32)
+    feed = {solver.model.img_tfph: imgs}
+
+    solver.sess.run(solver.model.unnorm_preds, feed_dict=feed)  # warm-up
+    tic = time.time()
+    for _ in range(FLAGS.num_runs):
+        solver.sess.run(solver.model.unnorm_preds, feed_dict=feed)
+    return (time.time() - tic) / FLAGS.num_runs * 1000.
+
+
+def trunk_size(params):
+    # Number of the conv trunk parameters, the FC head is not pruned by channels
+    return sum(value.size for key, value in params.items() if key.split('/')[0].startswith(
+        ('conv1', 'block_layer', 'before_gap_batch_norm')))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
@@ -14,16 +14,23 @@ import utils as utils
 
 class Dataset(object):
     def __init__(self, data=None, mode=0, domain='xy', img_format='.jpg', resize_factor=0.5, num_attribute=6,
-                 is_train=True, log_dir=None, is_debug=False, test_data_folder=None):
+                 is_train=True, log_dir=None, is_debug=False, test_data_folder=None, shard_index=0, num_shards=1,
+                 cache_dir=None):
         self.data= data
         self.mode = mode
         self.domain = domain
+        # Unified multi-domain model samples from both xy and rarb folders
+        self.domains = ['xy', 'rarb'] if self.domain == 'all' else [self.domain]
         self.img_format = img_format
         self.resize_factor = resize_factor
         self.is_train = is_train
         self.log_dir = log_dir
         self.is_debug = is_debug
         self.test_data_folder = test_data_folder
+        self.shard_index = shard_index  # data-parallel workers sample from disjoint shards of the training data
+        self.num_shards = num_shards
+        self.cache_dir = cache_dir      # preprocessed images shared by the runs of a sweep
+        self.cache = None
 
         if self.data == '01':
             self.top_left = (20, 100)
@@ -48,6 +55,9 @@ class Dataset(object):
 
         self._read_min_max_info()   # read min and max values from the .npy file
         self._read_img_path()       # read all img paths
+        self.train_indexes = np.arange(self.shard_index, self.num_train, self.num_shards)
+        if self.cache_dir is not None:
+            self._init_cache()
 
         self.print_parameters()
         if self.is_debug and self.mode == 0:
@@ -67,6 +77,7 @@ class Dataset(object):
             self.logger.info('bottom_right: \t\t{}'.format(self.bottom_right))
             self.logger.info('binarize_threshold: \t\t{}'.format(self.binarize_threshold))
             self.logger.info('Num. of train samples: \t{}'.format(self.num_train))
+            self.logger.info('Shard: \t\t\t{} / {}'.format(self.shard_index, self.num_shards))
             self.logger.info('Num. of val samples: \t{}'.format(self.num_val))
             self.logger.info('Num of test samples: \t{}'.format(self.num_test))
             self.logger.info('Num. of train left_imgs: \t{}'.format(len(self.train_left_img_paths)))
@@ -178,7 +189,16 @@ class Dataset(object):
             cv2.imwrite(os.path.join(save_folder, 's5_resize_' + os.path.basename(left_path)), resize_canvas)
 
     def _read_min_max_info(self):
-        min_max_data = np.load(os.path.join('../data', 'rg_' + self.domain + '_train_' + self.data + '.npy'))
+        domain_min_max_data = np.asarray([
+            np.load(os.path.join('../data', 'rg_' + domain + '_train_' + self.data + '.npy')) for domain in self.domains])
+        self.domain_min_values = domain_min_max_data[:, 0::2]
+        self.domain_max_values = domain_min_max_data[:, 1::2]
+
+        # Labels of all domains are normalized with the joint min and max values
+        min_max_data = np.zeros(domain_min_max_data.shape[1], dtype=domain_min_max_data.dtype)
+        min_max_data[0::2] = np.min(self.domain_min_values, axis=0)
+        min_max_data[1::2] = np.max(self.domain_max_values, axis=0)
+
         self.x_min = min_max_data[0]
         self.x_max = min_max_data[1]
         self.y_min = min_max_data[2]
@@ -199,6 +219,7 @@ class Dataset(object):
         self.train_left_img_paths, self.train_right_img_paths = list(), list()
         self.val_left_img_paths, self.val_right_img_paths = list(), list()
         self.test_left_img_paths, self.test_right_img_paths = list(), list()
+        self.train_domain_ids = list()
         self.num_train, self.num_val, self.num_test = 0, 0, 0
 
         if self.is_train:
@@ -208,15 +229,23 @@ class Dataset(object):
             self._read_test_img_path()      # Read test img paths
 
     def _read_train_img_path(self):
-        if self.mode == 0 or self.mode == 1:
-            self.train_left_img_paths = utils.all_files_under(
-                folder=os.path.join('../data', 'rg_' + self.domain + '_train_' + self.data),
-                endswith=self.img_format, condition='L_')
+        for domain_id, domain in enumerate(self.domains):
+            left_img_paths, right_img_paths = list(), list()
+            if self.mode == 0 or self.mode == 1:
+                left_img_paths = utils.all_files_under(
+                    folder=os.path.join('../data', 'rg_' + domain + '_train_' + self.data),
+                    endswith=self.img_format, condition='L_')
 
-        if self.mode == 0 or self.mode == 2:
-            self.train_right_img_paths = utils.all_files_under(
-                folder=os.path.join('../data', 'rg_' + self.domain + '_train_' + self.data),
-                endswith=self.img_format, condition='R_')
+            if self.mode == 0 or self.mode == 2:
+                right_img_paths = utils.all_files_under(
+                    folder=os.path.join('../data', 'rg_' + domain + '_train_' + self.data),
+                    endswith=self.img_format, condition='R_')
+
+            self.train_left_img_paths += left_img_paths
+            self.train_right_img_paths += right_img_paths
+            self.train_domain_ids += [domain_id] * max(len(left_img_paths), len(right_img_paths))
+
+        self.train_domain_ids = np.asarray(self.train_domain_ids, dtype=np.int32)
 
         if self.mode == 0:
             assert len(self.train_left_img_paths) == len(self.train_right_img_paths)
@@ -229,15 +258,16 @@ class Dataset(object):
             raise NotImplementedError
 
     def _read_val_img_path(self):
-        if self.mode == 0 or self.mode == 1:
-            self.val_left_img_paths = utils.all_files_under(
-                folder=os.path.join('../data', 'rg_' + self.domain + '_val_' + self.data),
-                endswith=self.img_format, condition='L_')
+        for domain in self.domains:
+            if self.mode == 0 or self.mode == 1:
+                self.val_left_img_paths += utils.all_files_under(
+                    folder=os.path.join('../data', 'rg_' + domain + '_val_' + self.data),
+                    endswith=self.img_format, condition='L_')
 
-        if self.mode == 0 or self.mode == 2:
-            self.val_right_img_paths = utils.all_files_under(
-                folder=os.path.join('../data', 'rg_'  + self.domain + '_val_' + self.data),
-                endswith=self.img_format, condition='R_')
+            if self.mode == 0 or self.mode == 2:
+                self.val_right_img_paths += utils.all_files_under(
+                    folder=os.path.join('../data', 'rg_'  + domain + '_val_' + self.data),
+                    endswith=self.img_format, condition='R_')
 
         if self.mode == 0:
             assert len(self.val_left_img_paths) == len(self.val_right_img_paths)
@@ -252,9 +282,10 @@ class Dataset(object):
     def _read_test_img_path(self):
         if self.mode == 0 or self.mode == 1:
             if self.test_data_folder is None:
-                self.test_left_img_paths = utils.all_files_under(
-                    folder=os.path.join('../data', 'rg_' + self.domain + '_test_' + self.data),
-                    endswith=self.img_format, condition='L_')
+                for domain in self.domains:
+                    self.test_left_img_paths += utils.all_files_under(
+                        folder=os.path.join('../data', 'rg_' + domain + '_test_' + self.data),
+                        endswith=self.img_format, condition='L_')
             else:
                 self.test_left_img_paths = utils.all_files_under(
                     folder=os.path.join('../data', self.test_data_folder),
@@ -262,13 +293,15 @@ class Dataset(object):
 
         if self.mode == 0 or self.mode == 2:
             if self.test_data_folder is None:
-                self.test_right_img_paths = utils.all_files_under(
-                    folder=os.path.join('../data', 'rg_' + self.domain + '_test_' + self.data),
-                    endswith=self.img_format, condition='R_')
-
-                self.test_left_img_paths = utils.all_files_under(
-                    folder=os.path.join('../data', 'rg_' + self.domain + '_test_' + self.data),
-                    endswith=self.img_format, condition='L_')
+                self.test_left_img_paths = list()
+                for domain in self.domains:
+                    self.test_right_img_paths += utils.all_files_under(
+                        folder=os.path.join('../data', 'rg_' + domain + '_test_' + self.data),
+                        endswith=self.img_format, condition='R_')
+
+                    self.test_left_img_paths += utils.all_files_under(
+                        folder=os.path.join('../data', 'rg_' + domain + '_test_' + self.data),
+                        endswith=self.img_format, condition='L_')
             else:
                 self.test_right_img_paths = utils.all_files_under(
                     folder=os.path.join('../data', self.test_data_folder),
@@ -284,8 +317,59 @@ class Dataset(object):
         else:
             raise NotImplementedError
 
-    def train_random_batch(self, batch_size=4):
-        indexes = np.random.random_integers(low=0, high=self.num_train-1, size=batch_size)
+    def _init_cache(self):
+        # Memory-mapped .npy files of the preprocessed images, written once and read by every run with the same input
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        self.cache = dict()
+        for stage in (['train', 'val'] if self.is_train else ['test']):
+            imgs_path, labels_path = self.cache_paths(stage)
+            if not (os.path.isfile(imgs_path) and os.path.isfile(labels_path)):
+                self._write_cache(stage, imgs_path, labels_path)
+            self.cache[stage] = (np.load(imgs_path, mmap_mode='r'), np.load(labels_path))
+
+    def cache_paths(self, stage):
+        # Every setting of data_reader is in the name, runs with other preprocessing never share a file
+        name = 'rg_{}_{}_{}'.format(self.domain, stage, self.data)
+        if stage == 'test' and self.test_data_folder is not None:
+            name = 'rg_{}'.format(self.test_data_folder)
+        name += '_mode{}_{}x{}_{}_th{:g}_{}_{}'.format(self.mode, *self.input_shape[:2], self.img_format.strip('.'),
+                                                      self.binarize_threshold, *self.top_left)
+        return os.path.join(self.cache_dir, name + '_imgs.npy'), os.path.join(self.cache_dir, name + '_labels.npy')
+
+    def _write_cache(self, stage, imgs_path, labels_path, batch_size=256):
+        left_img_paths = getattr(self, stage + '_left_img_paths')
+        right_img_paths = getattr(self, stage + '_right_img_paths')
+        num_imgs = getattr(self, 'num_' + stage)
+        self.logger.info(' [*] Caching {} {} images in {}...'.format(num_imgs, stage, imgs_path))
+
+        # Written under a temporary name, a concurrent run never reads a partial file
+        tmp_path = '{}.{}.tmp'.format(imgs_path, os.getpid())
+        imgs = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(num_imgs, *self.input_shape))
+        labels = list()
+        for start_index in range(0, num_imgs, batch_size):
+            end_index = min(start_index + batch_size, num_imgs)
+            batch_imgs, batch_labels = self.data_reader(left_img_paths[start_index:end_index],
+                                                        right_img_paths[start_index:end_index])
+            imgs[start_index:end_index] = batch_imgs.astype(np.uint8)    # binary images of 0 and 255
+            labels.append(batch_labels)
+        imgs.flush()
+        del imgs
+        os.replace(tmp_path, imgs_path)
+
+        tmp_path = '{}.{}.tmp'.format(labels_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.concatenate(labels, axis=0))
+        os.replace(tmp_path, labels_path)
+
+    def train_random_batch(self, batch_size=4, with_domain=False):
+        indexes = self.train_indexes[np.random.random_integers(low=0, high=len(self.train_indexes)-1, size=batch_size)]
+        if self.cache is not None:
+            imgs, labels = self.cache['train']
+            batch = (imgs[indexes].astype(np.float32), labels[indexes])
+            return (*batch, self.train_domain_ids[indexes]) if with_domain else batch
+
         left_img_paths, right_img_paths = None, None
 
         if self.mode == 0 or self.mode == 1:
@@ -294,6 +378,8 @@ class Dataset(object):
         if self.mode == 0 or self.mode == 2:
             right_img_paths = [self.train_right_img_paths[index] for index in indexes]
 
+        if with_domain:
+            return (*self.data_reader(left_img_paths, right_img_paths), self.train_domain_ids[indexes])
         return self.data_reader(left_img_paths, right_img_paths)
 
     def direct_batch(self, batch_size, start_index, stage='val'):
@@ -313,6 +399,10 @@ class Dataset(object):
         else:
             end_index = num_imgs
 
+        if self.cache is not None:
+            imgs, labels = self.cache[stage]
+            return imgs[start_index:end_index].astype(np.float32), labels[start_index:end_index]
+
         # Select indexes
         indexes = [idx for idx in range(start_index, end_index)]
 
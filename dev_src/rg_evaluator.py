@@ -0,0 +1,190 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Side-process evaluator that scores the training snapshots and keeps the best model
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import glob
+import time
+import shutil
+import numpy as np
+import tensorflow as tf
+
+import utils as utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+from resnet import ResNet18_Revised
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '', 'gpu index of the evaluator, empty for CPU only, default: ""')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('img_format', '.jpg', 'image format, default: .jpg')
+tf.flags.DEFINE_float('resize_factor', 0.5, 'resize the original input image, default: 0.5')
+tf.flags.DEFINE_string('load_model', None, 'folder of the model in training (e.g. 20191222-230522), default: None')
+tf.flags.DEFINE_integer('batch_size', 128, 'batch size of the evaluation, default: 128')
+tf.flags.DEFINE_integer('num_threads', 0, 'intra-op threads of the evaluator, 0 for all cores, default: 0')
+tf.flags.DEFINE_integer('min_iter', 0, 'snapshots before this iteration are scored but never selected as the best, '
+                                       'e.g. the end of the pruning schedule, default: 0')
+tf.flags.DEFINE_float('poll_secs', 10., 'seconds between two checks of the snapshot folder, default: 10.')
+tf.flags.DEFINE_string('cache_dir', '', 'folder of the preprocessed images of the training, empty for no cache, '
+                                       'default: ""')
+tf.flags.DEFINE_integer('parent_pid', 0, 'process id of the training, the evaluator stops when it is gone, 0 for '
+                                         'no parent, default: 0')
+
+ATTRIBUTES = ['X', 'Y', 'Ra', 'Rb', 'F', 'D']
+
+
+class Evaluator(object):
+    def __init__(self, data, model_dir, log_dir, min_iter=0, num_threads=0, batch_size=128, parent_pid=0):
+        self.data = data
+        self.model_dir = model_dir
+        self.snapshot_dir = os.path.join(model_dir, utils.SNAPSHOT_FOLDER)
+        self.min_iter = min_iter
+        self.batch_size = batch_size
+        self.parent_pid = parent_pid
+        self.scored = set()
+
+        self.best_record = utils.read_best_record(self.model_dir)
+        self.best_avg_err = self.best_record['avg_err'] if self.best_record is not None else np.inf
+
+        self.model = ResNet18_Revised(input_shape=data.input_shape,
+                                      min_values=data.min_values,
+                                      max_values=data.max_values,
+                                      domain=data.domain,
+                                      num_attribute=data.num_attribute,
+                                      is_train=False,
+                                      inference_only=True,
+                                      with_metrics=False,
+                                      domain_min_values=data.domain_min_values,
+                                      domain_max_values=data.domain_max_values,
+                                      **utils.model_kwargs(utils.read_model_config(model_dir)))
+        self.sess = tf.compat.v1.Session(config=tf_utils.session_config(num_threads=num_threads))
+        self.saver = tf.compat.v1.train.Saver()
+        self.tb_writer = tf.compat.v1.summary.FileWriter(logdir=log_dir)
+
+    def new_snapshots(self):
+        ckpt = tf.train.get_checkpoint_state(self.snapshot_dir)
+        if not ckpt:
+            return list()
+
+        paths = [os.path.join(self.snapshot_dir, os.path.basename(path)) for path in ckpt.all_model_checkpoint_paths]
+        return [path for path in paths if path not in self.scored]
+
+    def run(self, poll_secs=10.):
+        while True:
+            # The done file is checked first, the last snapshot is already listed when it exists
+            is_done = os.path.isfile(os.path.join(self.snapshot_dir, utils.SNAPSHOT_DONE_FILE))
+            snapshots = self.new_snapshots()
+            for snapshot in snapshots:
+                self.score(snapshot)
+
+            if is_done or not self.parent_alive():
+                break
+            if len(snapshots) == 0:
+                time.sleep(poll_secs)
+
+        self.tb_writer.close()
+
+    def parent_alive(self):
+        if self.parent_pid == 0:
+            return True
+
+        try:
+            os.kill(self.parent_pid, 0)
+        except OSError:
+            print(' [!] Training process {} is gone'.format(self.parent_pid))
+            return False
+        return True
+
+    def score(self, snapshot):
+        self.scored.add(snapshot)
+        iter_time = int(snapshot.split('-')[-1])
+
+        try:
+            self.saver.restore(self.sess, snapshot)
+        except (tf.errors.NotFoundError, ValueError):
+            print(' [!] Snapshot {} was removed before the evaluation'.format(snapshot))
+            return
+
+        errors = self.val_errors()
+        avg_err = float(np.mean(errors))
+
+        summary = tf.compat.v1.Summary(value=[tf.compat.v1.Summary.Value(tag='Eval/{}_err'.format(attr),
+                                                                         simple_value=err)
+                                              for attr, err in zip(ATTRIBUTES, errors)] +
+                                             [tf.compat.v1.Summary.Value(tag='Eval/avg_err', simple_value=avg_err)])
+        self.tb_writer.add_summary(summary, iter_time)
+        self.tb_writer.flush()
+
+        if (avg_err < self.best_avg_err) and (iter_time >= self.min_iter):
+            self.best_avg_err = avg_err
+            self.keep_best(snapshot, iter_time, errors)
+
+        if self.best_record is not None:
+            # scored_iter tells the training loop that one more evaluation is done, also without an improvement
+            self.best_record['scored_iter'] = iter_time
+            utils.write_best_record(self.model_dir, self.best_record)
+
+        print('Iter: {}, Avg. Error: {:.5f}, Best Avg. Error: {:.5f}'.format(iter_time, avg_err, self.best_avg_err))
+
+    def val_errors(self):
+        # Sum of the per-sample errors in numpy, the same avg. error as ResNet18_Revised.avg_err
+        errors = np.zeros(self.data.num_attribute, dtype=np.float64)
+        for index in range(0, self.data.num_val, self.batch_size):
+            img_vals, label_vals = self.data.direct_batch(batch_size=self.batch_size, start_index=index, stage='val')
+            unnorm_preds = self.sess.run(self.model.unnorm_preds, feed_dict={self.model.img_tfph: img_vals})
+            errors += np.sum(np.sqrt(np.square(unnorm_preds - self.data.unnormalize(label_vals))), axis=0)
+
+        return errors / self.data.num_val
+
+    def keep_best(self, snapshot, iter_time, errors):
+        # The best snapshot replaces the model of the model folder, the demo loader finds it as before
+        old_files = glob.glob(os.path.join(self.model_dir, 'model-*'))
+        for path in glob.glob(snapshot + '.*'):
+            shutil.copy(path, self.model_dir)
+
+        best_path = os.path.join(self.model_dir, os.path.basename(snapshot))
+        tf.compat.v1.train.update_checkpoint_state(self.model_dir, best_path)
+        for path in old_files:
+            if not os.path.basename(path).startswith(os.path.basename(snapshot) + '.'):
+                os.remove(path)
+
+        self.best_record = {'iter_time': iter_time,
+                            'avg_err': self.best_avg_err,
+                            'errors': [float(err) for err in errors],
+                            'snapshot': os.path.basename(snapshot)}
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+
+    if FLAGS.load_model is None:
+        exit(' [!] Please select the model folder with --load_model')
+
+    model_dir, log_dir = utils.make_folders_simple(cur_time=FLAGS.load_model)
+    log_dir = os.path.join(log_dir, 'evaluator')
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    data = Dataset(data=FLAGS.data,
+                   mode=FLAGS.mode,
+                   domain=FLAGS.domain,
+                   img_format=FLAGS.img_format,
+                   resize_factor=FLAGS.resize_factor,
+                   is_train=True,
+                   log_dir=log_dir,
+                   cache_dir=FLAGS.cache_dir or None)
+
+    evaluator = Evaluator(data, model_dir, log_dir, min_iter=FLAGS.min_iter, num_threads=FLAGS.num_threads,
+                          batch_size=FLAGS.batch_size, parent_pid=FLAGS.parent_pid)
+    evaluator.run(poll_secs=FLAGS.poll_secs)
+    print(' [!] Finished, Best Avg. Error: {:.5f}'.format(evaluator.best_avg_err))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
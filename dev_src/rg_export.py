@@ -0,0 +1,248 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Export-time graph optimizer for the regression model
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+import utils as utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+from resnet import ResNet18_Revised
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '0', 'gpu index if you have multiple gpus, default: 0')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('load_model', None, 'folder of the trained model to export (e.g. 20191222-230522), default: None')
+tf.flags.DEFINE_string('graph_name', 'inference_graph.pb', 'file name of the exported graph in the model folder, '
+                                                          'default: inference_graph.pb')
+tf.flags.DEFINE_integer('num_runs', 100, 'number of runs to compare the latency of the two graphs, default: 100')
+
+BN_EPSILON = 1e-5   # the same epsilon as tensorflow_utils.batch_norm
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+
+    if FLAGS.load_model is None:
+        exit(' [!] Please select the model folder with --load_model')
+
+    model_dir = os.path.join('../model', FLAGS.load_model)
+    config = utils.read_model_config(model_dir)
+    if config.get('block_type', 'basic') != 'basic':
+        exit(' [!] Only the basic blocks are folded, {} blocks are not supported'.format(config['block_type']))
+    if config.get('binary_layers', 0) > 0:
+        exit(' [!] Binary layers are not folded, use the XNOR kernels of numpy_utils')
+    data = Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, is_train=False)
+
+    ckpt = tf.train.get_checkpoint_state(model_dir)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        exit(' [!] Failed to find checkpoint in {}'.format(model_dir))
+
+    print(' [*] Folding {}...'.format(ckpt.model_checkpoint_path))
+    params = tf_utils.read_checkpoint(ckpt.model_checkpoint_path)
+    folded = fold_params(params, config, data.min_values, data.max_values)
+
+    graph = build_inference_graph(folded, data.input_shape, config)
+    tf.io.write_graph(graph.as_graph_def(), model_dir, FLAGS.graph_name, as_text=False)
+    print(' [!] Inference graph saved: {}'.format(os.path.join(model_dir, FLAGS.graph_name)))
+
+    verify(graph, ckpt.model_checkpoint_path, data, config)
+
+
+def bn_scale_shift(params, scope):
+    scale = params[scope + '/gamma'] / np.sqrt(params[scope + '/moving_variance'] + BN_EPSILON)
+    shift = params[scope + '/beta'] - params[scope + '/moving_mean'] * scale
+    return scale, shift
+
+
+def fold_params(params, config, min_values, max_values, small_value=1e-7):
+    folded = dict()
+
+    # Input normalization (x - 127.5) / 127.5 is folded into conv1
+    w, b = params['conv1/w'], params['conv1/biases']
+    folded['conv1/w'] = w / 127.5
+    folded['conv1/b'] = b - np.sum(w, axis=(0, 1, 2))
+
+    for stage, blocks in enumerate(config.get('layers', [2, 2, 2, 2])):
+        for block in range(blocks):
+            scope = 'block_layer{}_{}'.format(stage + 1, block + 1)
+
+            for conv_name in ['conv_0', 'conv_1', 'conv_projection']:
+                if scope + '/' + conv_name + '/w' in params:
+                    folded[scope + '/' + conv_name + '/w'] = params[scope + '/' + conv_name + '/w']
+                    folded[scope + '/' + conv_name + '/b'] = params[scope + '/' + conv_name + '/biases']
+
+            if config.get('use_batchnorm', False):
+                # batch_norm_1 directly follows conv_0, fold it into the conv weights
+                scale, shift = bn_scale_shift(params, scope + '/batch_norm_1')
+                folded[scope + '/conv_0/w'] = folded[scope + '/conv_0/w'] * scale
+                folded[scope + '/conv_0/b'] = folded[scope + '/conv_0/b'] * scale + shift
+
+                # batch_norm_0 normalizes the residual sum, it stays as one multiply-add
+                folded[scope + '/batch_norm_0/scale'], folded[scope + '/batch_norm_0/shift'] = bn_scale_shift(
+                    params, scope + '/batch_norm_0')
+
+    if config.get('use_batchnorm', False):
+        folded['before_gap_batch_norm/scale'], folded['before_gap_batch_norm/shift'] = bn_scale_shift(
+            params, 'before_gap_batch_norm')
+
+    for fc_name in ['FC1', 'FC2']:
+        if fc_name + '/matrix_u' in params:
+            # Low-rank layers keep the two thin matrices
+            folded[fc_name + '/u'], folded[fc_name + '/v'] = params[fc_name + '/matrix_u'], params[fc_name + '/matrix_v']
+        else:
+            folded[fc_name + '/w'] = params[fc_name + '/matrix']
+        folded[fc_name + '/b'] = params[fc_name + '/bias']
+
+    # Unnormalization max(x, 0) * r + m equals max(x * r + m, m) for r > 0, fold r and m into the output layer
+    value_range = (max_values - min_values + small_value).astype(np.float32)
+    folded['Out/w'] = params['Out/matrix'] * value_range
+    folded['Out/b'] = params['Out/bias'] * value_range + min_values.astype(np.float32)
+    folded['Out/min'] = min_values.astype(np.float32)
+
+    return folded
+
+
+def same_padding(size, kernel_size, strides):
+    pad_total = max((int(np.ceil(size / strides)) - 1) * strides + kernel_size - size, 0)
+    return pad_total // 2, pad_total - pad_total // 2
+
+
+def conv2d(x, folded, scope, kernel_size, strides):
+    padding = 'SAME'
+
+    if strides > 1:
+        pad_start = (kernel_size - 1) // 2
+        pad_end = kernel_size - 1 - pad_start
+        _, h, w, _ = x.get_shape().as_list()
+
+        # The explicit fixed_padding is merged into the conv when SAME padding pads the same rows and columns
+        if not (same_padding(h, kernel_size, strides) == same_padding(w, kernel_size, strides) ==
+                (pad_start, pad_end)):
+            x = tf.pad(x, [[0, 0], [pad_start, pad_end], [pad_start, pad_end], [0, 0]])
+            padding = 'VALID'
+
+    output = tf.nn.conv2d(x, tf.constant(folded[scope + '/w']), strides=[1, strides, strides, 1], padding=padding)
+    return tf.nn.bias_add(output, tf.constant(folded[scope + '/b']))
+
+
+def affine(x, folded, scope):
+    return x * tf.constant(folded[scope + '/scale']) + tf.constant(folded[scope + '/shift'])
+
+
+def build_inference_graph(folded, input_shape, config, name='ResNet18'):
+    layers = config.get('layers', [2, 2, 2, 2])
+    strides = [1, 2, 2, 2]
+
+    graph = tf.Graph()
+    with graph.as_default():
+        img_tfph = tf.compat.v1.placeholder(dtype=tf.dtypes.float32, shape=[None, *input_shape], name='img_tfph')
+
+        with tf.compat.v1.name_scope(name):
+            with tf.compat.v1.name_scope('conv1'):
+                # Padding with 127.5 is the zero padding of the normalized image
+                kernel_size = folded['conv1/w'].shape[0]
+                pad_start, pad_end = (kernel_size - 1) // 2, kernel_size - 1 - (kernel_size - 1) // 2
+                inputs = tf.pad(img_tfph, [[0, 0], [pad_start, pad_end], [pad_start, pad_end], [0, 0]],
+                                constant_values=127.5)
+                inputs = tf.nn.conv2d(inputs, tf.constant(folded['conv1/w']), strides=[1, 1, 1, 1], padding='VALID')
+                inputs = tf.nn.bias_add(inputs, tf.constant(folded['conv1/b']))
+
+            inputs = tf.nn.max_pool2d(inputs, ksize=[1, 3, 3, 1], strides=[1, 2, 2, 1], padding='SAME',
+                                      name='3x3_maxpool')
+
+            for stage, blocks in enumerate(layers):
+                for block in range(blocks):
+                    scope = 'block_layer{}_{}'.format(stage + 1, block + 1)
+                    with tf.compat.v1.name_scope(scope):
+                        shortcut = inputs
+                        if config.get('use_batchnorm', False):
+                            inputs = affine(inputs, folded, scope + '/batch_norm_0')
+                        inputs = tf.nn.relu(inputs)
+
+                        block_strides = strides[stage] if block == 0 else 1
+                        if block == 0:
+                            shortcut = conv2d(inputs, folded, scope + '/conv_projection', 1, block_strides)
+
+                        inputs = conv2d(inputs, folded, scope + '/conv_0', 3, block_strides)
+                        inputs = tf.nn.relu(inputs)
+                        inputs = conv2d(inputs, folded, scope + '/conv_1', 3, 1)
+                        inputs = inputs + shortcut
+
+            if config.get('use_batchnorm', False):
+                inputs = affine(inputs, folded, 'before_gap_batch_norm')
+            inputs = tf.nn.relu(inputs)
+            if config.get('head', 'flatten') == 'gap':
+                inputs = tf.math.reduce_mean(inputs, axis=[1, 2])
+            else:
+                inputs = tf.reshape(inputs, [-1, int(np.prod(inputs.get_shape().as_list()[1:]))])
+
+            for fc_name in ['FC1', 'FC2']:
+                with tf.compat.v1.name_scope(fc_name):
+                    if fc_name + '/u' in folded:
+                        inputs = tf.matmul(tf.matmul(inputs, tf.constant(folded[fc_name + '/u'])),
+                                           tf.constant(folded[fc_name + '/v']))
+                    else:
+                        inputs = tf.matmul(inputs, tf.constant(folded[fc_name + '/w']))
+                    inputs = tf.nn.relu(inputs + tf.constant(folded[fc_name + '/b']))
+
+            with tf.compat.v1.name_scope('Out'):
+                logits = tf.matmul(inputs, tf.constant(folded['Out/w'])) + tf.constant(folded['Out/b'])
+
+        tf.math.maximum(logits, tf.constant(folded['Out/min']), name='unnorm_preds')
+
+    return graph
+
+
+def verify(graph, ckpt_path, data, config, batch_size=1):
+    if data.num_test > 0:
+        imgs, _ = data.direct_batch(batch_size=batch_size, start_index=0, stage='test')
+    else:
+        imgs = 255. * np.random.randint(low=0, high=2, size=(batch_size, *data.input_shape)).astype(np.float32)
+
+    # Original training graph restored from the checkpoint
+    org_graph = tf.Graph()
+    with org_graph.as_default():
+        model = ResNet18_Revised(input_shape=data.input_shape,
+                                 min_values=data.min_values,
+                                 max_values=data.max_values,
+                                 domain=data.domain,
+                                 num_attribute=data.num_attribute,
+                                 is_train=False,
+                                 inference_only=True,
+                                 with_metrics=False,
+                                 domain_min_values=data.domain_min_values,
+                                 domain_max_values=data.domain_max_values,
+                                 **utils.model_kwargs(config))
+        org_sess = tf.compat.v1.Session(graph=org_graph)
+        tf.compat.v1.train.Saver().restore(org_sess, ckpt_path)
+
+    sess = tf.compat.v1.Session(graph=graph)
+    preds_op = graph.get_tensor_by_name('unnorm_preds:0')
+    img_tfph = graph.get_tensor_by_name('img_tfph:0')
+
+    results = list()
+    for name, session, fetch, feed in [('original', org_sess, model.unnorm_preds, {model.img_tfph: imgs}),
+                                       ('folded', sess, preds_op, {img_tfph: imgs})]:
+        preds = session.run(fetch, feed_dict=feed)  # warm-up
+        tic = time.time()
+        for _ in range(FLAGS.num_runs):
+            session.run(fetch, feed_dict=feed)
+        avg_pt = (time.time() - tic) / FLAGS.num_runs * 1000.
+        results.append(preds)
+        print(' [*] {:>8} graph: {:.3f} msec, {} ops'.format(name, avg_pt, len(session.graph.get_operations())))
+
+    print(' [*] Max abs. difference: {:.6f}'.format(np.max(np.abs(results[0] - results[1]))))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
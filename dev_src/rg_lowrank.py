@@ -0,0 +1,211 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Low-rank factorization of the FC1 and FC2 layers of a trained model
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import numpy as np
+import tensorflow as tf
+
+import utils as utils
+import numpy_utils as np_utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+from rg_solver import Solver
+from resnet import ResNet18_Revised
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '0', 'gpu index if you have multiple gpus, default: 0')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('load_model', None, 'folder of the trained model to factorize (e.g. 20191222-230522), the '
+                                           'factorized model is saved in <load_model>_lowrank, default: None')
+tf.flags.DEFINE_float('error_budget', 0.02, 'allowed relative increase of the validation avg. error, the smallest '
+                                            'rank within the budget is selected, default: 0.02')
+tf.flags.DEFINE_string('ranks', '4,8,16,32,64,128,256', 'candidate ranks of the factorized layers, '
+                                                        'default: 4,8,16,32,64,128,256')
+tf.flags.DEFINE_bool('factor_fc2', False, 'factorize FC2 in addition to FC1, default: False')
+tf.flags.DEFINE_integer('finetune_iters', 0, 'number of fine-tuning iterations of the factorized model, '
+                                             'default: 0')
+tf.flags.DEFINE_integer('eval_freq', 200, 'evaluation frequency during fine-tuning, default: 200')
+tf.flags.DEFINE_integer('batch_size', 128, 'batch size for one iteration, default: 128')
+tf.flags.DEFINE_float('learning_rate', 1e-5, 'initial learning rate of the fine-tuning, default: 0.00001')
+tf.flags.DEFINE_float('weight_decay', 1e-6, 'weight decay of the fine-tuning, default: 1e-6')
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+
+    if FLAGS.load_model is None:
+        exit(' [!] Please select the model folder with --load_model')
+
+    org_model_dir = os.path.join('../model', FLAGS.load_model)
+    ckpt = tf.train.get_checkpoint_state(org_model_dir)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        exit(' [!] Failed to find checkpoint in {}'.format(org_model_dir))
+
+    config = utils.read_model_config(org_model_dir)
+    if config.get('fc_ranks'):
+        exit(' [!] {} is already factorized: {}'.format(org_model_dir, config['fc_ranks']))
+
+    model_dir, log_dir = utils.make_folders_simple(cur_time=FLAGS.load_model + '_lowrank')
+    data = Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, is_train=True, log_dir=log_dir)
+
+    params = tf_utils.read_checkpoint(ckpt.model_checkpoint_path)
+    for name in ['FC1', 'FC2']:
+        if name + '/mask' in params:
+            params[name + '/matrix'] = params[name + '/matrix'] * params.pop(name + '/mask')
+
+    # The conv trunk does not change, its validation features are computed once and the ranks are searched in numpy
+    org_graph = tf.Graph()
+    with org_graph.as_default():
+        org_solver = Solver(build_model(data, config, log_dir), data)
+        tf.compat.v1.train.Saver().restore(org_solver.sess, ckpt.model_checkpoint_path)
+        features, gts = val_features(org_solver, data)
+
+    dense_err = head_error(params, features, gts, data)
+    max_err = dense_err * (1. + FLAGS.error_budget)
+
+    lines = list()
+    lines.append('Original: {}, Factorized: {}'.format(org_model_dir, model_dir))
+    lines.append('Dense head avg. error: {:.5f}, budget: {:.5f}'.format(dense_err, max_err))
+
+    fc_ranks, factored = dict(), dict(params)
+    for fc_name in (['FC1', 'FC2'] if FLAGS.factor_fc2 else ['FC1']):
+        matrix = params[fc_name + '/matrix']
+
+        lines.append('')
+        lines.append('{} {}'.format(fc_name, list(matrix.shape)))
+        lines.append('{:>8}{:>12}{:>14}'.format('Rank', 'Avg. Err', 'MACs'))
+        for rank in utils.str_to_ints(FLAGS.ranks):
+            if rank * (matrix.shape[0] + matrix.shape[1]) >= matrix.size:
+                break   # no savings from this rank on
+
+            matrix_u, matrix_v = np_utils.truncated_svd(matrix, rank)
+            candidate = dict(factored)
+            candidate[fc_name + '/matrix'] = np.matmul(matrix_u, matrix_v)
+            avg_err = head_error(candidate, features, gts, data)
+            lines.append('{:>8}{:>12.5f}{:>14,}'.format(rank, avg_err, rank * (matrix.shape[0] + matrix.shape[1])))
+
+            if avg_err <= max_err:
+                fc_ranks[fc_name] = rank
+                factored = candidate
+                break
+
+        if fc_name not in fc_ranks:
+            lines.append('No rank within the budget, {} stays dense'.format(fc_name))
+
+    if len(fc_ranks) == 0:
+        for line in lines:
+            print(line)
+        exit(' [!] Nothing to factorize within the error budget {}'.format(FLAGS.error_budget))
+
+    # Checkpoint of the factorized model holds the thin matrices
+    for fc_name, rank in fc_ranks.items():
+        factored[fc_name + '/matrix_u'], factored[fc_name + '/matrix_v'] = np_utils.truncated_svd(
+            params[fc_name + '/matrix'], rank)
+        factored.pop(fc_name + '/matrix')
+
+    lowrank_config = dict(config)
+    lowrank_config['fc_ranks'] = fc_ranks
+    utils.write_model_config(model_dir, lowrank_config)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        solver = Solver(build_model(data, lowrank_config, log_dir), data)
+        num_assigned = tf_utils.assign_variables(solver.sess, factored, name=solver.model.name)
+        print(' [*] Assigned {} of {} variables'.format(num_assigned, len(factored)))
+        saver = tf.compat.v1.train.Saver(max_to_keep=1)
+
+        lowrank_err, _ = solver.eval(batch_size=FLAGS.batch_size)
+        best_err = finetune(solver, saver, model_dir, log_dir, lowrank_err)
+
+    lines.append('')
+    lines.append('Ranks: {}'.format(fc_ranks))
+    lines.append('FC1 + FC2 params (= MACs per frame): {:,} -> {:,}, {:.1f}x'.format(
+        head_size(params), head_size(factored), head_size(params) / head_size(factored)))
+    lines.append('Model weights: {:.2f} MB -> {:.2f} MB'.format(model_size(params) / 2 ** 20,
+                                                                model_size(factored) / 2 ** 20))
+    lines.append('Avg. Error: original {:.5f}, factorized {:.5f}, fine-tuned {:.5f}'.format(
+        dense_err, lowrank_err, best_err))
+
+    with open(os.path.join(log_dir, 'lowrank_report.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    for line in lines:
+        print(line)
+
+
+def build_model(data, config, log_dir):
+    return ResNet18_Revised(input_shape=data.input_shape,
+                            min_values=data.min_values,
+                            max_values=data.max_values,
+                            domain=data.domain,
+                            num_attribute=data.num_attribute,
+                            lr=FLAGS.learning_rate,
+                            weight_decay=FLAGS.weight_decay,
+                            total_iters=max(FLAGS.finetune_iters, 1),
+                            is_train=True,
+                            log_dir=log_dir,
+                            domain_min_values=data.domain_min_values,
+                            domain_max_values=data.domain_max_values,
+                            **utils.model_kwargs(config))
+
+
+def val_features(solver, data):
+    features, gts = list(), list()
+    for index in range(0, data.num_val, FLAGS.batch_size):
+        img_vals, label_vals = data.direct_batch(batch_size=FLAGS.batch_size, start_index=index, stage='val')
+        features.append(solver.sess.run(solver.model.features, feed_dict={solver.model.img_tfph: img_vals}))
+        gts.append(data.unnormalize(label_vals))
+
+    return np.concatenate(features, axis=0), np.concatenate(gts, axis=0)
+
+
+def head_error(params, features, gts, data):
+    # The same avg. error as ResNet18_Revised.avg_err
+    preds = data.unnormalize(np.maximum(np_utils.dense_head_forward(params, features), 0.))
+    return np.mean(np.mean(np.sqrt(np.square(preds - gts)), axis=0))
+
+
+def head_size(params):
+    # Number of the FC1 and FC2 parameters, the same as their MACs per frame
+    return sum(value.size for key, value in params.items() if key.split('/')[0] in ['FC1', 'FC2'])
+
+
+def model_size(params):
+    return sum(value.nbytes for value in params.values())
+
+
+def finetune(solver, saver, model_dir, log_dir, lowrank_err):
+    best_avg_err = lowrank_err
+    saver.save(solver.sess, os.path.join(model_dir, 'model'), global_step=0)
+
+    tb_writer = tf.compat.v1.summary.FileWriter(logdir=log_dir, graph=solver.sess.graph_def)
+    for iter_time in range(FLAGS.finetune_iters):
+        total_loss, data_loss, reg_term, summary = solver.train(batch_size=FLAGS.batch_size)
+        tb_writer.add_summary(summary, iter_time)
+
+        if ((iter_time + 1) % FLAGS.eval_freq == 0) or (iter_time + 1 == FLAGS.finetune_iters):
+            print("[{0:6} / {1:6}] Total loss: {2:.5f}, Data loss: {3:.5f}, Reg. term: {4:.5f}".format(
+                iter_time, FLAGS.finetune_iters, total_loss, data_loss, reg_term))
+
+            avg_err, eval_summary = solver.eval(batch_size=FLAGS.batch_size)
+            tb_writer.add_summary(eval_summary, iter_time)
+            tb_writer.flush()
+
+            if avg_err < best_avg_err:
+                best_avg_err = avg_err
+                saver.save(solver.sess, os.path.join(model_dir, 'model'), global_step=iter_time + 1)
+
+            print('Avg. Error: {:.5f}, Best Avg. Error: {:.5f}'.format(avg_err, best_avg_err))
+
+    return best_avg_err
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
@@ -6,18 +6,29 @@
 # Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
 # ---------------------------------
 import os
+import sys
 import time
 import math
 import xlsxwriter
+import signal
 import logging
+import threading
+import subprocess
 import numpy as np
 from datetime import datetime
 import tensorflow as tf
 
 from rg_dataset import Dataset
-from rg_solver import Solver
+from rg_solver import Solver, Teacher
 from resnet import ResNet18_Revised
+from tf_profiler import LayerProfiler
+from metrics import MetricsWriter
+from checkpoint_manager import CheckpointManager
+from step_profiler import StepProfiler, phase
+import checkpoint_manager as checkpoint_manager
+import parallel_utils as parallel_utils
 import utils as utils
+import tensorflow_utils as tf_utils
 
 
 FLAGS = tf.flags.FLAGS
@@ -25,7 +36,8 @@ tf.flags.DEFINE_string('gpu_index', '0', 'gpu index if you have multiple gpus, d
 tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
                                    'default: 0')
 tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 02')
-tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb], default: xy')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], all trains one model on both xy and '
+                                       'rarb data, default: xy')
 tf.flags.DEFINE_string('img_format', '.jpg', 'image format, default: .jpg')
 tf.flags.DEFINE_bool('use_batchnorm', False, 'use batchnorm or not in regression task, default: False')
 tf.flags.DEFINE_integer('batch_size', 128, 'batch size for one iteration, default: 256')
@@ -35,8 +47,84 @@ tf.flags.DEFINE_float('learning_rate', 1e-4, 'initial learning rate for optimize
 tf.flags.DEFINE_float('weight_decay', 1e-6, 'weight decay for model to handle overfitting, defautl: 1e-6')
 tf.flags.DEFINE_integer('epoch', 200, 'number of epochs, default: 100')
 tf.flags.DEFINE_integer('print_freq', 1, 'print frequence for loss information, default: 1')
+tf.flags.DEFINE_string('metrics_sinks', 'tensorboard,console', 'outputs of the training metrics [tensorboard | csv | '
+                                                             'jsonl | console], default: tensorboard,console')
+tf.flags.DEFINE_float('flush_secs', 10., 'seconds between two writes of the queued metrics, the console prints the '
+                                         'mean of the losses since the last write, default: 10.')
 tf.flags.DEFINE_string('load_model', None, 'folder of saved model that you wish to continue training '
                                            '(e.g. 20191008-151952), default: None')
+tf.flags.DEFINE_string('layers', '2,2,2,2', 'number of residual blocks in each block_layer, default: 2,2,2,2')
+tf.flags.DEFINE_string('filters', '64,128,256,512', 'number of filters in each block_layer, default: 64,128,256,512')
+tf.flags.DEFINE_string('stem', 'conv7', 'stem of the network [conv7 | conv3], default: conv7')
+tf.flags.DEFINE_integer('stem_filters', 64, 'number of filters of the stem conv, default: 64')
+tf.flags.DEFINE_string('head', 'flatten', 'input of the FC layers [flatten | gap], gap is global average pooling, '
+                                          'default: flatten')
+tf.flags.DEFINE_string('block_type', 'basic', 'residual block [basic | separable | inverted_residual], separable '
+                                             'uses depthwise 3x3 and pointwise 1x1 convs, default: basic')
+tf.flags.DEFINE_integer('expansion', 4, 'expansion factor of the inverted residual blocks, default: 4')
+tf.flags.DEFINE_integer('binary_layers', 0, 'binary weights and activations trained with straight-through estimators, '
+                                            '0: none, 1: conv1, 2: conv1 and block_layer1, default: 0')
+tf.flags.DEFINE_string('model_config', None, 'json file of the architecture that overrides the architecture flags, '
+                                             'e.g. a pareto config of rg_arch_search.py, default: None')
+tf.flags.DEFINE_string('teacher_model', None, 'folder of a trained model used as the frozen teacher for knowledge '
+                                              'distillation (e.g. 20191222-230522), default: None')
+tf.flags.DEFINE_float('distill_alpha', 0.5, 'weight of the teacher outputs in the distillation loss, the rest is on '
+                                            'the ground-truth labels, default: 0.5')
+tf.flags.DEFINE_float('prune_sparsity', 0., 'final sparsity of the gradual magnitude pruning of FC1 and FC2, 0. for '
+                                           'no pruning, default: 0.')
+tf.flags.DEFINE_float('prune_start', 0.2, 'start of the pruning schedule as a fraction of total iterations, '
+                                          'default: 0.2')
+tf.flags.DEFINE_float('prune_end', 0.7, 'end of the pruning schedule as a fraction of total iterations, the rest '
+                                        'recovers the accuracy at the final sparsity, default: 0.7')
+tf.flags.DEFINE_integer('prune_freq', 500, 'iterations between two pruning steps, default: 500')
+tf.flags.DEFINE_bool('exit_heads', False, 'train early-exit heads with a learned variance of the weighted errors '
+                                          'after block_layer2 and block_layer3 for confidence-based early exit in the '
+                                          'demo, the exit_threshold of the demo is on the same scale, default: False')
+tf.flags.DEFINE_float('exit_weight', 0.3, 'weight of the early-exit heads loss, default: 0.3')
+tf.flags.DEFINE_string('data_format', 'NHWC', 'layout of the activations [NHWC | NCHW], the saved variables are the '
+                                             'same for both, default: NHWC')
+tf.flags.DEFINE_bool('fused_bn', False, 'fused batch normalization kernels, default: False')
+tf.flags.DEFINE_bool('use_xla', False, 'XLA JIT compilation and aggressive graph optimizations, default: False')
+tf.flags.DEFINE_integer('num_workers', 1, 'number of synchronous data-parallel training processes on this host, each '
+                                         'worker samples batch_size images from its own shard of the training data '
+                                         'and the gradients are averaged every iteration, default: 1')
+tf.flags.DEFINE_integer('accum_steps', 1, 'number of micro-batches of batch_size images of which the gradients are '
+                                         'accumulated for one update, the learning rate schedule counts the updates, '
+                                         'default: 1')
+tf.flags.DEFINE_bool('async_eval', False, 'save snapshots instead of evaluating in the training loop, a side process '
+                                         '(rg_evaluator.py) scores them and keeps the best model, default: False')
+tf.flags.DEFINE_integer('eval_threads', 0, 'intra-op threads of the side evaluator, 0 for all cores, default: 0')
+tf.flags.DEFINE_integer('early_stop_patience', 0, 'number of evaluations without improvement of the best validation '
+                                                 'avg. error before the training stops, 0 for no early stopping, '
+                                                 'default: 0')
+tf.flags.DEFINE_integer('plateau_patience', 0, 'number of evaluations without improvement before the learning rate is '
+                                              'reduced, 0 for the fixed schedule, default: 0')
+tf.flags.DEFINE_float('plateau_factor', 0.5, 'factor of the learning rate reduction on a plateau, default: 0.5')
+tf.flags.DEFINE_float('min_lr_scale', 0.01, 'lower bound of the learning rate reductions relative to the schedule, '
+                                            'default: 0.01')
+tf.flags.DEFINE_float('min_delta', 0., 'relative decrease of the best avg. error that counts as an improvement, '
+                                       'default: 0.')
+tf.flags.DEFINE_float('time_budget', 0., 'hours of training after which it stops at the next evaluation, 0 for no '
+                                         'budget, default: 0.')
+tf.flags.DEFINE_integer('keep_top_k', 1, 'number of the best checkpoints by validation avg. error that are kept, the '
+                                        'latest state for the resume is kept in <model_dir>/resume, default: 1')
+tf.flags.DEFINE_string('run_name', None, 'folder name of the model and the logs of a new training instead of the '
+                                        'start time, e.g. sweep/trial_000, default: None')
+tf.flags.DEFINE_string('cache_dir', None, 'folder of the preprocessed images in memory-mapped .npy files, written '
+                                         'at the first use and shared by the runs of a sweep, default: None')
+tf.flags.DEFINE_bool('step_profile', False, 'time the phases of each training step and report their percentiles, '
+                                            'the samples/s and the data-stall fraction, default: False')
+tf.flags.DEFINE_integer('profile_window', 100, 'number of steps of the rolling window of the step profile, it is '
+                                               'reported at the end of every window, default: 100')
+tf.flags.DEFINE_integer('trace_start', 0, 'first training step of the chrome-trace window, default: 0')
+tf.flags.DEFINE_integer('trace_steps', 0, 'number of training steps written as chrome traces into the log folder, 0 '
+                                          'for no trace, default: 0')
+tf.flags.DEFINE_bool('profile', False, 'collect per-layer latency of the test graph with RunMetadata and write a '
+                                       'chrome-trace timeline and a hotspot table into the log folder, default: False')
+tf.flags.DEFINE_integer('profile_frames', 100, 'number of test frames traced for the profile after a warm-up, the '
+                                               'processing time is measured without tracing, default: 100')
+
+TERMINATE = threading.Event()   # set by SIGTERM, the training saves its resume state and stops
 
 
 def print_main_parameters(logger, flags):
@@ -55,7 +143,41 @@ def print_main_parameters(logger, flags):
         logger.info('weight_decay: \t\t{}'.format(flags.weight_decay))
         logger.info('epoch: \t\t\t{}'.format(flags.epoch))
         logger.info('print_freq: \t\t\t{}'.format(flags.print_freq))
+        logger.info('metrics_sinks: \t\t{}'.format(flags.metrics_sinks))
+        logger.info('flush_secs: \t\t\t{}'.format(flags.flush_secs))
         logger.info('load_model: \t\t\t{}'.format(flags.load_model))
+        logger.info('layers: \t\t\t{}'.format(flags.layers))
+        logger.info('filters: \t\t\t{}'.format(flags.filters))
+        logger.info('stem: \t\t\t{}'.format(flags.stem))
+        logger.info('stem_filters: \t\t{}'.format(flags.stem_filters))
+        logger.info('head: \t\t\t{}'.format(flags.head))
+        logger.info('block_type: \t\t\t{}'.format(flags.block_type))
+        logger.info('expansion: \t\t\t{}'.format(flags.expansion))
+        logger.info('binary_layers: \t\t{}'.format(flags.binary_layers))
+        logger.info('model_config: \t\t{}'.format(flags.model_config))
+        logger.info('teacher_model: \t\t{}'.format(flags.teacher_model))
+        logger.info('distill_alpha: \t\t{}'.format(flags.distill_alpha))
+        logger.info('prune_sparsity: \t\t{}'.format(flags.prune_sparsity))
+        logger.info('prune_start: \t\t{}'.format(flags.prune_start))
+        logger.info('prune_end: \t\t\t{}'.format(flags.prune_end))
+        logger.info('prune_freq: \t\t\t{}'.format(flags.prune_freq))
+        logger.info('exit_heads: \t\t\t{}'.format(flags.exit_heads))
+        logger.info('exit_weight: \t\t{}'.format(flags.exit_weight))
+        logger.info('data_format: \t\t{}'.format(flags.data_format))
+        logger.info('fused_bn: \t\t\t{}'.format(flags.fused_bn))
+        logger.info('use_xla: \t\t\t{}'.format(flags.use_xla))
+        logger.info('num_workers: \t\t{}'.format(flags.num_workers))
+        logger.info('accum_steps: \t\t{}'.format(flags.accum_steps))
+        logger.info('async_eval: \t\t\t{}'.format(flags.async_eval))
+        logger.info('eval_threads: \t\t{}'.format(flags.eval_threads))
+        logger.info('early_stop_patience: \t{}'.format(flags.early_stop_patience))
+        logger.info('plateau_patience: \t\t{}'.format(flags.plateau_patience))
+        logger.info('plateau_factor: \t\t{}'.format(flags.plateau_factor))
+        logger.info('min_lr_scale: \t\t{}'.format(flags.min_lr_scale))
+        logger.info('min_delta: \t\t\t{}'.format(flags.min_delta))
+        logger.info('time_budget: \t\t{}'.format(flags.time_budget))
+        logger.info('keep_top_k: \t\t\t{}'.format(flags.keep_top_k))
+        logger.info('profile: \t\t\t{}'.format(flags.profile))
     else:
         print('main func parameters:')
         print('-- gpu_index: \t\t\t{}'.format(flags.gpu_index))
@@ -72,24 +194,58 @@ def print_main_parameters(logger, flags):
         print('-- epoch: \t\t\t{}'.format(flags.epoch))
         print('-- print_freq: \t\t\t{}'.format(flags.print_freq))
         print('-- load_model: \t\t\t{}'.format(flags.load_model))
+        print('-- layers: \t\t\t{}'.format(flags.layers))
+        print('-- filters: \t\t\t{}'.format(flags.filters))
+        print('-- profile: \t\t\t{}'.format(flags.profile))
+        print('-- profile_frames: \t\t{}'.format(flags.profile_frames))
+        print('-- use_xla: \t\t\t{}'.format(flags.use_xla))
 
 
 def main(_):
-    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+    if FLAGS.use_xla:
+        tf_utils.enable_xla_cpu_jit()   # before any session, the spawned workers inherit the environment
 
     # Initialize model and log folders
     if FLAGS.load_model is None:
-        cur_time = datetime.now().strftime("%Y%m%d-%H%M%S")
+        cur_time = FLAGS.run_name if FLAGS.run_name is not None else datetime.now().strftime("%Y%m%d-%H%M%S")
     else:
         cur_time = FLAGS.load_model
 
+    if FLAGS.is_train and FLAGS.num_workers > 1:
+        exitcodes = parallel_utils.launch_workers(run_worker, FLAGS.num_workers, args=(sys.argv, cur_time))
+        if any(exitcode != 0 for exitcode in exitcodes):
+            exit(' [!] Data-parallel training failed, exit codes of the workers: {}'.format(exitcodes))
+    else:
+        run(cur_time)
+
+
+def run_worker(rank, collective, argv, cur_time):
+    # Entry of a spawned worker process, the flags are parsed again from the command line of the launcher
+    FLAGS(argv)
+    if rank != 0:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)   # the chief stops all workers together
+    run(cur_time, rank=rank, collective=collective)
+    collective.close()
+
+
+def run(cur_time, rank=0, collective=None):
+    gpu_indexes = FLAGS.gpu_index.split(',')
+    os.environ["CUDA_VISIBLE_DEVICES"] = gpu_indexes[rank % len(gpu_indexes)]
+
     model_dir, log_dir = utils.make_folders_simple(cur_time=cur_time)
+    is_chief = (rank == 0)
+    if not is_chief:
+        # Logs of the other workers, the chief writes the summaries and the checkpoints
+        log_dir = os.path.join(log_dir, 'worker_{}'.format(rank))
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
 
     # Logger
     logger = logging.getLogger(__name__)  # logger
     logger.setLevel(logging.INFO)
     utils.init_logger(logger=logger, log_dir=log_dir, is_train=FLAGS.is_train, name='main')
-    print_main_parameters(logger, flags=FLAGS)
+    if is_chief:
+        print_main_parameters(logger, flags=FLAGS)
 
     # Initialize dataset
     data = Dataset(data=FLAGS.data,
@@ -100,7 +256,20 @@ def main(_):
                    num_attribute=6,  # X, Y, Ra, Rb, F, D
                    is_train=FLAGS.is_train,
                    log_dir=log_dir,
-                   is_debug=False)
+                   is_debug=False,
+                   shard_index=rank,
+                   num_shards=FLAGS.num_workers if collective is not None else 1,
+                   cache_dir=FLAGS.cache_dir)
+
+    # Model architecture, a restored model keeps the architecture that it was trained with
+    model_config = init_model_config(model_dir)
+    if FLAGS.is_train and is_chief:
+        utils.write_model_config(model_dir, model_config)
+
+    # Initialize teacher model for knowledge distillation
+    teacher = None
+    if FLAGS.is_train and FLAGS.teacher_model is not None:
+        teacher = Teacher(data, model_dir=os.path.join('../model', FLAGS.teacher_model))
 
     # Initialize model
     model = ResNet18_Revised(input_shape=data.input_shape,
@@ -108,71 +277,288 @@ def main(_):
                              max_values=data.max_values,
                              domain=FLAGS.domain,
                              num_attribute=data.num_attribute,
-                             use_batchnorm=FLAGS.use_batchnorm,
                              lr=FLAGS.learning_rate,
                              weight_decay=FLAGS.weight_decay,
-                             total_iters=int(np.ceil(FLAGS.epoch * data.num_train / FLAGS.batch_size)),
+                             total_iters=num_total_iters(data.num_train),
                              is_train=FLAGS.is_train,
-                             log_dir=log_dir)
+                             log_dir=log_dir,
+                             exit_weight=FLAGS.exit_weight,
+                             distill_alpha=FLAGS.distill_alpha if teacher is not None else 0.,
+                             domain_min_values=data.domain_min_values,
+                             domain_max_values=data.domain_max_values,
+                             prune_fc=FLAGS.is_train and FLAGS.prune_sparsity > 0.,
+                             data_format=FLAGS.data_format,
+                             fused_bn=FLAGS.fused_bn,
+                             inference_only=not FLAGS.is_train,
+                             data_parallel=collective is not None,
+                             accum_steps=FLAGS.accum_steps,
+                             **utils.model_kwargs(model_config))
     # Initialize solver
-    solver = Solver(model, data)
+    solver = Solver(model, data, teacher=teacher, use_xla=FLAGS.use_xla, collective=collective, rank=rank,
+                    num_threads=max(os.cpu_count() // FLAGS.num_workers, 1) if collective is not None else 0)
 
     # Initialize saver
     saver = tf.compat.v1.train.Saver(max_to_keep=1)
 
     if FLAGS.is_train is True:
-        train(solver, saver, logger, model_dir, log_dir)
+        train(solver, saver, logger, model_dir, log_dir, is_chief=is_chief)
     else:
-        test(solver, saver, model_dir)
+        test(solver, saver, model_dir, log_dir)
+
+
+def init_model_config(model_dir):
+    model_config = {
+        'use_batchnorm': FLAGS.use_batchnorm,
+        'layers': utils.str_to_ints(FLAGS.layers),
+        'filters': utils.str_to_ints(FLAGS.filters),
+        'exit_heads': FLAGS.exit_heads,
+        'stem': FLAGS.stem,
+        'stem_filters': FLAGS.stem_filters,
+        'head': FLAGS.head,
+        'block_type': FLAGS.block_type,
+        'expansion': FLAGS.expansion,
+        'binary_layers': FLAGS.binary_layers
+    }
+
+    if FLAGS.model_config is not None:
+        model_config.update(utils.read_model_config(os.path.dirname(FLAGS.model_config),
+                                                    file_name=os.path.basename(FLAGS.model_config)))
 
+    if FLAGS.load_model is not None:
+        model_config.update(utils.read_model_config(model_dir))
 
-def train(solver, saver, logger, model_dir, log_dir):
-    best_avg_err = math.inf
-    iter_time, eval_time = 0, 0
-    total_iters = int(np.ceil(FLAGS.epoch * solver.data.num_train / FLAGS.batch_size))
-    eval_iters = total_iters // 100
+    return model_config
 
-    if FLAGS.load_model is not None:
-        flag, iter_time = load_model(saver=saver, solver=solver, model_dir=model_dir, logger=logger, is_train=True)
 
-        if flag is True:
-            logger.info(' [!] Load Success! Iter: {}'.format(iter_time))
-        else:
-            exit(' [!] Failed to restore model {}'.format(FLAGS.load_model))
+def target_sparsity(iter_time, total_iters):
+    # Gradual pruning schedule s_t = s_f * (1 - (1 - progress)^3) of Zhu and Gupta
+    start_iter, end_iter = int(FLAGS.prune_start * total_iters), int(FLAGS.prune_end * total_iters)
+    progress = np.clip((iter_time - start_iter) / max(end_iter - start_iter, 1), 0., 1.)
+    return FLAGS.prune_sparsity * (1. - (1. - progress) ** 3)
 
-    # Tensorboard writer
-    tb_writer = tf.compat.v1.summary.FileWriter(logdir=log_dir, graph=solver.sess.graph_def)
 
-    while iter_time < total_iters:
-        total_loss, data_loss, reg_term, summary = solver.train(batch_size=FLAGS.batch_size)
+def num_total_iters(num_train):
+    # Number of updates, each consumes accum_steps micro-batches of batch_size samples on every worker
+    num_workers = FLAGS.num_workers if FLAGS.is_train else 1
+    return int(np.ceil(FLAGS.epoch * num_train / (FLAGS.batch_size * FLAGS.accum_steps * num_workers)))
 
-        # Print loss information
-        if iter_time % FLAGS.print_freq == 0:
-            msg = "[{0:6} / {1:6}] Total loss: {2:.5f}, Data loss: {3:.5f}, Reg. term: {4:.5f}"
-            print(msg.format(iter_time, total_iters, total_loss, data_loss, reg_term))
 
-            # Write to tensorboard
-            tb_writer.add_summary(summary, iter_time)
-            tb_writer.flush()
+def train(solver, saver, logger, model_dir, log_dir, is_chief=True):
+    best_avg_err = math.inf
+    iter_time = 0
+    total_iters = num_total_iters(solver.data.num_train)
+    eval_iters = total_iters // 100
+    prune_start_iter, prune_end_iter = int(FLAGS.prune_start * total_iters), int(FLAGS.prune_end * total_iters)
 
-        if (iter_time != 0) and ((iter_time % eval_iters == 0) or (iter_time + 1 == total_iters)):
-            avg_err, eval_summary = solver.eval(batch_size=FLAGS.batch_size)
+    monitor = utils.PlateauMonitor(patience=FLAGS.early_stop_patience,
+                                   plateau_patience=FLAGS.plateau_patience,
+                                   factor=FLAGS.plateau_factor,
+                                   min_lr_scale=FLAGS.min_lr_scale,
+                                   min_delta=FLAGS.min_delta,
+                                   time_budget=FLAGS.time_budget)
 
-            # Write the summary of evaluation on tensorboard
-            tb_writer.add_summary(eval_summary, eval_time)
-            tb_writer.flush()
+    if FLAGS.load_model is not None:
+        # The resume state continues exactly, model folders without it restart from the best checkpoint
+        state = checkpoint_manager.restore_resume(solver.sess, saver, model_dir)
+        if state is not None:
+            iter_time = state['iter_time'] + 1
+            best_avg_err = state['best_avg_err']
+            solver.lr_scale = state['lr_scale']
+            monitor.load_state_dict(state['monitor'])
+            if is_chief:
+                checkpoint_manager.set_rng_state(state['rng_state'])
+            logger.info(' [!] Resume Success! Iter: {}'.format(iter_time))
+        else:
+            flag, iter_time = load_model(saver=saver, solver=solver, model_dir=model_dir, logger=logger,
+                                         is_train=True)
+
+            if flag is True:
+                logger.info(' [!] Load Success! Iter: {}'.format(iter_time))
+            else:
+                exit(' [!] Failed to restore model {}'.format(FLAGS.load_model))
+
+    if solver.collective is not None:
+        solver.sync_variables()
+
+    # Checkpoints are written by a background thread, SIGTERM saves the resume state before the stop
+    ckpt_manager = None
+    if is_chief:
+        ckpt_manager = CheckpointManager(solver.sess, model_dir, max_to_keep=FLAGS.keep_top_k)
+        signal.signal(signal.SIGTERM, lambda signum, frame: TERMINATE.set())
+
+    # Metrics are written by a background thread, the training loop only queues them
+    metrics = MetricsWriter(log_dir, sinks=FLAGS.metrics_sinks.split(','), flush_secs=FLAGS.flush_secs,
+                            graph=solver.sess.graph_def, total_steps=total_iters) if is_chief else None
+
+    evaluator, snapshot_dir = None, os.path.join(model_dir, utils.SNAPSHOT_FOLDER)
+    if FLAGS.async_eval and is_chief:
+        # The best model is only selected at the final sparsity
+        min_iter = prune_end_iter + 1 if FLAGS.prune_sparsity > 0. else 0
+        evaluator = start_evaluator(model_dir, log_dir, snapshot_dir, min_iter)
+        snapshot_saver = tf.compat.v1.train.Saver(max_to_keep=5)
+
+        # Last evaluation of the evaluator that the monitor has seen, a resumed monitor already counted it
+        record = utils.read_best_record(model_dir)
+        last_scored_iter = record.get('scored_iter', record['iter_time']) if record is not None else -1
+
+    # Step-time breakdown of the chief, its allreduce phase includes the wait for the slowest worker
+    profiler = None
+    if is_chief and (FLAGS.step_profile or FLAGS.trace_steps > 0):
+        profiler = StepProfiler(window=FLAGS.profile_window, log_dir=log_dir, trace_start=FLAGS.trace_start,
+                                trace_steps=FLAGS.trace_steps)
+        solver.profiler = profiler
 
-            if avg_err < best_avg_err:
+    while iter_time < total_iters:
+        if profiler is not None:
+            profiler.start_step(iter_time)
+
+        if (FLAGS.prune_sparsity > 0.) and (prune_start_iter <= iter_time <= prune_end_iter) and \
+                ((iter_time % FLAGS.prune_freq == 0) or (iter_time == prune_end_iter)):
+            sparsities = solver.prune(target_sparsity(iter_time, total_iters))
+            logger.info('Iter: {}, FC1 sparsity: {:.2%}, FC2 sparsity: {:.2%}'.format(iter_time, *sparsities))
+
+        total_loss, data_loss, reg_term, scalars = solver.train(batch_size=FLAGS.batch_size, with_summary=False)
+        is_eval_iter = (iter_time != 0) and ((iter_time % eval_iters == 0) or (iter_time + 1 == total_iters))
+
+        if (solver.collective is not None) and is_eval_iter:
+            # The evaluation and the checkpoints of the chief use the batch norm statistics of all shards
+            with phase(profiler, 'sync'):
+                solver.sync_batchnorm()
+
+        if not is_chief:
+            # The other workers only contribute gradients and follow the schedule and the stop of the chief
+            if solver.sync_schedule():
+                break
+            iter_time += 1
+            continue
+
+        # Loss information
+        if iter_time % FLAGS.print_freq == 0:
+            with phase(profiler, 'metrics'):
+                metrics.add_scalars(iter_time, scalars)
+
+        # The best model is only selected at the final sparsity
+        is_pruning = (FLAGS.prune_sparsity > 0.) and (iter_time <= prune_end_iter)
+        if is_eval_iter and (evaluator is not None):
+            # Training goes on while the evaluator scores the snapshot, its best model is reported back in best.json
+            with phase(profiler, 'checkpoint'):
+                snapshot_saver.save(solver.sess, os.path.join(snapshot_dir, 'model'), global_step=iter_time)
+            record = utils.read_best_record(model_dir)
+            if record is not None:
+                best_avg_err = record['avg_err']
+
+            # The monitor only judges the snapshots that the evaluator has scored since the last check
+            is_new_eval = (record is not None) and (record.get('scored_iter', record['iter_time']) > last_scored_iter)
+            if is_new_eval:
+                last_scored_iter = record.get('scored_iter', record['iter_time'])
+            print('Snapshot: {}, Best Avg. Error: {:.5f}'.format(iter_time, best_avg_err))
+        elif is_eval_iter:
+            with phase(profiler, 'eval'):
+                avg_err, eval_summary = solver.eval(batch_size=FLAGS.batch_size)
+
+            # Summary of the evaluation at the iteration of the losses
+            with phase(profiler, 'metrics'):
+                metrics.add_summary(iter_time, eval_summary)
+
+            with phase(profiler, 'checkpoint'):
+                is_saved = not is_pruning and ckpt_manager.save(iter_time, avg_err)
+            if is_saved:
+                logger.info('[*] Model saved: Iter: {}, rmse: {:.5f}'.format(iter_time, avg_err))
+            if (avg_err < best_avg_err) and not is_pruning:
                 best_avg_err = avg_err
-                save_model(saver, solver, logger, model_dir, iter_time, best_avg_err)
 
             print('Avg. Error: {:.5f}, Best Avg. Error: {:.5f}'.format(avg_err, best_avg_err))
-            eval_time += 1
+
+        should_stop = False
+        if is_eval_iter:
+            # Convergence control on the best avg. error, the errors of the pruning schedule are not judged
+            if not is_pruning and (evaluator is None or is_new_eval):
+                lr_scale = monitor.lr_scale
+                should_stop = monitor.update(best_avg_err)
+                if monitor.lr_scale != lr_scale:
+                    solver.lr_scale = monitor.lr_scale
+                    logger.info('Iter: {}, Plateau of the avg. error, learning rate scale: {} -> {}'.format(
+                        iter_time, lr_scale, monitor.lr_scale))
+                if should_stop:
+                    logger.info('Iter: {}, Early stopping, no improvement in {} evaluations'.format(
+                        iter_time, monitor.num_bad_evals))
+
+            if monitor.over_budget():
+                logger.info('Iter: {}, Time budget of {} hours is used up'.format(iter_time, FLAGS.time_budget))
+                should_stop = True
+
+        if TERMINATE.is_set():
+            logger.info(' [!] SIGTERM, saving the resume state of iter {}...'.format(iter_time))
+            ckpt_manager.save_resume(iter_time, resume_state(solver, monitor, best_avg_err), block=True)
+            should_stop = True
+        elif is_eval_iter:
+            with phase(profiler, 'checkpoint'):
+                ckpt_manager.save_resume(iter_time, resume_state(solver, monitor, best_avg_err))
+
+        if solver.collective is not None:
+            with phase(profiler, 'sync'):
+                should_stop = solver.sync_schedule(should_stop)
+
+        if profiler is not None:
+            profiler.end_step(num_samples=FLAGS.batch_size * FLAGS.accum_steps)
+            if (len(profiler.steps) == FLAGS.profile_window) and ((iter_time + 1) % FLAGS.profile_window == 0):
+                logger.info(profiler.report())
+                metrics.add_scalars(iter_time, profiler.scalars())
+
+        if should_stop:
+            break
 
         iter_time += 1
 
+    if metrics is not None:
+        metrics.close()
+
+    if ckpt_manager is not None:
+        ckpt_manager.close()
+
+    if evaluator is not None:
+        open(os.path.join(snapshot_dir, utils.SNAPSHOT_DONE_FILE), 'w').close()
+        logger.info(' [*] Waiting for the evaluator...')
+        evaluator.wait()
+
+        record = utils.read_best_record(model_dir)
+        if record is not None:
+            logger.info('[*] Best model: Iter: {}, Best rmse: {:.5f}'.format(record['iter_time'], record['avg_err']))
+
+
+def resume_state(solver, monitor, best_avg_err):
+    # Everything besides the variables that the next iteration depends on, the sampler draws from the numpy RNG
+    return {'best_avg_err': float(best_avg_err),
+            'lr_scale': solver.lr_scale,
+            'monitor': monitor.state_dict(),
+            'rng_state': checkpoint_manager.rng_state()}
+
 
-def test(solver, saver, model_dir):
+def start_evaluator(model_dir, log_dir, snapshot_dir, min_iter):
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir)
+
+    done_path = os.path.join(snapshot_dir, utils.SNAPSHOT_DONE_FILE)
+    if os.path.isfile(done_path):
+        os.remove(done_path)    # left by the run that is continued
+
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rg_evaluator.py')
+    log_file = open(os.path.join(log_dir, 'evaluator.txt'), 'a')
+    return subprocess.Popen([sys.executable, script_path,
+                             '--mode={}'.format(FLAGS.mode),
+                             '--data={}'.format(FLAGS.data),
+                             '--domain={}'.format(FLAGS.domain),
+                             '--img_format={}'.format(FLAGS.img_format),
+                             '--resize_factor={}'.format(FLAGS.resize_factor),
+                             '--load_model={}'.format(os.path.relpath(model_dir, '../model')),
+                             '--batch_size={}'.format(FLAGS.batch_size),
+                             '--num_threads={}'.format(FLAGS.eval_threads),
+                             '--min_iter={}'.format(min_iter),
+                             '--cache_dir={}'.format(FLAGS.cache_dir or ''),
+                             '--parent_pid={}'.format(os.getpid())], stdout=log_file, stderr=subprocess.STDOUT)
+
+
+def test(solver, saver, model_dir, log_dir):
     if FLAGS.load_model is not None:
         flag, iter_time = load_model(saver=saver, solver=solver, model_dir=model_dir)
         if flag is True:
@@ -180,12 +566,29 @@ def test(solver, saver, model_dir):
         else:
             exit(' [!] Failed to restore model {}'.format(FLAGS.load_model))
 
+    fetches = [solver.model.unnorm_preds, solver.model.unnorm_gts]
+    if FLAGS.profile:
+        # Warm-up before the untraced timing, the first runs include the graph setup
+        img_tests, label_tests = solver.data.direct_batch(batch_size=1, start_index=0, stage='test')
+        for _ in range(10):
+            solver.sess.run(fetches, feed_dict={solver.model.img_tfph: img_tests, solver.model.gt_tfph: label_tests})
+
     tic = time.time()
     preds, gts = solver.test_eval(batch_size=1)
     total_pt = time.time() - tic
     avg_pt = total_pt / solver.data.num_test * 1000
     print(' [*] Avg. processing time: {:.3f} msec. {:.2f} FPS'.format(avg_pt, (1000. / avg_pt)))
 
+    if FLAGS.profile:
+        # Traced runs of a bounded window of test frames, apart from the timing above
+        profiler = LayerProfiler(sess=solver.sess, name=solver.model.name)
+        for index in range(min(FLAGS.profile_frames, solver.data.num_test)):
+            img_tests, label_tests = solver.data.direct_batch(batch_size=1, start_index=index, stage='test')
+            profiler.run(fetches, feed_dict={solver.model.img_tfph: img_tests, solver.model.gt_tfph: label_tests})
+
+        print(' [*] Writing profile...')
+        profiler.write_report(save_folder=log_dir, prefix='test_eval')
+
     print(' [*] Writing excel...')
     write_to_csv(preds, gts, solver)
     print(' [!] Finished to write!')
@@ -231,11 +634,6 @@ def write_to_csv(preds, gts, solver, save_folder='../result'):
     workbook.close()
 
 
-def save_model(saver, solver, logger, model_dir, iter_time, best_rmse):
-    saver.save(solver.sess, os.path.join(model_dir, 'model'), global_step=iter_time)
-    logger.info('[*] Model saved: Iter: {}, Best rmse: {:.5f}'.format(iter_time, best_rmse))
-
-
 def load_model(saver, solver, model_dir, logger=None, is_train=False):
     if is_train:
         logger.info(' [*] Reading checkpoint...')
@@ -0,0 +1,80 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Inference-only checkpoint of the regression model without the optimizer state
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+import utils as utils
+import numpy_utils as np_utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('load_model', None, 'folder of the trained model to slim (e.g. 20191222-230522), default: None')
+tf.flags.DEFINE_bool('float16', False, 'store the weights in float16, they are upcast to float32 at load, '
+                                       'default: False')
+tf.flags.DEFINE_string('file_name', None, 'file name of the slim checkpoint in the model folder, default: '
+                                          'model_slim.npz or model_slim_fp16.npz')
+
+
+def main(_):
+    if FLAGS.load_model is None:
+        exit(' [!] Please select the model folder with --load_model')
+
+    model_dir = os.path.join('../model', FLAGS.load_model)
+    ckpt = tf.train.get_checkpoint_state(model_dir)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        exit(' [!] Failed to find checkpoint in {}'.format(model_dir))
+
+    config = utils.read_model_config(model_dir)
+    data = Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, is_train=False)
+    iter_time = int(ckpt.model_checkpoint_path.split('-')[-1])
+
+    tic = time.time()
+    params = tf_utils.read_checkpoint(ckpt.model_checkpoint_path)
+    ckpt_load_time = (time.time() - tic) * 1000.
+
+    # Pruning masks are folded into the matrices, the slim model has no mask variables
+    for name in ['FC1', 'FC2']:
+        if name + '/mask' in params:
+            params[name + '/matrix'] = params[name + '/matrix'] * params.pop(name + '/mask')
+
+    file_name = FLAGS.file_name
+    if file_name is None:
+        file_name = 'model_slim_fp16.npz' if FLAGS.float16 else 'model_slim.npz'
+    slim_path = os.path.join(model_dir, file_name)
+
+    np_utils.save_slim_checkpoint(slim_path, params, data.min_values, data.max_values, config=config,
+                                  iter_time=iter_time, use_float16=FLAGS.float16)
+
+    tic = time.time()
+    slim_params, _ = np_utils.load_slim_checkpoint(slim_path)
+    slim_load_time = (time.time() - tic) * 1000.
+
+    max_diff = max(float(np.max(np.abs(slim_params[key] - params[key]))) if params[key].size > 0 else 0.
+                   for key in params)
+
+    ckpt_size = sum(os.path.getsize(os.path.join(model_dir, file))
+                    for file in os.listdir(model_dir)
+                    if file.startswith(os.path.basename(ckpt.model_checkpoint_path) + '.'))
+    slim_size = os.path.getsize(slim_path)
+
+    print(' [!] Slim checkpoint saved: {}'.format(slim_path))
+    print('Variables: {}, Iter: {}, Max. weight diff: {:.2e}'.format(len(params), iter_time, max_diff))
+    print('Size: {:.2f} MB -> {:.2f} MB, {:.1f}x'.format(ckpt_size / 2 ** 20, slim_size / 2 ** 20,
+                                                         ckpt_size / slim_size))
+    print('Load time: {:.1f} msec -> {:.1f} msec'.format(ckpt_load_time, slim_load_time))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
@@ -5,44 +5,138 @@
 # Email: sbkim0407@gmail.com
 # Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
 # --------------------------------------------------------------------------
+import os
 import time
 import numpy as np
 import tensorflow as tf
 
+import utils as utils
+import tensorflow_utils as tf_utils
+from resnet import ResNet18_Revised
+from step_profiler import phase
+
 
 class Solver(object):
-    def __init__(self, model, data):
+    def __init__(self, model, data, teacher=None, use_xla=False, collective=None, rank=0, num_threads=0):
         self.model = model
         self.data = data
+        self.teacher = teacher
+        self.use_xla = use_xla
+        self.collective = collective    # parallel_utils.LocalAllReduce of the data-parallel workers
+        self.num_threads = num_threads
+        self.lr_scale = 1.              # factor of the learning rate schedule, lowered on a validation plateau
+        self.profiler = None            # step_profiler.StepProfiler of the training loop
 
         self._init_session()
         self._init_variables()
 
+        # Moving statistics of the batch norms, updated from the local shard of each worker by the bn_update_op of
+        # the model
+        self.bn_variables = [variable for variable in tf.compat.v1.global_variables()
+                             if variable.op.name.endswith(('moving_mean', 'moving_variance'))]
+
+        if self.collective is not None:
+            self.collective.setup(rank, size=sum(int(np.prod(variable.get_shape().as_list()))
+                                                 for variable in tf.compat.v1.global_variables()))
+
     def _init_session(self):
-        self.sess = tf.compat.v1.Session()
+        self.sess = tf.compat.v1.Session(config=tf_utils.session_config(use_xla=self.use_xla,
+                                                                        num_threads=self.num_threads))
 
     def _init_variables(self):
         self.sess.run(tf.compat.v1.global_variables_initializer())
 
-    def train(self, batch_size=4):
-        img_trains, label_trains = self.data.train_random_batch(batch_size=batch_size)
+    def sync_variables(self):
+        # Every worker continues from the variables of the chief, e.g. its initialization or a restored checkpoint
+        variables = tf.compat.v1.global_variables()
+        values = self.collective.broadcast(self.sess.run(variables))
+        for variable, value in zip(variables, values):
+            variable.load(value, self.sess)
+
+    def sync_batchnorm(self):
+        # Mean of the moving statistics over the workers, called by every worker before the evaluation and the
+        # checkpoints of the chief. The variance is the mean of the local variances
+        if len(self.bn_variables) == 0:
+            return
+
+        values = self.collective.all_reduce(self.sess.run(self.bn_variables))
+        for variable, value in zip(self.bn_variables, values):
+            variable.load(value, self.sess)
+
+    def train_feed(self, batch_size=4):
+        with phase(self.profiler, 'data'):
+            if self.data.domain == 'all':
+                img_trains, label_trains, domain_trains = self.data.train_random_batch(batch_size=batch_size,
+                                                                                       with_domain=True)
+            else:
+                img_trains, label_trains = self.data.train_random_batch(batch_size=batch_size)
 
         feed = {
             self.model.img_tfph: img_trains,
             self.model.gt_tfph: label_trains,
+            self.model.lr_scale_tfph: self.lr_scale,
+            self.model.train_mode: True,
         }
 
+        if self.data.domain == 'all':
+            feed[self.model.domain_tfph] = domain_trains
+
+        if self.teacher is not None:
+            with phase(self.profiler, 'teacher'):
+                feed[self.model.teacher_tfph] = self.teacher.predict(img_trains)
+
+        return feed
+
+    def train(self, batch_size=4, with_summary=True):
+        # One update, batch_size is the size of a micro-batch with gradient accumulation. Without the summary the
+        # last output is the dict of the scalar values of the summary
+        for _ in range(self.model.accum_steps - 1):
+            feed = self.train_feed(batch_size=batch_size)
+            with phase(self.profiler, 'compute'):
+                self.sess.run(self.model.accum_op, feed_dict=feed)
+
+        # The losses and the summary are of the last micro-batch
+        feed = self.train_feed(batch_size=batch_size)
+
         train_op = self.model.train_op
         total_loss_op = self.model.total_loss
         data_loss_op = self.model.data_loss
         reg_term_op = self.model.reg_term
-        summary_op = self.model.summary_op
-
-        _, total_loss, data_loss, reg_term, summary = self.sess.run(
-            [train_op, total_loss_op, data_loss_op, reg_term_op, summary_op], feed_dict=feed)
+        summary_op = self.model.summary_op if with_summary else self.model.train_scalars
+        run_kwargs = self.profiler.run_kwargs() if self.profiler is not None else dict()
+
+        # The compute phase includes the copy of the feed, the trace window of the profiler splits them
+        if self.collective is not None:
+            # The same averaged gradients are applied on every worker, the trainable variables stay in sync. The
+            # moving statistics of the batch norms update in the run of the gradients from the local batch and differ
+            # over the workers until sync_batchnorm
+            with phase(self.profiler, 'compute'):
+                grads, _, total_loss, data_loss, reg_term, summary = self.sess.run(
+                    [self.model.grads, self.model.bn_update_op, total_loss_op, data_loss_op, reg_term_op,
+                     summary_op], feed_dict=feed, **run_kwargs)
+            with phase(self.profiler, 'allreduce'):
+                grads = self.collective.all_reduce(grads)
+            apply_feed = dict(zip(self.model.grad_tfphs, grads))
+            apply_feed[self.model.lr_scale_tfph] = self.lr_scale
+            with phase(self.profiler, 'compute'):
+                self.sess.run(train_op, feed_dict=apply_feed)
+        else:
+            with phase(self.profiler, 'compute'):
+                _, total_loss, data_loss, reg_term, summary = self.sess.run(
+                    [train_op, total_loss_op, data_loss_op, reg_term_op, summary_op], feed_dict=feed, **run_kwargs)
 
         return total_loss, data_loss, reg_term, summary
 
+    def sync_schedule(self, should_stop=False):
+        # The chief decides on the plateau and the stop, the other workers follow it
+        lr_scale, stop = self.collective.broadcast([np.float32(self.lr_scale), np.float32(should_stop)])
+        self.lr_scale = float(lr_scale)
+        return bool(stop > 0.)
+
+    def prune(self, sparsity):
+        self.sess.run(self.model.prune_op, feed_dict={self.model.sparsity_tfph: sparsity})
+        return self.sess.run(self.model.sparsity_ops)
+
     def eval(self, batch_size=4):
         print(' [*] Evalute on the validation dataset...')
 
@@ -100,3 +194,52 @@ class Solver(object):
             # ############################################################################################################
 
         return preds_total, gts_total
+
+
+class Teacher(object):
+    def __init__(self, data, model_dir, use_batchnorm=False, name='ResNet18'):
+        self.model_dir = model_dir
+        self.graph = tf.Graph()     # Separate graph, the student owns the variables in the default graph
+
+        config = {'use_batchnorm': use_batchnorm}
+        config.update(utils.read_model_config(self.model_dir))
+        with self.graph.as_default():
+            self.model = ResNet18_Revised(input_shape=data.input_shape,
+                                          min_values=data.min_values,
+                                          max_values=data.max_values,
+                                          domain=data.domain,
+                                          num_attribute=data.num_attribute,
+                                          is_train=False,
+                                          inference_only=True,
+                                          with_metrics=False,
+                                          name=name,
+                                          domain_min_values=data.domain_min_values,
+                                          domain_max_values=data.domain_max_values,
+                                          **utils.model_kwargs(config))
+            self.sess = tf.compat.v1.Session(graph=self.graph)
+            self.saver = tf.compat.v1.train.Saver(max_to_keep=1)
+
+        flag, iter_time = self.load_model()
+        if flag is True:
+            print(' [!] Load teacher success! Iter: {}'.format(iter_time))
+        else:
+            exit(' [!] Failed to restore teacher model {}'.format(self.model_dir))
+
+    def predict(self, imgs):
+        # Normalized predictions, the same label space as the student
+        return self.sess.run(self.model.preds, feed_dict={self.model.img_tfph: imgs})
+
+    def load_model(self):
+        print(' [*] Reading teacher checkpoint...')
+
+        ckpt = tf.train.get_checkpoint_state(self.model_dir)
+        if ckpt and ckpt.model_checkpoint_path:
+            ckpt_name = os.path.basename(ckpt.model_checkpoint_path)
+            self.saver.restore(self.sess, os.path.join(self.model_dir, ckpt_name))
+
+            meta_graph_path = ckpt.model_checkpoint_path + '.meta'
+            iter_time = int(meta_graph_path.split('-')[-1].split('.')[0])
+
+            return True, iter_time
+        else:
+            return False, None
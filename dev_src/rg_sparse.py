@@ -0,0 +1,136 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Sparse (CSR) export of the pruned FC1 and FC2 layers
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import numpy as np
+import tensorflow as tf
+
+import utils as utils
+import numpy_utils as np_utils
+import tensorflow_utils as tf_utils
+from rg_dataset import Dataset
+from resnet import ResNet18_Revised
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '', 'gpu index of the latency measurement, empty for CPU only, default: ""')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('load_model', None, 'folder of the trained model to export (e.g. 20191222-230522), default: None')
+tf.flags.DEFINE_string('sparsity_levels', '0,50,80,90,95,98', 'sparsity levels in percent of the exported FC layers, '
+                                                              'levels above the trained sparsity are one-shot pruned, '
+                                                              'default: 0,50,80,90,95,98')
+tf.flags.DEFINE_integer('num_runs', 200, 'number of runs to measure the per-frame latency, default: 200')
+
+
+def main(_):
+    os.environ["CUDA_VISIBLE_DEVICES"] = FLAGS.gpu_index
+
+    if FLAGS.load_model is None:
+        exit(' [!] Please select the model folder with --load_model')
+
+    model_dir = os.path.join('../model', FLAGS.load_model)
+    ckpt = tf.train.get_checkpoint_state(model_dir)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        exit(' [!] Failed to find checkpoint in {}'.format(model_dir))
+
+    params = tf_utils.read_checkpoint(ckpt.model_checkpoint_path)
+    missing = [name for name in ['FC1', 'FC2'] if name + '/matrix' not in params]
+    if len(missing) > 0:
+        exit(' [!] {} has no dense {} weights, e.g. a low-rank factorized model, only dense heads are exported'
+             .format(model_dir, ' and '.join(missing)))
+
+    for name in ['FC1', 'FC2']:
+        if name + '/mask' in params:
+            params[name + '/matrix'] = params[name + '/matrix'] * params.pop(name + '/mask')
+
+    # The demo restores the checkpoint and, with sparse_fc, the npz of the CSR head on top of it
+    ckpt_prefix = os.path.basename(ckpt.model_checkpoint_path)
+    ckpt_bytes = sum(os.path.getsize(os.path.join(model_dir, file_name)) for file_name in os.listdir(model_dir)
+                     if file_name.startswith(ckpt_prefix + '.data') or file_name == ckpt_prefix + '.index')
+
+    data = Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, is_train=False)
+    imgs = 255. * np.random.randint(low=0, high=2, size=(1, *data.input_shape)).astype(np.float32)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        model = ResNet18_Revised(input_shape=data.input_shape,
+                                 min_values=data.min_values,
+                                 max_values=data.max_values,
+                                 domain=data.domain,
+                                 num_attribute=data.num_attribute,
+                                 is_train=False,
+                                 inference_only=True,
+                                 with_metrics=False,
+                                 domain_min_values=data.domain_min_values,
+                                 domain_max_values=data.domain_max_values,
+                                 **utils.model_kwargs(utils.read_model_config(model_dir)))
+        sess = tf.compat.v1.Session(graph=graph, config=tf_utils.session_config())
+        saver = tf.compat.v1.train.Saver()
+
+    feed = {model.img_tfph: imgs}
+
+    def dense_fn():
+        return sess.run(model.unnorm_preds, feed_dict=feed)
+
+    tic = time.time()
+    saver.restore(sess, ckpt.model_checkpoint_path)
+    dense_load_time = (time.time() - tic) * 1000.
+    dense_latency = measure_latency(dense_fn)
+
+    lines = list()
+    lines.append('Dense: checkpoint {:.2f} MB (incl. optimizer slots), load: {:.2f} msec, latency: {:.3f} msec per '
+                 'frame'.format(ckpt_bytes / 2 ** 20, dense_load_time, dense_latency))
+    lines.append('Sizes and load times are of the checkpoint and the npz restored by the demo, latencies are '
+                 'end-to-end, the conv trunk in tensorflow and the CSR head in numpy')
+    lines.append('')
+    lines.append('{:>9}{:>10}{:>10}{:>12}{:>12}{:>12}{:>14}{:>9}'.format(
+        'Sparsity', 'FC1', 'FC2', 'Head(MB)', 'Total(MB)', 'Load(ms)', 'Latency(ms)', 'Speedup'))
+
+    for level in utils.str_to_ints(FLAGS.sparsity_levels):
+        pruned = dict(params)
+        for name in ['FC1', 'FC2']:
+            pruned[name + '/matrix'] = np_utils.magnitude_prune(params[name + '/matrix'], level / 100.)
+
+        file_path = os.path.join(model_dir, 'fc_sparse_{:02d}.npz'.format(level))
+        np_utils.save_sparse_head(file_path, pruned)
+        head_bytes = os.path.getsize(file_path)
+
+        tic = time.time()
+        saver.restore(sess, ckpt.model_checkpoint_path)
+        head = np_utils.load_sparse_head(file_path)
+        load_time = (time.time() - tic) * 1000.
+
+        def sparse_fn():
+            features = sess.run(model.features, feed_dict=feed)
+            return np_utils.sparse_head_forward(head, features)
+
+        latency = measure_latency(sparse_fn)
+        lines.append('{:>8}%{:>10.2%}{:>10.2%}{:>12.2f}{:>12.2f}{:>12.2f}{:>14.3f}{:>8.2f}x'.format(
+            level, np.mean(pruned['FC1/matrix'] == 0.), np.mean(pruned['FC2/matrix'] == 0.), head_bytes / 2 ** 20,
+            (ckpt_bytes + head_bytes) / 2 ** 20, load_time, latency, dense_latency / latency))
+    sess.close()
+
+    with open(os.path.join(model_dir, 'fc_sparse_report.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    for line in lines:
+        print(line)
+
+
+def measure_latency(fn):
+    fn()    # warm-up
+    tic = time.time()
+    for _ in range(FLAGS.num_runs):
+        fn()
+    return (time.time() - tic) / FLAGS.num_runs * 1000.
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
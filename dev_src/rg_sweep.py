@@ -0,0 +1,270 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Local hyperparameter sweep of rg_main with CPU pinning, a shared data cache and asynchronous successive halving
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import itertools
+import subprocess
+import numpy as np
+from datetime import datetime
+import tensorflow as tf
+
+from rg_dataset import Dataset
+
+
+FLAGS = tf.flags.FLAGS
+tf.flags.DEFINE_string('gpu_index', '', 'gpu index of the trials, empty for CPU only, default: ""')
+tf.flags.DEFINE_integer('mode', 0, '0 for left-and-right input, 1 for only left image, 2 for only right image input, '
+                                   'default: 0')
+tf.flags.DEFINE_string('data', '03', 'data folder name[01: normal, 02: single, 03: 10N], default: 03')
+tf.flags.DEFINE_string('domain', 'xy', 'data domtain for [xy | rarb | all], default: xy')
+tf.flags.DEFINE_string('img_format', '.jpg', 'image format, default: .jpg')
+tf.flags.DEFINE_string('learning_rates', '1e-4,3e-4,1e-3', 'candidate initial learning rates, default: 1e-4,3e-4,1e-3')
+tf.flags.DEFINE_string('weight_decays', '1e-6,1e-5', 'candidate weight decays, default: 1e-6,1e-5')
+tf.flags.DEFINE_string('batch_sizes', '64,128', 'candidate batch sizes, default: 64,128')
+tf.flags.DEFINE_string('resize_factors', '0.5', 'candidate resize factors of the input images, default: 0.5')
+tf.flags.DEFINE_integer('num_samples', 0, 'number of configurations sampled from the grid, 0 for the full grid, '
+                                          'default: 0')
+tf.flags.DEFINE_integer('epoch', 50, 'number of epochs of a trial that is never stopped, default: 50')
+tf.flags.DEFINE_string('extra_flags', '', 'flags of rg_main shared by all trials, e.g. "--use_batchnorm=True", '
+                                          'default: ""')
+tf.flags.DEFINE_integer('cores_per_run', 4, 'cpu cores pinned to each trial, default: 4')
+tf.flags.DEFINE_integer('max_concurrent', 0, 'number of trials at the same time, 0 for all cores / cores_per_run, '
+                                             'default: 0')
+tf.flags.DEFINE_integer('reduction_factor', 3, 'only the best 1 / reduction_factor of the trials at a rung go on, '
+                                               'default: 3')
+tf.flags.DEFINE_integer('min_evals', 5, 'evaluations of the first rung, a trial has 100 evaluations in total, '
+                                        'default: 5')
+tf.flags.DEFINE_string('cache_dir', '../cache', 'folder of the preprocessed images shared by the trials, empty for '
+                                                'no cache, default: ../cache')
+tf.flags.DEFINE_float('poll_secs', 5., 'seconds between two checks of the trials, default: 5.')
+tf.flags.DEFINE_integer('seed', 0, 'random seed of the configuration sampling, default: 0')
+
+NUM_EVALS = 100     # rg_main evaluates every 1% of the iterations
+
+
+class SuccessiveHalving(object):
+    """Asynchronous successive halving, a trial goes past a rung only in the top 1 / eta of the trials at that rung."""
+    def __init__(self, min_evals=5, eta=3, max_evals=NUM_EVALS):
+        self.eta = eta
+        self.milestones = list()
+        milestone = min_evals
+        while milestone < max_evals:
+            self.milestones.append(milestone)
+            milestone *= eta
+        self.records = [list() for _ in self.milestones]   # best avg. error of the trials at each rung
+
+    def should_stop(self, trial):
+        # Each rung is judged once per trial, against the trials that reached it before
+        while trial['rung'] < len(self.milestones) and len(trial['errors']) >= self.milestones[trial['rung']]:
+            rung = trial['rung']
+            value = min(trial['errors'][:self.milestones[rung]])
+            self.records[rung].append(value)
+            trial['rung'] += 1
+
+            num_kept = len(self.records[rung]) // self.eta
+            if num_kept > 0 and value > sorted(self.records[rung])[num_kept - 1]:
+                return True
+
+        return False
+
+
+def main(_):
+    sweep_name = os.path.join('sweep', datetime.now().strftime("%Y%m%d-%H%M%S"))
+    log_dir = os.path.join('../log', sweep_name)
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    trials = [new_trial(idx, config, sweep_name) for idx, config in enumerate(sample_configs())]
+    slots = cpu_slots()
+    print(' [*] {} trials, {} at the same time on {} cores each'.format(len(trials), len(slots), FLAGS.cores_per_run))
+
+    # Preprocessed images of each input size, written once before the trials read them
+    if FLAGS.cache_dir:
+        for resize_factor in sorted(set(trial['config']['resize_factor'] for trial in trials)):
+            Dataset(data=FLAGS.data, mode=FLAGS.mode, domain=FLAGS.domain, img_format=FLAGS.img_format,
+                    resize_factor=resize_factor, is_train=True, log_dir=log_dir, cache_dir=FLAGS.cache_dir)
+
+    scheduler = SuccessiveHalving(min_evals=FLAGS.min_evals, eta=FLAGS.reduction_factor)
+    try:
+        run_trials(trials, slots, scheduler, log_dir)
+    finally:
+        # An interrupted sweep stops its trials, they save their resume state
+        for trial in trials:
+            if trial['process'] is not None and trial['process'].poll() is None:
+                trial['process'].terminate()
+                trial['process'].wait()
+                finish_trial(trial)
+        write_results(trials, log_dir)
+
+
+def sample_configs():
+    grid = [dict(zip(['learning_rate', 'weight_decay', 'batch_size', 'resize_factor'], values))
+            for values in itertools.product([float(value) for value in FLAGS.learning_rates.split(',')],
+                                            [float(value) for value in FLAGS.weight_decays.split(',')],
+                                            [int(value) for value in FLAGS.batch_sizes.split(',')],
+                                            [float(value) for value in FLAGS.resize_factors.split(',')])]
+
+    if 0 < FLAGS.num_samples < len(grid):
+        rng = np.random.RandomState(FLAGS.seed)
+        grid = [grid[idx] for idx in sorted(rng.choice(len(grid), size=FLAGS.num_samples, replace=False))]
+    return grid
+
+
+def new_trial(idx, config, sweep_name):
+    name = 'trial_{:03d}'.format(idx)
+    return {'name': name,
+            'config': config,
+            'run_name': os.path.join(sweep_name, name),
+            'metrics_path': os.path.join('../log', sweep_name, name, 'metrics.jsonl'),
+            'status': 'pending',
+            'rung': 0,
+            'errors': list(),
+            'steps': list(),
+            'process': None,
+            'start_time': None,
+            'end_time': None}
+
+
+def cpu_slots():
+    # Disjoint sets of cores, one per concurrent trial
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    cores_per_run = min(FLAGS.cores_per_run, len(cores))
+    num_slots = max(len(cores) // cores_per_run, 1)
+    if FLAGS.max_concurrent > 0:
+        num_slots = min(num_slots, FLAGS.max_concurrent)
+
+    return [cores[idx * cores_per_run:(idx + 1) * cores_per_run] for idx in range(num_slots)]
+
+
+def run_trials(trials, slots, scheduler, log_dir):
+    pending, running = list(trials), dict()     # running: {slot index: trial}
+    while len(pending) > 0 or len(running) > 0:
+        for slot, trial in list(running.items()):
+            trial['steps'], trial['errors'] = read_errors(trial['metrics_path'])
+            if trial['process'].poll() is not None:
+                finish_trial(trial)
+                del running[slot]
+            elif trial['status'] == 'running' and scheduler.should_stop(trial):
+                print(' [!] {} stopped at rung {}, best avg. error: {:.5f}'.format(
+                    trial['name'], trial['rung'], min(trial['errors'])))
+                trial['status'] = 'stopped'
+                trial['process'].terminate()    # SIGTERM, the trial saves its resume state and exits
+
+        for slot in range(len(slots)):
+            if slot not in running and len(pending) > 0:
+                running[slot] = pending.pop(0)
+                start_trial(running[slot], slots[slot], log_dir)
+
+        time.sleep(FLAGS.poll_secs)
+
+
+def start_trial(trial, cores, log_dir):
+    config = trial['config']
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rg_main.py')
+    command = [sys.executable, script_path,
+               '--gpu_index={}'.format(FLAGS.gpu_index),
+               '--mode={}'.format(FLAGS.mode),
+               '--data={}'.format(FLAGS.data),
+               '--domain={}'.format(FLAGS.domain),
+               '--img_format={}'.format(FLAGS.img_format),
+               '--learning_rate={}'.format(config['learning_rate']),
+               '--weight_decay={}'.format(config['weight_decay']),
+               '--batch_size={}'.format(config['batch_size']),
+               '--resize_factor={}'.format(config['resize_factor']),
+               '--epoch={}'.format(FLAGS.epoch),
+               '--run_name={}'.format(trial['run_name']),
+               '--metrics_sinks=jsonl',
+               '--flush_secs=1',
+               '--cache_dir={}'.format(FLAGS.cache_dir)] + FLAGS.extra_flags.split()
+    if not FLAGS.cache_dir:
+        command.remove('--cache_dir=')
+
+    env = dict(os.environ, OMP_NUM_THREADS=str(len(cores)))
+    preexec_fn = (lambda: os.sched_setaffinity(0, cores)) if hasattr(os, 'sched_setaffinity') else None
+    log_file = open(os.path.join(log_dir, trial['name'] + '.txt'), 'a')
+    trial['process'] = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env=env,
+                                        preexec_fn=preexec_fn, cwd=os.path.dirname(script_path))
+    trial['status'] = 'running'
+    trial['start_time'] = time.time()
+    print(' [*] {} started on cores {}: {}'.format(trial['name'], cores, json.dumps(config, sort_keys=True)))
+
+
+def finish_trial(trial):
+    trial['end_time'] = time.time()
+    trial['steps'], trial['errors'] = read_errors(trial['metrics_path'])
+    if trial['status'] == 'running':
+        trial['status'] = 'completed' if trial['process'].returncode == 0 else 'failed'
+
+    best = '{:.5f}'.format(min(trial['errors'])) if len(trial['errors']) > 0 else '-'
+    print(' [*] {} {}, evaluations: {}, best avg. error: {}'.format(
+        trial['name'], trial['status'], len(trial['errors']), best))
+
+
+def read_errors(metrics_path):
+    # Eval/avg_err records of the metrics.jsonl of a trial, a resumed trial writes some steps again
+    errors = dict()
+    if os.path.isfile(metrics_path):
+        with open(metrics_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue    # line in writing
+                if 'Eval/avg_err' in record:
+                    errors[record['step']] = record['Eval/avg_err']
+
+    steps = sorted(errors)
+    return steps, [errors[step] for step in steps]
+
+
+def write_results(trials, log_dir):
+    results = list()
+    for trial in trials:
+        best_idx = int(np.argmin(trial['errors'])) if len(trial['errors']) > 0 else None
+        hours = (trial['end_time'] - trial['start_time']) / 3600. if trial['end_time'] is not None else 0.
+        results.append({'name': trial['name'],
+                        'config': trial['config'],
+                        'status': trial['status'],
+                        'rung': trial['rung'],
+                        'num_evals': len(trial['errors']),
+                        'best_avg_err': trial['errors'][best_idx] if best_idx is not None else None,
+                        'best_step': trial['steps'][best_idx] if best_idx is not None else None,
+                        'hours': hours,
+                        'run_name': trial['run_name']})
+    results = sorted(results, key=lambda result: (result['best_avg_err'] is None, result['best_avg_err']))
+
+    lines = list()
+    lines.append('{:<11}{:>11}{:>6}{:>7}{:>10}{:>10}{:>8}  {}'.format(
+        'Name', 'Status', 'Rung', 'Evals', 'Best err', 'Best iter', 'Hours', 'Config'))
+    for result in results:
+        best_avg_err = '{:>10.5f}'.format(result['best_avg_err']) if result['best_avg_err'] is not None \
+            else '{:>10}'.format('-')
+        lines.append('{:<11}{:>11}{:>6}{:>7}{}{:>10}{:>8.2f}  {}'.format(
+            result['name'], result['status'], result['rung'], result['num_evals'], best_avg_err,
+            result['best_step'] if result['best_step'] is not None else '-', result['hours'],
+            json.dumps(result['config'], sort_keys=True)))
+
+    total_hours = sum(result['hours'] for result in results) * FLAGS.cores_per_run
+    lines.append('Trials: {}, stopped early: {}, core-hours: {:.2f}'.format(
+        len(results), sum(result['status'] == 'stopped' for result in results), total_hours))
+
+    with open(os.path.join(log_dir, 'sweep.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    with open(os.path.join(log_dir, 'sweep.json'), 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+    for line in lines:
+        print(line)
+    if len(results) > 0 and results[0]['best_avg_err'] is not None:
+        print(' [!] Best trial {}, model in ../model/{}'.format(results[0]['name'], results[0]['run_name']))
+
+
+if __name__ == '__main__':
+    tf.compat.v1.app.run()
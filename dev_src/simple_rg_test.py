@@ -36,7 +36,8 @@ def main(_):
                              min_values=data.min_values,
                              max_values=data.max_values,
                              domain=FLAGS.domain,
-                             is_train=False)
+                             is_train=False,
+                             inference_only=True)
 
     # Initialize solver
     solver = Solver(model, data)
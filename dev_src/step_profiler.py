@@ -0,0 +1,100 @@
+# --------------------------------------------------------------------------
+# Tensorflow Implementation of Tacticle Sensor Project
+# Step-time breakdown of the training loop with rolling percentiles, throughput and the data-stall fraction
+# Licensed under The MIT License [see LICENSE for details]
+# Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
+# --------------------------------------------------------------------------
+import os
+import time
+import contextlib
+import collections
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class StepProfiler(object):
+    """Wall time of the phases of each training step over a rolling window of steps."""
+    def __init__(self, window=100, log_dir=None, trace_start=0, trace_steps=0):
+        self.window = window
+        self.log_dir = log_dir
+        self.trace_start = trace_start      # steps [trace_start, trace_start + trace_steps) write a chrome trace
+        self.trace_steps = trace_steps
+        self.steps = collections.deque(maxlen=window)  # (step time, num. of samples, {phase: duration})
+        self.step, self.step_start = 0, None
+        self.durations = collections.defaultdict(float)
+        self.run_metadata = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - tic
+
+    def start_step(self, step):
+        self.step = step
+        self.durations = collections.defaultdict(float)
+        self.step_start = time.perf_counter()
+
+    def end_step(self, num_samples):
+        step_time = time.perf_counter() - self.step_start
+        durations = dict(self.durations)
+        durations['other'] = max(step_time - sum(durations.values()), 0.)  # pruning, console and loop overhead
+        self.steps.append((step_time, num_samples, durations))
+
+        if self.run_metadata is not None:
+            self._write_trace()
+
+    @property
+    def is_tracing(self):
+        return self.trace_steps > 0 and self.trace_start <= self.step < self.trace_start + self.trace_steps
+
+    def run_kwargs(self):
+        # Options of the sess.run of the update, a full trace only in the trace window
+        if not self.is_tracing:
+            return dict()
+
+        self.run_metadata = tf.compat.v1.RunMetadata()
+        return {'options': tf.compat.v1.RunOptions(trace_level=tf.compat.v1.RunOptions.FULL_TRACE),
+                'run_metadata': self.run_metadata}
+
+    def _write_trace(self):
+        trace = timeline.Timeline(self.run_metadata.step_stats).generate_chrome_trace_format()
+        with open(os.path.join(self.log_dir, 'step_trace_{}.json'.format(self.step)), 'w') as f:
+            f.write(trace)
+        self.run_metadata = None
+
+    def summary(self):
+        # Percentiles in msec of every phase, the data stall is the share of the step time spent on the input
+        step_times = np.asarray([step[0] for step in self.steps])
+        phases = sorted(set(phase for step in self.steps for phase in step[2]))
+        durations = {phase: np.asarray([step[2].get(phase, 0.) for step in self.steps]) for phase in phases}
+
+        result = {'samples_per_sec': sum(step[1] for step in self.steps) / max(np.sum(step_times), 1e-12),
+                  'data_stall': np.sum(durations.get('data', 0.)) / max(np.sum(step_times), 1e-12)}
+        for phase, values in [('step', step_times)] + list(durations.items()):
+            for q in [50, 90, 99]:
+                result['{}_p{}_ms'.format(phase, q)] = float(np.percentile(values, q) * 1000.)
+        return result
+
+    def scalars(self):
+        return {'Profile/' + key: value for key, value in self.summary().items()}
+
+    def report(self):
+        summary = self.summary()
+        phases = sorted(key[:-len('_p50_ms')] for key in summary if key.endswith('_p50_ms') and key != 'step_p50_ms')
+        lines = ['Step profile of the last {} steps: {:.1f} samples/s, data stall: {:.1%}, step p50 / p90 / p99: '
+                 '{:.2f} / {:.2f} / {:.2f} msec'.format(len(self.steps), summary['samples_per_sec'],
+                                                         summary['data_stall'], summary['step_p50_ms'],
+                                                         summary['step_p90_ms'], summary['step_p99_ms'])]
+        for phase in phases:
+            lines.append('  {:<11}{:>10.2f}{:>10.2f}{:>10.2f} msec'.format(
+                phase, summary[phase + '_p50_ms'], summary[phase + '_p90_ms'], summary[phase + '_p99_ms']))
+        return '\n'.join(lines)
+
+
+def phase(profiler, name):
+    # Timed block of a phase, nothing without a profiler
+    return profiler.phase(name) if profiler is not None else contextlib.nullcontext()
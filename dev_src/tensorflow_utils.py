@@ -5,11 +5,69 @@
 # Email: sbkim0407@gmail.com
 # Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
 # ---------------------------------------------------------
+import os
 import functools
 import numpy as np
 import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
+from tensorflow.python.framework import smart_cond
 from tensorflow.python.training import moving_averages
 
+# Layout of the 4-D activations, NCHW runs the cuDNN / MKL kernels without the internal transposes
+DATA_FORMAT = 'NHWC'
+
+
+def set_data_format(data_format='NHWC'):
+    global DATA_FORMAT
+    if data_format not in ['NHWC', 'NCHW']:
+        raise NotImplementedError
+    DATA_FORMAT = data_format
+
+
+def to_format(values):
+    # [batch, height, width, channel] ordered values (strides, ksize, paddings) in the current layout
+    if DATA_FORMAT == 'NCHW':
+        return [values[0], values[3], values[1], values[2]]
+    return list(values)
+
+
+def channel_axis():
+    return 1 if DATA_FORMAT == 'NCHW' else 3
+
+
+def spatial_axes():
+    return [2, 3] if DATA_FORMAT == 'NCHW' else [1, 2]
+
+
+def enable_xla_cpu_jit():
+    # Global JIT on CPU is only enabled by the XLA flags, read when the first session compiles. Called once at the
+    # start of the program, before the first session with session_config(use_xla=True)
+    if '--tf_xla_cpu_global_jit' not in os.environ.get('TF_XLA_FLAGS', ''):
+        os.environ['TF_XLA_FLAGS'] = (os.environ.get('TF_XLA_FLAGS', '') + ' --tf_xla_cpu_global_jit').strip()
+
+
+def session_config(use_xla=False, cpu_only=False, num_threads=0):
+    # XLA JIT clustering and the aggressive Grappler passes, the default session settings otherwise. The CPU also
+    # needs enable_xla_cpu_jit() for the JIT, this function has no side effects
+    config = tf.compat.v1.ConfigProto()
+    if cpu_only:
+        config.device_count['GPU'] = 0
+    if num_threads > 0:
+        # Cores of one data-parallel worker, 0 for all cores of the host
+        config.intra_op_parallelism_threads = num_threads
+
+    if use_xla:
+        config.graph_options.optimizer_options.global_jit_level = tf.compat.v1.OptimizerOptions.ON_1
+
+        rewrite_options = config.graph_options.rewrite_options
+        rewrite_options.constant_folding = rewriter_config_pb2.RewriterConfig.ON
+        rewrite_options.layout_optimizer = rewriter_config_pb2.RewriterConfig.ON
+        rewrite_options.remapping = rewriter_config_pb2.RewriterConfig.ON
+        rewrite_options.arithmetic_optimization = rewriter_config_pb2.RewriterConfig.AGGRESSIVE
+        rewrite_options.dependency_optimization = rewriter_config_pb2.RewriterConfig.AGGRESSIVE
+
+    return config
+
 
 def padding2d(x, p_h=1, p_w=1, pad_type='REFLECT', name='pad2d'):
     if pad_type == 'REFLECT':
@@ -28,12 +86,77 @@ def conv2d(x, output_dim, k_h=5, k_w=5, d_h=2, d_w=2, stddev=0.02, initializer=N
         else:
             raise NotImplementedError
 
-        w = tf.compat.v1.get_variable('w', [k_h, k_w, x.get_shape()[-1], output_dim], initializer=init_op)
-        conv = tf.nn.conv2d(x, w, strides=[1, d_h, d_w, 1], padding=padding)
+        w = tf.compat.v1.get_variable('w', [k_h, k_w, x.get_shape()[channel_axis()], output_dim], initializer=init_op)
+        conv = tf.nn.conv2d(x, w, strides=to_format([1, d_h, d_w, 1]), padding=padding, data_format=DATA_FORMAT)
 
         biases = tf.compat.v1.get_variable('biases', [output_dim], initializer=tf.compat.v1.constant_initializer(0.0))
         # conv = tf.reshape(tf.nn.bias_add(conv, biases), conv.get_shape())
-        conv = tf.nn.bias_add(conv, biases, name='add')
+        conv = tf.nn.bias_add(conv, biases, data_format=DATA_FORMAT, name='add')
+
+        if is_print:
+            print_activations(conv, logger)
+
+        return conv
+
+
+def depthwise_conv2d(x, k_h=3, k_w=3, d_h=1, d_w=1, channel_multiplier=1, stddev=0.02, initializer=None,
+                     padding='SAME', name='depthwise_conv2d', is_print=True, logger=None):
+    with tf.compat.v1.variable_scope(name):
+        if initializer is None:
+            init_op = tf.truncated_normal_initializer(stddev=stddev)
+        elif initializer.lower() == 'he':
+            init_op = tf.compat.v1.initializers.he_normal()
+        elif initializer.lower() == 'xavier':
+            init_op = tf.contrib.layers.xavier_initializer()
+        else:
+            raise NotImplementedError
+
+        input_dim = x.get_shape().as_list()[channel_axis()]
+        w = tf.compat.v1.get_variable('w', [k_h, k_w, input_dim, channel_multiplier], initializer=init_op)
+        conv = tf.nn.depthwise_conv2d(x, w, strides=to_format([1, d_h, d_w, 1]), padding=padding,
+                                      data_format=DATA_FORMAT)
+
+        biases = tf.compat.v1.get_variable('biases', [input_dim * channel_multiplier],
+                                           initializer=tf.compat.v1.constant_initializer(0.0))
+        conv = tf.nn.bias_add(conv, biases, data_format=DATA_FORMAT, name='add')
+
+        if is_print:
+            print_activations(conv, logger)
+
+        return conv
+
+
+def binarize(x, name='binarize'):
+    # sign(x) in the forward pass, straight-through estimator with the gradient clipped to |x| <= 1 in the backward
+    with tf.compat.v1.name_scope(name):
+        clipped = tf.clip_by_value(x, -1., 1.)
+        return clipped + tf.stop_gradient(tf.where(x >= 0., tf.ones_like(x), -tf.ones_like(x)) - clipped)
+
+
+def binary_conv2d(x, output_dim, k_h=3, k_w=3, d_h=1, d_w=1, stddev=0.02, initializer=None, name='binary_conv2d',
+                  is_print=True, logger=None):
+    # Binary weights alpha * sign(w) on binary inputs, padded with -1 so that the XNOR kernels give the same output
+    with tf.compat.v1.variable_scope(name):
+        if initializer is None:
+            init_op = tf.truncated_normal_initializer(stddev=stddev)
+        elif initializer.lower() == 'he':
+            init_op = tf.compat.v1.initializers.he_normal()
+        elif initializer.lower() == 'xavier':
+            init_op = tf.contrib.layers.xavier_initializer()
+        else:
+            raise NotImplementedError
+
+        w = tf.compat.v1.get_variable('w', [k_h, k_w, x.get_shape()[channel_axis()], output_dim], initializer=init_op)
+        alpha = tf.stop_gradient(tf.math.reduce_mean(tf.math.abs(w), axis=[0, 1, 2]))
+        binary_w = alpha * binarize(w)
+
+        pads = to_format([[0, 0], [(k_h - 1) // 2, k_h - 1 - (k_h - 1) // 2],
+                          [(k_w - 1) // 2, k_w - 1 - (k_w - 1) // 2], [0, 0]])
+        conv = tf.nn.conv2d(tf.pad(x, pads, constant_values=-1.), binary_w, strides=to_format([1, d_h, d_w, 1]),
+                            padding='VALID', data_format=DATA_FORMAT)
+
+        biases = tf.compat.v1.get_variable('biases', [output_dim], initializer=tf.compat.v1.constant_initializer(0.0))
+        conv = tf.nn.bias_add(conv, biases, data_format=DATA_FORMAT, name='add')
 
         if is_print:
             print_activations(conv, logger)
@@ -91,11 +214,17 @@ def upsampling2d(x, size=(2, 2), name='upsampling2d'):
         shape = x.get_shape().as_list()
         return tf.image.resize_nearest_neighbor(x, size=(size[0] * shape[1], size[1] * shape[2]))
 
-def flatten(x, name='flatten', data_format='channels_last', is_print=True, logger=None):
+def flatten(x, name='flatten', data_format=None, is_print=True, logger=None):
+    # channels_first inputs are flattened in the channels_last order, the FC weights do not depend on the layout
+    if data_format is None:
+        data_format = 'channels_first' if DATA_FORMAT == 'NCHW' else 'channels_last'
+
     try:
         output = tf.layers.flatten(inputs=x, name=name, data_format=data_format)
     except(RuntimeError, TypeError, NameError):
         print('[*] Catch the flatten function Error!')
+        if data_format == 'channels_first':
+            x = tf.transpose(x, [0, 2, 3, 1])
         output = tf.contrib.layers.flatten(inputs=x, scope=name)
 
     if is_print:
@@ -103,8 +232,8 @@ def flatten(x, name='flatten', data_format='channels_last', is_print=True, logge
     return output
 
 
-def linear(x, output_size, bias_start=0.0, stddev=0.02, initializer=None, name='fc', with_w=False,
-           is_print=True, logger=None):
+def linear(x, output_size, bias_start=0.0, stddev=0.02, initializer=None, name='fc', with_w=False, use_mask=False,
+           rank=None, is_print=True, logger=None):
     shape = x.get_shape().as_list()
 
     with tf.compat.v1.variable_scope(name):
@@ -117,10 +246,37 @@ def linear(x, output_size, bias_start=0.0, stddev=0.02, initializer=None, name='
         else:
             raise NotImplementedError
 
+        if rank is not None:
+            # Low-rank factorization matrix = matrix_u x matrix_v, two thin matmuls instead of one
+            matrix_u = tf.compat.v1.get_variable(name="matrix_u", shape=[shape[1], rank],
+                                                 dtype=tf.float32, initializer=init_op)
+            matrix_v = tf.compat.v1.get_variable(name="matrix_v", shape=[rank, output_size],
+                                                 dtype=tf.float32, initializer=init_op)
+            bias = tf.compat.v1.get_variable(name="bias", shape=[output_size],
+                                             initializer=tf.compat.v1.constant_initializer(bias_start))
+            output = tf.matmul(tf.matmul(x, matrix_u), matrix_v) + bias
+
+            if is_print:
+                print_activations(output, logger)
+
+            if with_w:
+                return output, tf.matmul(matrix_u, matrix_v), bias
+            else:
+                return output
+
         matrix = tf.compat.v1.get_variable(name="matrix", shape=[shape[1], output_size],
                                            dtype=tf.float32, initializer=init_op)
         bias = tf.compat.v1.get_variable(name="bias", shape=[output_size],
                                          initializer=tf.compat.v1.constant_initializer(bias_start))
+
+        if use_mask:
+            # Binary pruning mask of the weights
+            mask = tf.compat.v1.get_variable(name="mask", shape=[shape[1], output_size], dtype=tf.float32,
+                                             initializer=tf.compat.v1.constant_initializer(1.0), trainable=False)
+            tf.compat.v1.add_to_collection('pruning_weights', matrix)
+            tf.compat.v1.add_to_collection('pruning_masks', mask)
+            matrix = matrix * mask
+
         output = tf.matmul(x, matrix) + bias
 
         if is_print:
@@ -132,45 +288,63 @@ def linear(x, output_size, bias_start=0.0, stddev=0.02, initializer=None, name='
             return output
 
 
-def norm(x, name, _type, _ops, is_train=True, is_print=True, logger=None):
+def norm(x, name, _type, _ops, is_train=True, fused=False, is_print=True, logger=None):
     if _type == 'batch':
-        return batch_norm(x, name=name, _ops=_ops, is_train=is_train, is_print=is_print, logger=logger)
+        return batch_norm(x, name=name, _ops=_ops, is_train=is_train, fused=fused, is_print=is_print, logger=logger)
     elif _type == 'instance':
         return instance_norm(x, name=name, is_print=is_print, logger=logger)
     else:
         raise NotImplementedError
 
 
-def batch_norm(x, name, _ops, is_train=True, is_print=True, logger=None):
+def batch_norm(x, name, _ops, is_train=True, fused=False, is_print=True, logger=None):
     """Batch normalization."""
     with tf.compat.v1.variable_scope(name):
-        params_shape = [x.get_shape()[-1]]
+        params_shape = [x.get_shape()[channel_axis()]]
 
         beta = tf.compat.v1.get_variable('beta', params_shape, tf.float32,
                                initializer=tf.compat.v1.constant_initializer(0.0))
         gamma = tf.compat.v1.get_variable('gamma', params_shape, tf.float32,
                                 initializer=tf.compat.v1.constant_initializer(1.0))
 
-        if is_train is True:
-            mean, variance = tf.nn.moments(x, [0, 1, 2], name='moments')
+        moving_mean = tf.compat.v1.get_variable('moving_mean', params_shape, tf.float32,
+                                                initializer=tf.compat.v1.constant_initializer(0.0), trainable=False)
+        moving_variance = tf.compat.v1.get_variable('moving_variance', params_shape, tf.float32,
+                                                    initializer=tf.compat.v1.constant_initializer(1.0), trainable=False)
+
+        def normalize(mean, variance, is_training):
+            if fused:
+                # Moments and normalization in one kernel
+                if is_training:
+                    return tf.compat.v1.nn.fused_batch_norm(x, gamma, beta, epsilon=1e-5, data_format=DATA_FORMAT,
+                                                            is_training=True)
+                y, _, _ = tf.compat.v1.nn.fused_batch_norm(x, gamma, beta, mean=mean, variance=variance, epsilon=1e-5,
+                                                           data_format=DATA_FORMAT, is_training=False)
+                return y, tf.identity(mean), tf.identity(variance)
+
+            if is_training:
+                mean, variance = tf.nn.moments(x, [0] + spatial_axes(), name='moments')
+            shape = [-1, 1, 1] if DATA_FORMAT == 'NCHW' else [-1]  # per-channel values over [channel, height, width]
+            # epsilon used to be 1e-5. Maybe 0.001 solves NaN problem in deeper net.
+            y = tf.nn.batch_normalization(x, tf.reshape(mean, shape), tf.reshape(variance, shape),
+                                          tf.reshape(beta, shape), tf.reshape(gamma, shape), 1e-5)
+            return y, tf.identity(mean), tf.identity(variance)
+
+        def train_fn():
+            return normalize(None, None, is_training=True)
+
+        def inference_fn():
+            return normalize(moving_mean, moving_variance, is_training=False)
+
+        # Batch statistics for training and moving statistics for inference, a bool placeholder selects them at run
+        # time and a python bool at graph construction
+        y, mean, variance = smart_cond.smart_cond(is_train, train_fn, inference_fn)
+
+        if is_train is not False:
+            # The moving statistics stay as they are in inference mode, their update moves them to themselves
+            _ops.append(moving_averages.assign_moving_average(moving_mean, mean, 0.9, zero_debias=False))
+            _ops.append(moving_averages.assign_moving_average(moving_variance, variance, 0.9, zero_debias=False))
 
-            moving_mean = tf.compat.v1.get_variable('moving_mean', params_shape, tf.float32,
-                                          initializer=tf.compat.v1.constant_initializer(0.0),
-                                          trainable=False)
-            moving_variance = tf.compat.v1.get_variable('moving_variance', params_shape, tf.float32,
-                                              initializer=tf.compat.v1.constant_initializer(1.0),
-                                              trainable=False)
-
-            _ops.append(moving_averages.assign_moving_average(moving_mean, mean, 0.9))
-            _ops.append(moving_averages.assign_moving_average(moving_variance, variance, 0.9))
-        else:
-            mean = tf.compat.v1.get_variable('moving_mean', params_shape, tf.float32,
-                initializer=tf.compat.v1.constant_initializer(0.0), trainable=False)
-            variance = tf.compat.v1.get_variable('moving_variance', params_shape, tf.float32,
-                initializer=tf.compat.v1.constant_initializer(1.0), trainable=False)
-
-        # epsilon used to be 1e-5. Maybe 0.001 solves NaN problem in deeper net.
-        y = tf.nn.batch_normalization(x, mean, variance, beta, gamma, 1e-5)
         y.set_shape(x.get_shape())
 
         if is_print:
@@ -311,7 +485,8 @@ def identity(x, name='identity', is_print=True, logger=None):
 
 
 def max_pool(x, name='max_pool', ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], is_print=True, logger=None):
-    output = tf.nn.max_pool2d(x, ksize=ksize, strides=strides, padding='SAME', name=name)
+    output = tf.nn.max_pool2d(x, ksize=to_format(ksize), strides=to_format(strides), padding='SAME',
+                              data_format=DATA_FORMAT, name=name)
     if is_print:
         print_activations(output, logger)
 
@@ -319,7 +494,8 @@ def max_pool(x, name='max_pool', ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], is_pr
 
 
 def avg_pool(x, name='avg_pool', ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], is_print=True, logger=None):
-    output = tf.nn.avg_pool2d(x, ksize=ksize, strides=strides, padding='VALID', name=name)
+    output = tf.nn.avg_pool2d(x, ksize=to_format(ksize), strides=to_format(strides), padding='VALID',
+                              data_format=DATA_FORMAT, name=name)
     if is_print:
         print_activations(output, logger)
 
@@ -421,6 +597,29 @@ def show_all_variables(logger=None, scope=None):
         logger.info("[Total] variable size: %s" % "{:,}".format(total_count))
 
 
+def read_checkpoint(ckpt_path, name='ResNet18'):
+    # Forward variables of the model as numpy arrays, Adam slots and the global step are dropped
+    reader = tf.train.load_checkpoint(ckpt_path)
+    params = dict()
+    for var_name in reader.get_variable_to_shape_map():
+        if var_name.startswith(name + '/') and not var_name.split('/')[-1].startswith('Adam'):
+            params[var_name[len(name) + 1:]] = reader.get_tensor(var_name)
+
+    return params
+
+
+def assign_variables(sess, params, name='ResNet18'):
+    # Loads numpy arrays of read_checkpoint into the variables of the model with the same names
+    num_assigned = 0
+    for variable in tf.compat.v1.global_variables():
+        key = variable.op.name[len(name) + 1:]
+        if variable.op.name.startswith(name + '/') and key in params:
+            variable.load(params[key], sess)
+            num_assigned += 1
+
+    return num_assigned
+
+
 def batch_convert2int(images):
     # images: 4D float tensor (batch_size, image_size, image_size, depth)
     return tf.map_fn(convert2int, images, dtype=tf.uint8)
@@ -7,6 +7,8 @@
 # Re-used for Vision-based tactile sensor mechanism for the estimation of contact position and force distribution using deep learning
 # --------------------------------------------------------------------------
 import os
+import json
+import time
 import logging
 import numpy as np
 
@@ -72,3 +74,99 @@ def read_label(img_path, img_format='.jpg'):
 
     return np.asarray([X, Y, Ra, Rb, F, D])
 
+
+def write_model_config(model_dir, config, file_name='model_config.json'):
+    # Architecture of the saved model, the demo loader rebuilds the same graph from it
+    with open(os.path.join(model_dir, file_name), 'w') as f:
+        json.dump(config, f, indent=4, sort_keys=True)
+
+
+def read_model_config(model_dir, file_name='model_config.json'):
+    config_path = os.path.join(model_dir, file_name)
+    if not os.path.isfile(config_path):
+        return dict()   # models trained before the config file use the default architecture
+
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def model_kwargs(config):
+    # Architecture arguments of ResNet18_Revised in a model config, missing keys keep the defaults of the model
+    keys = ['use_batchnorm', 'layers', 'filters', 'inner_filters', 'fc_ranks', 'exit_heads', 'stem', 'stem_filters',
+            'head', 'block_type', 'expansion', 'binary_layers']
+    return {key: config[key] for key in keys if key in config}
+
+
+# Checkpoints of rg_main --async_eval in <model_dir>/snapshots, scored by rg_evaluator until the done file exists
+SNAPSHOT_FOLDER = 'snapshots'
+SNAPSHOT_DONE_FILE = 'train_done'
+
+
+def write_best_record(model_dir, record, file_name='best.json'):
+    # Best model of rg_evaluator, replaced in one step since the training loop reads it at any time
+    tmp_path = os.path.join(model_dir, file_name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, os.path.join(model_dir, file_name))
+
+
+def read_best_record(model_dir, file_name='best.json'):
+    record_path = os.path.join(model_dir, file_name)
+    if not os.path.isfile(record_path):
+        return None
+
+    with open(record_path, 'r') as f:
+        return json.load(f)
+
+
+class PlateauMonitor(object):
+    """Early stopping, reduce-on-plateau and time budget on the validation avg. error."""
+    def __init__(self, patience=0, plateau_patience=0, factor=0.5, min_lr_scale=0.01, min_delta=0., time_budget=0.):
+        self.patience = patience                    # evaluations without improvement before the stop, 0 for never
+        self.plateau_patience = plateau_patience    # evaluations without improvement before the learning rate drops
+        self.factor = factor
+        self.min_lr_scale = min_lr_scale
+        self.min_delta = min_delta                  # relative improvement that counts
+        self.time_budget = time_budget              # hours, 0 for no budget
+        self.start_time = time.time()
+        self.best_err = np.inf
+        self.num_bad_evals, self.num_plateau_evals = 0, 0
+        self.lr_scale = 1.
+
+    def update(self, avg_err):
+        # Returns True when there is nothing left to gain
+        if avg_err < self.best_err * (1. - self.min_delta):
+            self.best_err = avg_err
+            self.num_bad_evals, self.num_plateau_evals = 0, 0
+            return False
+
+        self.num_bad_evals += 1
+        self.num_plateau_evals += 1
+        if (self.plateau_patience > 0) and (self.num_plateau_evals >= self.plateau_patience) and \
+                (self.lr_scale > self.min_lr_scale):
+            self.lr_scale = max(self.lr_scale * self.factor, self.min_lr_scale)
+            self.num_plateau_evals = 0
+
+        return (self.patience > 0) and (self.num_bad_evals >= self.patience)
+
+    def over_budget(self):
+        return (self.time_budget > 0.) and ((time.time() - self.start_time) / 3600. >= self.time_budget)
+
+    def state_dict(self):
+        return {'best_err': float(self.best_err),
+                'num_bad_evals': self.num_bad_evals,
+                'num_plateau_evals': self.num_plateau_evals,
+                'lr_scale': self.lr_scale,
+                'elapsed_hours': (time.time() - self.start_time) / 3600.}
+
+    def load_state_dict(self, state):
+        # The time budget also counts the hours before the resume
+        self.best_err = state['best_err']
+        self.num_bad_evals = state['num_bad_evals']
+        self.num_plateau_evals = state['num_plateau_evals']
+        self.lr_scale = state['lr_scale']
+        self.start_time = time.time() - state['elapsed_hours'] * 3600.
+
+
+def str_to_ints(value):
+    return [int(item) for item in value.split(',') if item.strip() != '']